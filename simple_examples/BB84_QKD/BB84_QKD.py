@@ -1,18 +1,28 @@
+from amplification import PrivacyAmplifier
 import argparse
 from cqc.pythonLib import CQCConnection, CQCNoQubitError, qubit
 import logging
 import numpy as np
 from numpy.random import binomial
 import os
+from reconciliation import Cascade, LDPC, LDPC_BLOCK_SIZE
 import time
 from simulaqron.network import Network
 from simulaqron.settings import simulaqron_settings
-from threading import Thread, Event
+import sys
+from threading import Condition, Thread
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'sims'))
+import utils
 
 FORMAT = "%(levelname)s: %(message)s"
 STATES = [["|0>", "|1>"], ["|+>", "|->"]]
 NETWORK_NAME = "BB84_QKD"
 ALICE_WAIT = 1#s
+SEND_APP_ID = 0  # CQC application IDs of connections sending qubits ...
+RECV_APP_ID = 1  # ... and receiving them, so a relay node can do both
+BACKOFF_WAIT = 0.01#s
 
 
 class ThreadManager:
@@ -21,7 +31,7 @@ class ThreadManager:
     corresponding results.
     """
 
-    def __init__(self, n_qubits, noisy, t1):
+    def __init__(self, n_qubits, noisy, t1, window=1):
         """
         Create new ThreadManager for n qubit BB84. Create empty arrays for 
         storing bases and measurements, initialising to -1 as this is an 
@@ -33,6 +43,8 @@ class ThreadManager:
         noisy -- a boolean value indicating whether noisy qubits should be 
         simulated
         t1 - the simulated coherence time of the qubits
+        window -- the number of qubits allowed in flight between Alice and 
+        Bob, None for as many as a node can hold
         """
         self.n_qubits = n_qubits
         
@@ -40,18 +52,11 @@ class ThreadManager:
         self.bob_results   = -1*np.ones((2, n_qubits))
 
         # control qubit flow
-        self.sent_to_eve_event = Event()
-        self.sent_to_bob_event = Event()
-        self.sent_to_bob_event.set()
-
-        logging.info("NETWORK: Turning noisy-qubits %s.", 
-                    ["off","on"][noisy])
-        self.orig_noise_state = simulaqron_settings.noisy_qubits
-        simulaqron_settings.noisy_qubits = noisy
+        self.window = QubitWindow(window_size(window))
+        logging.info("TM     : Allowing %d qubits in flight.", 
+                     self.window.size)
 
-        self.orig_t1_value = simulaqron_settings.t1
-        if t1 is not None:
-            simulaqron_settings.t1 = t1
+        self.orig_noise_state, self.orig_t1_value = set_noise(noisy, t1)
 
         self.network = init_network()
 
@@ -68,16 +73,14 @@ class ThreadManager:
         self.alice_thread = Thread(target=alice, 
                                    args=(self.n_qubits, 
                                          self.alice_results,
-                                         self.sent_to_eve_event,
-                                         self.sent_to_bob_event,))
+                                         self.window,))
         time.sleep(ALICE_WAIT)  # Allow Alice time to establish connection 
         self.bob_thread   = Thread(target=bob  , 
                                    args=(self.n_qubits,
-                                         self.bob_results,))
+                                         self.bob_results,
+                                         self.window,))
         self.eve_thread   = Thread(target=eve  , 
                                    args=(self.n_qubits,
-                                         self.sent_to_eve_event,
-                                         self.sent_to_bob_event,
                                          eavesdrop,))
 
         self.alice_thread.start()
@@ -108,11 +111,229 @@ class ThreadManager:
         return results
 
 
+class NetworkManager:
+    """
+    Class to manage running BB84 over many links of one network at once: 
+    n_pairs Alice/Bob pairs, each joined by a chain of n_relays trusted relays.
+    Each link, from one node of a chain to the next, passes its qubits through
+    its own Eve and is run by its own sender, Eve and receiver threads, so 
+    every link exchanges qubits at the same time.
+    """
+
+    def __init__(self, n_pairs, n_relays, n_qubits, noisy, t1, window=1,
+                 name=NETWORK_NAME):
+        """
+        Create new NetworkManager for n qubit BB84 over every link. Create 
+        empty arrays for storing the bases and qubits/measurements of each 
+        link's sender and receiver, initialising to -1 as for ThreadManager.
+        Initialise network for running the protocol on.
+
+        Arguments:
+        n_pairs -- the number of Alice/Bob pairs
+        n_relays -- the number of trusted relays between each pair
+        n_qubits -- the number of qubits to be sent over each link
+        noisy -- a boolean value indicating whether noisy qubits should be 
+        simulated
+        t1 - the simulated coherence time of the qubits
+        window -- the number of qubits allowed in flight over each link, None
+        for as many as a node can hold
+        name -- the name of the network
+        """
+        self.n_qubits = n_qubits
+        self.name = name
+
+        # chains of nodes from each Alice to her Bob, and the links along them
+        self.paths = [["Alice{}".format(pair)]
+                      + ["Relay{}_{}".format(pair, hop) 
+                         for hop in range(n_relays)]
+                      + ["Bob{}".format(pair)] for pair in range(n_pairs)]
+        self.links = [(path[hop], "Eve{}_{}".format(pair, hop), path[hop+1])
+                      for pair, path in enumerate(self.paths)
+                      for hop in range(len(path) - 1)]
+        n_links = len(self.links)
+
+        self.sender_results   = -1*np.ones((n_links, 2, n_qubits))
+        self.receiver_results = -1*np.ones((n_links, 2, n_qubits))
+
+        # control qubit flow over each link
+        self.windows = [QubitWindow(window_size(window)) 
+                        for _ in range(n_links)]
+        logging.info("TM     : %d links, allowing %d qubits in flight on each.",
+                     n_links, self.windows[0].size)
+
+        self.orig_noise_state, self.orig_t1_value = set_noise(noisy, t1)
+
+        nodes = sorted(set(node for link in self.links for node in link))
+        topology = {node: [] for node in nodes}
+        for sender, channel, receiver in self.links:
+            topology[sender].append(channel)
+            topology[channel].append(receiver)
+        self.network = init_network(name, nodes, topology)
+
+
+    def start(self, eavesdrop):
+        """
+        Start the sender, receiver and Eve threads of every link.
+
+        Arguments:
+        eavesdrop -- if true, every Eve will peek at every qubit which passes
+        through
+        """
+        logging.info("TM     : Starting threads.")
+
+        self.threads = []
+        for i, (sender, channel, receiver) in enumerate(self.links):
+            self.threads += [
+                Thread(target=alice, args=(self.n_qubits, 
+                                           self.sender_results[i],
+                                           self.windows[i], sender, channel,
+                                           self.name)),
+                Thread(target=bob  , args=(self.n_qubits, 
+                                           self.receiver_results[i],
+                                           self.windows[i], receiver, 
+                                           self.name)),
+                Thread(target=eve  , args=(self.n_qubits, eavesdrop, channel,
+                                           receiver, self.name))]
+        time.sleep(ALICE_WAIT)  # Allow the network time to settle
+
+        for thread in self.threads:
+            thread.start()
+
+
+    def join(self):
+        """
+        Join (i.e. wait for) every link's threads. Stop the network as we no
+        longer need it.
+
+        Returns:
+        results -- (np.ndarray, np.ndarray), each of shape (n_links, 2, 
+        n_qubits), the senders' and receivers' bases and qubits/measurements
+        on each link.
+        """
+        for thread in self.threads:
+            thread.join()
+        logging.info("TM     : Threads joined.")
+
+        # tidy up SimulaQron backend
+        self.network.stop()
+        simulaqron_settings.noisy_qubits = self.orig_noise_state
+        simulaqron_settings.t1 = self.orig_t1_value
+
+        results = (self.sender_results, self.receiver_results)
+        return results
+
+
+    def path_links(self, pair):
+        """
+        Find the links along the chain of a pair.
+
+        Arguments:
+        pair -- the index of the Alice/Bob pair
+
+        Returns:
+        links -- list of the indices of the pair's links, from Alice to Bob
+        """
+        path = self.paths[pair]
+        return [i for i, (sender, _, _) in enumerate(self.links)
+                if sender in path[:-1]]
+
+
+class QubitWindow:
+    """
+    Pipeline qubits from Alice to Bob, bounding how many are in flight at once.
+    Alice takes a slot before preparing each qubit and Bob frees it once he 
+    has measured, so up to size qubits can be in the network rather than 
+    waiting for each one to make the full trip via Eve.
+    """
+
+    def __init__(self, size):
+        """
+        Create a new window with nothing in flight.
+
+        Arguments:
+        size -- the maximum number of qubits in flight
+        """
+        self.size = size
+        self.n_in_flight = 0
+        self.n_received = 0
+        self.condition = Condition()
+
+
+    def acquire(self):
+        """
+        Wait for, then take, a slot for a new qubit.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.n_in_flight < self.size)
+            self.n_in_flight += 1
+
+
+    def release(self):
+        """
+        Free the slot of a qubit which has been received.
+        """
+        with self.condition:
+            self.n_in_flight -= 1
+            self.n_received += 1
+            self.condition.notify_all()
+
+
+    def backoff(self):
+        """
+        Wait for a qubit to leave the network after a node has run out of 
+        space, rather than immediately retrying. If nothing else is in flight
+        there is nothing to wait for, so only wait BACKOFF_WAIT.
+        """
+        with self.condition:
+            n_received = self.n_received
+            self.condition.wait_for(lambda: self.n_received > n_received,
+                                    timeout=BACKOFF_WAIT)
+
+
+def window_size(window):
+    """
+    Bound the number of qubits in flight by the number a node can hold.
+
+    Arguments:
+    window -- the number of qubits requested in flight, None for as many as a
+    node can hold
+
+    Returns:
+    size -- the number of qubits allowed in flight
+    """
+    capacity = simulaqron_settings.max_qubits
+    if window is None or window > capacity:
+        return capacity
+    return window
+
+
+def set_noise(noisy, t1):
+    """
+    Turn SimulaQron's noisy qubits on or off, and set their coherence time.
+
+    Arguments:
+    noisy -- a boolean value indicating whether noisy qubits should be 
+    simulated
+    t1 - the simulated coherence time of the qubits, unchanged if None
+
+    Returns:
+    original -- (bool, float), the original noisy qubits and t1 settings
+    """
+    logging.info("NETWORK: Turning noisy-qubits %s.", 
+                ["off","on"][noisy])
+    original = (simulaqron_settings.noisy_qubits, simulaqron_settings.t1)
+    simulaqron_settings.noisy_qubits = noisy
+    if t1 is not None:
+        simulaqron_settings.t1 = t1
+    return original
+
+
 def init_network(name=NETWORK_NAME, nodes=["Alice","Bob","Eve"], topology=None):
     """
     Start fully connected (the default) simulaqron network.
 
     Arguments:
+    name -- the name of the network
     nodes -- list of nodes, identified by a string (name)
     topology -- dict representing adjacency list of network
 
@@ -127,23 +348,28 @@ def init_network(name=NETWORK_NAME, nodes=["Alice","Bob","Eve"], topology=None):
     return network
 
 
-def alice(n_qubits_to_send, results, sent_to_eve_event, sent_to_bob_event):
+def alice(n_qubits_to_send, results, window, name="Alice", target="Eve",
+          network_name=NETWORK_NAME):
     """
     Alice chooses n random pairs of bits (x, a), using the first to determine a
     measurement basis (computational or Hadamard) and the second to determine 
     the corresponding qubit orientation (|+> or |0>, |-> or |1> respectively).
-    She sends these qubits to Bob via Eve through an untrusted quantum channel.
+    She sends these qubits to Bob via Eve through an untrusted quantum channel,
+    keeping as many in flight as the window allows.
 
     Arguments:
     n_qubits_to_send -- the number of qubits to prepare and send to Bob
     results -- np.ndarray to store bases and qubits
-    sent_to_eve_event -- threading.Event to control flow of qubits
-    sent_to_bob_event -- threading.Event to control flow of qubits
+    window -- QubitWindow to control flow of qubits
+    name -- the node sending, Alice or a relay
+    target -- the node the qubits are sent to
+    network_name -- the name of the network
     """
 
     # Connect to network
-    with CQCConnection("Alice", network_name=NETWORK_NAME) as Alice:
-        logging.info("ALICE  : Alice connceted.")
+    with CQCConnection(name, network_name=network_name, 
+                       appID=SEND_APP_ID) as Alice:
+        logging.info("ALICE  : %s connceted.", name)
 
         n_qubits_sent = 0
         while n_qubits_sent < n_qubits_to_send:
@@ -154,21 +380,21 @@ def alice(n_qubits_to_send, results, sent_to_eve_event, sent_to_bob_event):
             results[0,n_qubits_sent] = x  # basis
             results[1,n_qubits_sent] = a  # qubit
 
-            # try to make a qubit
-            sent_to_bob_event.wait()    
-            try:
-                q = qubit(Alice)  # |0>
-            except CQCNoQubitError:
-                continue
+            # try to make a qubit, backing off while the network is full
+            window.acquire()
+            while True:
+                try:
+                    q = qubit(Alice)  # |0>
+                    break
+                except CQCNoQubitError:
+                    window.backoff()
             # if successful, encode accordingly
             if a:
                 q.X()  # |1>
             if x:
                 q.H()  # |+> or |->
 
-            Alice.sendQubit(q, "Eve")
-            sent_to_eve_event.set()
-            sent_to_bob_event.clear()
+            Alice.sendQubit(q, target, remote_appID=RECV_APP_ID)
             
             logging.debug("ALICE  : state %s sent", STATES[x][a])
 
@@ -181,7 +407,8 @@ def alice(n_qubits_to_send, results, sent_to_eve_event, sent_to_bob_event):
             n_qubits_sent += 1
 
 
-def bob(n_qubits_to_recieve, results):
+def bob(n_qubits_to_recieve, results, window, name="Bob", 
+        network_name=NETWORK_NAME):
     """
     Bob chooses a random bit y to determine a measurement basis (computational 
     or Hadamard) and uses this to measure the Qubit sent by Alice. If his bit 
@@ -191,12 +418,15 @@ def bob(n_qubits_to_recieve, results):
     Arguments:
     n_qubits_to_recieve -- the number of qubits to receive from Alice
     results -- np.ndarray to store bases and qubits
-    sent_to_bob_event -- threading.Event to control flow of qubits
+    window -- QubitWindow to control flow of qubits
+    name -- the node receiving, Bob or a relay
+    network_name -- the name of the network
     """
 
     # Connect to network
-    with CQCConnection("Bob", network_name=NETWORK_NAME) as Bob:
-        logging.info("BOB    : Bob connected.")
+    with CQCConnection(name, network_name=network_name, 
+                       appID=RECV_APP_ID) as Bob:
+        logging.info("BOB    : %s connected.", name)
         for n_qubits_recieved in range(0,n_qubits_to_recieve):
             # random bit
             y = binomial(1, 0.5)  # 0 -> computational, 1 -> Hadamard
@@ -208,6 +438,7 @@ def bob(n_qubits_to_recieve, results):
             if y:    
                 q.H() 
             b = q.measure()
+            window.release()
 
             # store for QBER estimation
             results[0,n_qubits_recieved] = y       # basis
@@ -223,7 +454,8 @@ def bob(n_qubits_to_recieve, results):
                              n_qubits_recieved, n_qubits_to_recieve)
         
 
-def eve(n_qubits_to_recieve, sent_to_eve_event, sent_to_bob_event, eavesdrop=False):
+def eve(n_qubits_to_recieve, eavesdrop=False, name="Eve", target="Bob",
+        network_name=NETWORK_NAME):
     """
     Eve receives a qubit from Alice and passes it on to Bob. Eve can be set to 
     eavesdrop (i.e. measure at random then send her resulting state to Bob) or 
@@ -231,18 +463,19 @@ def eve(n_qubits_to_recieve, sent_to_eve_event, sent_to_bob_event, eavesdrop=Fal
 
     Arguments:
     n_qubits_to_recieve -- the number of qubits Eve is to expect
-    sent_to_eve_event -- threading.Event to control flow of qubits
-    sent_to_bob_event -- threading.Event to control flow of qubits
     easvedrop -- whether or not Eve will look at each state she recieve
+    name -- the node in the middle of the channel
+    target -- the node the qubits are passed on to
+    network_name -- the name of the network
     """
 
     # connect to network
-    with CQCConnection("Eve", network_name=NETWORK_NAME) as Eve:
-        logging.info("EVE    : Eve connected.")
+    with CQCConnection(name, network_name=network_name, 
+                       appID=RECV_APP_ID) as Eve:
+        logging.info("EVE    : %s connected.", name)
 
         for _ in range(n_qubits_to_recieve):
             # recieve qubit from Alice
-            sent_to_eve_event.wait()
             q = Eve.recvQubit()
 
             if eavesdrop:
@@ -261,12 +494,65 @@ def eve(n_qubits_to_recieve, sent_to_eve_event, sent_to_bob_event, eavesdrop=Fal
                     q.H()  # |+> or |->
 
             # send qubit to Bob
-            Eve.sendQubit(q, "Bob")
-            sent_to_eve_event.clear()
-            sent_to_bob_event.set()
+            Eve.sendQubit(q, target, remote_appID=RECV_APP_ID)
+
 
+def sift_keys(alice_results, bob_results, test_prob=None):
+    """
+    Sift the keys of a stack of runs at once. In each run, keep the qubits 
+    where Alice's and Bob's bases agree, set aside a random test subset of 
+    these for estimating the QBER and return the rest as the key. Qubits never
+    sent or measured (i.e. still -1) are discarded.
+
+    Arguments:
+    alice_results -- np.ndarray, (n_runs, 2, n_qubits), of Alice's randomly 
+    chosen bases and qubits in each run
+    bob_results -- np.ndarray, (n_runs, 2, n_qubits), of Bob's randomly chosen
+    bases and corresponding measurements in each run
+    test_prob -- probability with which each sifted qubit is used to estimate
+    the QBER, the ``true'' QBER over all sifted qubits will be returned and 
+    the whole sifted key kept if not specified
 
-def generate_key(alice_results, bob_results, test_prob=None):
+    Returns:
+    alice_keys -- np.ndarray, (n_runs, n_bytes), of Alice's keys packed with
+    np.packbits and zero-padded to the longest key
+    bob_keys -- np.ndarray, (n_runs, n_bytes), of Bob's keys likewise
+    key_lens -- np.ndarray of the number of bits in each run's key
+    qbers -- np.ndarray of the QBER estimate of each run, nan if no qubits were
+    tested
+    """
+    alice_results = np.asarray(alice_results).astype(np.int8, copy=False)
+    bob_results   = np.asarray(bob_results  ).astype(np.int8, copy=False)
+    n_runs, _, n_qubits = alice_results.shape
+
+    sifted = ((alice_results[:,0] == bob_results[:,0])
+              & (alice_results[:,0] >= 0) & (bob_results[:,1] >= 0))
+    errors = alice_results[:,1] != bob_results[:,1]
+
+    if test_prob is not None:
+        tested = sifted & (np.random.random_sample(sifted.shape) < test_prob)
+        kept   = sifted & np.logical_not(tested)
+    else:
+        tested = kept = sifted
+    n_tested = np.count_nonzero(tested, axis=1)
+    n_errors = np.count_nonzero(tested & errors, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        qbers = n_errors / n_tested
+
+    # compact each run's kept bits to the front of its row, then pack
+    key_lens = np.count_nonzero(kept, axis=1)
+    starts = np.cumsum(key_lens) - key_lens
+    runs  = np.repeat(np.arange(n_runs), key_lens)
+    slots = np.arange(key_lens.sum()) - np.repeat(starts, key_lens)
+    keys = np.zeros((2, n_runs, key_lens.max(initial=0)), dtype=np.uint8)
+    keys[0, runs, slots] = alice_results[:,1][kept]
+    keys[1, runs, slots] =   bob_results[:,1][kept]
+    alice_keys, bob_keys = np.packbits(keys, axis=2)
+
+    return (alice_keys, bob_keys, key_lens, qbers)
+
+
+def generate_key(alice_results, bob_results, test_prob=None, log_keys=False):
     """
     Generate the key from the results of Alice and Bob; namely where their
     bases agree return the corresponding qubits/measurements.
@@ -277,28 +563,27 @@ def generate_key(alice_results, bob_results, test_prob=None):
     measurements
     test_frac -- fraction of measurements to randomly select for estimating 
     QBER, the ``true'' QBER will be returned if not specified
+    log_keys -- if true, log the sifted keys
 
     Returns:
     key -- the key generated by the BB84 protocol
     qber -- the estimated QBER
     """
-    basis_match = alice_results[0] == bob_results[0]
-    alice_key = alice_results[1][basis_match].astype(int)
-    bob_key   =   bob_results[1][basis_match].astype(int)
+    alice_keys, bob_keys, key_lens, qbers = sift_keys(alice_results[None], 
+                                                      bob_results[None],
+                                                      test_prob)
+    key_len = key_lens[0]
+    alice_key = np.unpackbits(alice_keys[0], count=key_len).astype(int)
+    bob_key   = np.unpackbits(  bob_keys[0], count=key_len).astype(int)
 
-    if test_prob is not None:
-        test_idxs = binomial(1, test_prob, size=alice_key.shape).astype(bool)
-        keep_idxs = np.logical_not(test_idxs)
-        qber = estimate_qber(alice_key[test_idxs], bob_key[test_idxs])
-        alice_key = alice_key[keep_idxs]
-        bob_key   =   bob_key[keep_idxs]
-    else:
-        qber = estimate_qber(alice_key, bob_key)
+    if log_keys:
+        logging.info("QBER   : Alice key: %s", alice_key)
+        logging.info("QBER   :   Bob key: %s",   bob_key)
 
-    return (alice_key, bob_key, qber)
+    return (alice_key, bob_key, qbers[0])
 
 
-def estimate_qber(alice_key_sample, bob_key_sample):
+def estimate_qber(alice_key_sample, bob_key_sample, log_keys=False):
     """
     Given equal sized samples of the keys generated for Alice and Bob, estimate
     the QBER of the system.
@@ -308,18 +593,107 @@ def estimate_qber(alice_key_sample, bob_key_sample):
     chosen indices
     bob_key_sample -- np.ndarray sampling Bob's key, drawn from the same random
     indices
+    log_keys -- if true, log both samples
 
     Returns:
     qber -- the estimated QBER
     """
-    logging.info("QBER   : Alice sample: %s", alice_key_sample)
-    logging.info("QBER   :   Bob sample: %s",   bob_key_sample)
+    if log_keys:
+        logging.info("QBER   : Alice sample: %s", alice_key_sample)
+        logging.info("QBER   :   Bob sample: %s",   bob_key_sample)
 
     n_in_agreement = np.sum(alice_key_sample != bob_key_sample)
     n_total = len(alice_key_sample)
     return n_in_agreement / n_total
 
 
+def relay_keys(sender_keys, receiver_keys):
+    """
+    Combine the keys of the links along a chain of trusted relays into a key 
+    shared by the ends of the chain. Each relay announces the XOR of the key it
+    received over the link before it with the key it sent over the link after
+    it. XORing every announcement into his key from the last link, Bob 
+    recovers Alice's key from the first.
+
+    Arguments:
+    sender_keys -- list of np.ndarrays of each link's sender's key, in order
+    from Alice to Bob
+    receiver_keys -- list of np.ndarrays of each link's receiver's key, in the
+    same order
+
+    Returns:
+    alice_key -- Alice's key, cut to the length of the shortest link key
+    bob_key -- Bob's key, likewise
+    """
+    n = min(len(key) for key in sender_keys)
+    alice_key = np.asarray(sender_keys[0][:n], dtype=np.uint8)
+    bob_key = np.array(receiver_keys[-1][:n], dtype=np.uint8)
+    for received, sent in zip(receiver_keys[:-1], sender_keys[1:]):
+        bob_key ^= np.asarray(received[:n], dtype=np.uint8)
+        bob_key ^= np.asarray(sent[:n], dtype=np.uint8)
+    return (alice_key, bob_key)
+
+
+def post_process(alice_key, bob_key, qber, args, seed=None):
+    """
+    Reconcile and amplify the privacy of a pair of sifted keys, as requested
+    on the command line. If reconciliation fails to correct every block, the
+    keys are discarded rather than amplified.
+
+    Arguments:
+    alice_key -- np.ndarray of Alice's sifted key
+    bob_key -- np.ndarray of Bob's sifted key
+    qber -- the estimated QBER
+    args -- dictionary of processed command line arguments
+    seed -- the opened extractor seed shared by every key of the run, as from
+    utils.open_seed, None to open one from args['seed_source'] for this key
+
+    Returns:
+    alice_key -- Alice's final key
+    bob_key -- Bob's final key
+    stats -- dictionary of leakage and key length statistics, as strings
+    """
+    stats = {}
+    n_leaked = 0
+    if args['reconcile'] is not None:
+        if args['reconcile'] == 'cascade':
+            reconciler = Cascade(args['passes'], args['block_size'])
+        else:
+            reconciler = LDPC(args['block_size'] or LDPC_BLOCK_SIZE)
+        n_errors = np.count_nonzero(alice_key != bob_key)
+        bob_key, n_leaked, n_messages = reconciler.reconcile(alice_key, 
+                                                             bob_key, qber)
+        n_remaining = np.count_nonzero(alice_key != bob_key)
+        logging.info("MAIN   : Reconciled %d errors, %d remain.", 
+                     n_errors - n_remaining, n_remaining)
+        stats['leaked']   = str(n_leaked)
+        stats['messages'] = str(n_messages)
+        stats['errors']   = str(n_remaining)
+        stats['failed']   = str(reconciler.n_failed)
+        if reconciler.n_failed:
+            logging.warning("MAIN   : %d blocks failed to reconcile, "
+                            "discarding the key.", reconciler.n_failed)
+            alice_key = bob_key = np.zeros(0, dtype=np.uint8)
+            if args['amplify'] is not None:
+                stats['secret_len'] = '0'
+            return (alice_key, bob_key, stats)
+
+    if args['amplify'] is not None:
+        with PrivacyAmplifier(args['amplify'], 
+                              seed_source=args['seed_source'], 
+                              seed=seed) as amplifier:
+            alice_key, bob_key = amplifier.amplify_keys(alice_key, bob_key, 
+                                                        qber, n_leaked)
+        logging.info("MAIN   : Secret key length: %d, keys agree: %s", 
+                     len(alice_key), np.array_equal(alice_key, bob_key))
+        if args['log_keys']:
+            logging.info("MAIN   : Alice's secret key: %s", alice_key)
+            logging.info("MAIN   :   Bob's secret key: %s",   bob_key)
+        stats['secret_len'] = str(len(alice_key))
+
+    return (alice_key, bob_key, stats)
+
+
 def process_args(args):
     """
     Process the parsed command line arguments.
@@ -336,6 +710,23 @@ def process_args(args):
     processed_args['eavesdrop'] = args.eavesdrop
     processed_args['noisy']     = args.noisy
     processed_args['outfile']   = args.write
+    processed_args['window']    = int(args.window) or None
+    processed_args['n_runs']    = int(args.runs)
+    processed_args['log_keys']  = args.log_keys
+    processed_args['reconcile'] = args.reconcile
+    processed_args['passes']    = int(args.passes)
+    processed_args['amplify']   = args.amplify
+    processed_args['seed_source'] = args.seed_source
+    processed_args['seed_cursor'] = args.seed_cursor
+    if args.pairs is not None:
+        processed_args['n_pairs'] = int(args.pairs)
+    else:
+        processed_args['n_pairs'] = args.pairs
+    processed_args['n_relays']  = int(args.relays)
+    if args.block_size is not None:
+        processed_args['block_size'] = int(args.block_size)
+    else:
+        processed_args['block_size'] = args.block_size
     if args.test_prob is not None:
         processed_args['test_prob'] = float(args.test_prob)
     else:
@@ -348,40 +739,157 @@ def process_args(args):
     return processed_args
 
 
-def print_nicely(outfile, outvals):
-    if os.path.exists(outfile):
-        logging.info("FILE   : Appending to existing outfile")
-        with open(outfile, 'a') as f:
-            f.write(', '.join(outvals.values())+'\n')
-    else:
-        logging.info("FILE   : Creating new outfile")
-        with open(outfile, 'w+') as f:
-            f.write(','.join(outvals  .keys())+'\n')
-            f.write(','.join(outvals.values())+'\n')
+def table_row(args, qber, key_len, stats):
+    """
+    Collect the settings and statistics of one key into a row of the outfile.
+
+    Arguments:
+    args -- dictionary of processed command line arguments
+    qber -- the estimated QBER
+    key_len -- the length of the sifted key
+    stats -- dictionary of statistics, as from post_process
+
+    Returns:
+    row -- dictionary of the row's columns, as strings
+    """
+    row = {'noisy'    : str(args['noisy']), 
+           't1'       : str(args['t1']),
+           'eavesdrop': str(args['eavesdrop']),
+           'QBER'     : str(qber),
+           'key_len'  : str(key_len)}
+    row.update(stats)
+    return row
+
+
+def table_columns(args):
+    """
+    List the columns of the outfile rows a run with these arguments writes.
+
+    Arguments:
+    args -- dictionary of processed command line arguments
+
+    Returns:
+    columns -- list of column names
+    """
+    columns = list(table_row(args, None, None, {}))
+    if args['reconcile'] is not None:
+        columns += ['leaked', 'messages', 'errors', 'failed']
+    if args['amplify'] is not None:
+        columns += ['secret_len']
+    if args['n_pairs'] is not None:
+        columns += ['pair', 'hop', 'relays', 'pair_key_len']
+    return columns
 
 
 def main(args):
     logging.basicConfig(format=FORMAT, level=logging.INFO)
     args = process_args(args)
-        
-    thread_manager = ThreadManager(args['n_qubits'], args['noisy'], args['t1'])
-    thread_manager.start(args['eavesdrop'])
-    alice_res, bob_res = thread_manager.join()
-
-    alice_key, bob_key, qber = generate_key(alice_res, bob_res, 
-                                           args['test_prob'])
-
-    logging.info("MAIN   : Alice's generated key: %s", alice_key)
-    logging.info("MAIN   :   Bob's generated key: %s",   bob_key)
-    logging.info("MAIN   : QBER estimate: %.3f", qber)
+    if args['n_pairs'] is not None:
+        main_network(args)
+        return
+    if args['outfile'] is not None:
+        # fail now, not after the simulation, if the rows don't fit the table
+        utils.check_table(args['outfile'], table_columns(args))
+
+    # run the protocol n_runs times, sifting all runs together at the end
+    alice_res = np.empty((args['n_runs'], 2, args['n_qubits']))
+    bob_res   = np.empty((args['n_runs'], 2, args['n_qubits']))
+    for run in range(args['n_runs']):
+        logging.info("MAIN   : Run %d of %d.", run + 1, args['n_runs'])
+        thread_manager = ThreadManager(args['n_qubits'], args['noisy'], 
+                                       args['t1'], args['window'])
+        thread_manager.start(args['eavesdrop'])
+        alice_res[run], bob_res[run] = thread_manager.join()
+
+    alice_keys, bob_keys, key_lens, qbers = sift_keys(alice_res, bob_res,
+                                                      args['test_prob'])
+
+    # every run's key is amplified with fresh bits of the same seed
+    with utils.open_seed(args['seed_source'], args['seed_cursor']) as seed:
+        for run in range(args['n_runs']):
+            alice_key = np.unpackbits(alice_keys[run], count=key_lens[run])
+            bob_key   = np.unpackbits(  bob_keys[run], count=key_lens[run])
+            if args['log_keys']:
+                logging.info("MAIN   : Alice's generated key: %s", alice_key)
+                logging.info("MAIN   :   Bob's generated key: %s",   bob_key)
+            logging.info("MAIN   : Key length: %d, QBER estimate: %.3f", 
+                         key_lens[run], qbers[run])
+
+            _, _, stats = post_process(alice_key, bob_key, qbers[run], args,
+                                       seed)
+
+            if args['outfile'] is not None:
+                utils.write_table([table_row(args, qbers[run], key_lens[run], 
+                                             stats)],
+                                  args['outfile'], append=True)
+
+
+def main_network(args):
+    """
+    Run BB84 over every link of a network of Alice/Bob pairs joined by 
+    trusted relays, then combine the keys along each pair's chain.
 
+    Arguments:
+    args -- dictionary of processed command line arguments
+    """
+    if args['outfile'] is not None:
+        # fail now, not after the simulation, if the rows don't fit the table
+        utils.check_table(args['outfile'], table_columns(args))
+    manager = NetworkManager(args['n_pairs'], args['n_relays'], 
+                             args['n_qubits'], args['noisy'], args['t1'],
+                             args['window'])
+    start = time.time()
+    manager.start(args['eavesdrop'])
+    sender_res, receiver_res = manager.join()
+    exchanged = time.time()
+
+    # sift every link at once, then finish each link's key separately
+    sender_keys, receiver_keys, key_lens, qbers = sift_keys(sender_res, 
+                                                            receiver_res,
+                                                            args['test_prob'])
+    link_keys = []
+    link_stats = []
+    # every link's key is amplified with fresh bits of the same seed
+    with utils.open_seed(args['seed_source'], args['seed_cursor']) as seed:
+        for i, (sender, _, receiver) in enumerate(manager.links):
+            logging.info("MAIN   : %s -> %s key length: %d, QBER estimate: "
+                         "%.3f", sender, receiver, key_lens[i], qbers[i])
+            alice_key, bob_key, stats = post_process(
+                np.unpackbits(  sender_keys[i], count=key_lens[i]),
+                np.unpackbits(receiver_keys[i], count=key_lens[i]),
+                qbers[i], args, seed)
+            link_keys.append((alice_key, bob_key))
+            link_stats.append(stats)
+
+    n_key_bits = 0
+    rows = []
+    for pair in range(args['n_pairs']):
+        links = manager.path_links(pair)
+        alice_key, bob_key = relay_keys([link_keys[i][0] for i in links],
+                                        [link_keys[i][1] for i in links])
+        n_key_bits += len(alice_key)
+        logging.info("MAIN   : Pair %d key length: %d, keys agree: %s", pair,
+                     len(alice_key), np.array_equal(alice_key, bob_key))
+        if args['log_keys']:
+            logging.info("MAIN   : Alice%d's key: %s", pair, alice_key)
+            logging.info("MAIN   :   Bob%d's key: %s", pair,   bob_key)
+
+        # a row per link, as main writes per run, with the pair's key
+        for hop, i in enumerate(links):
+            row = table_row(args, qbers[i], key_lens[i], link_stats[i])
+            row.update({'pair'        : str(pair),
+                        'hop'         : str(hop),
+                        'relays'      : str(args['n_relays']),
+                        'pair_key_len': str(len(alice_key))})
+            rows.append(row)
+
+    elapsed = time.time() - start
+    logging.info("MAIN   : %d key bits over %d links in %.2fs (%.2fs "
+                 "exchanging qubits), %.1f bits/s.", n_key_bits, 
+                 len(manager.links), elapsed, exchanged - start,
+                 n_key_bits / elapsed)
     if args['outfile'] is not None:
-        outvals = {'noisy'    : str(args['noisy']), 
-                   't1'       : str(args['t1']),
-                   'eavesdrop': str(args['eavesdrop']),
-                   'QBER'     : str(qber),
-                   'key_len'  : str(len(alice_key))}
-        print_nicely(args['outfile'], outvals)
+        utils.write_table(rows, args['outfile'], append=True)
 
 
 if __name__ == "__main__":
@@ -400,6 +908,39 @@ if __name__ == "__main__":
     parser.add_argument("--test_prob"     , "-f", default=None, 
                         help=("Probability with which Alice and Bob consider "
                               "using each of their qubits to estimate QBER"))
+    parser.add_argument("--window"        , "-W", default=1,
+                        help=("Number of qubits allowed in flight between "
+                              "Alice and Bob, 0 for as many as a node can "
+                              "hold"))
+    parser.add_argument("--runs"          , "-r", default=1,
+                        help="Number of times to run the protocol")
+    parser.add_argument("--log_keys"      , "-k", action="store_true",
+                        help="If flagged, log the generated keys")
+    parser.add_argument("--reconcile"     , "-c", default=None, 
+                        choices=["cascade", "ldpc"],
+                        help="If set, reconcile the keys with this protocol")
+    parser.add_argument("--passes"        , "-p", default=4,
+                        help="Number of Cascade passes")
+    parser.add_argument("--block_size"    , "-b", default=None,
+                        help=("Cascade first pass block size, chosen from the "
+                              "QBER if not set, or LDPC code word length"))
+    parser.add_argument("--amplify"       , "-a", default=None,
+                        choices=["toeplitz", "carter_wegman"],
+                        help=("If set, amplify privacy of the keys with this "
+                              "extractor, carter_wegman loses about 60 bits "
+                              "more than toeplitz per 512 key bits"))
+    parser.add_argument("--seed_source"   , "-s", default="local",
+                        help=("Source file for the public extractor seed, or "
+                              "local"))
+    parser.add_argument("--seed_cursor"   ,       default=None,
+                        help=("If set, file recording the seed bits already "
+                              "used, so that later runs take fresh ones"))
+    parser.add_argument("--pairs"         , "-P", default=None,
+                        help=("If set, run this many Alice/Bob pairs at once "
+                              "in one network"))
+    parser.add_argument("--relays"        , "-R", default=0,
+                        help=("Number of trusted relays between each pair, "
+                              "used with --pairs"))
     parser.add_argument("--write"    , "-w", default=None,
                         help="If set, write to QBER corresponding log file.")
     args = parser.parse_args()
@@ -0,0 +1,179 @@
+import logging
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'sims'))
+import utils
+
+"""
+Privacy amplification for the reconciled BB84 keys. Eve may know something
+about the key, both from disturbing the qubits (bounded by the QBER) and from
+the parities disclosed during reconciliation. Alice and Bob hash their keys
+with the same seeded randomness extractor, from sims/utils.py, shrinking them
+to a key about which Eve knows (almost) nothing.
+
+PrivacyAmplifier.amplify hashes the keys block by block as they are passed
+in, so a caller streaming its key blocks in and its output blocks out holds
+only one of each at a time. amplify_keys, given whole keys, returns whole
+secret keys.
+"""
+
+PA_BLOCK_SIZE = 1 << 16
+PA_EPSILON = 1e-9
+
+
+def blocks(keys, block_size=PA_BLOCK_SIZE):
+    """
+    Split equal length keys into consecutive blocks, stacking one block of
+    each key at a time.
+
+    Arguments:
+    keys -- sequence of np.ndarrays of each party's key
+    block_size -- the number of bits per block
+
+    Returns:
+    blocks -- generator of np.ndarray, (n_parties, block_size), of blocks,
+    the last possibly shorter
+    """
+    for start in range(0, len(keys[0]), block_size):
+        yield np.stack([key[start:start+block_size] for key in keys])
+
+
+def min_entropy_rate(qber, n_bits, n_leaked):
+    """
+    Bound the min-entropy per bit of a reconciled key, given the QBER and the
+    number of bits disclosed while reconciling. Asymptotically, Eve learns at
+    most h(QBER) bits per key bit from the quantum channel, on top of
+    everything disclosed over the classical channel.
+
+    Arguments:
+    qber -- the estimated QBER
+    n_bits -- the length of the key
+    n_leaked -- the number of bits disclosed by reconciliation
+
+    Returns:
+    rate -- the min-entropy per key bit, 0 if nothing can be extracted
+    """
+    if n_bits == 0 or qber is None or not 0 <= qber < 0.5:
+        return 0.
+    h = 0. if qber == 0 else -qber*np.log2(qber) - (1-qber)*np.log2(1-qber)
+    return max(1 - h - n_leaked / n_bits, 0.)
+
+
+class PrivacyAmplifier:
+    """
+    Hash blocks of Alice's and Bob's keys with one of utils.EXTRACTORS. The
+    seed is public, taken from a seed source shared by Alice and Bob. As the
+    extractors are strong, the Toeplitz seed is reused for every block, while
+    Carter-Wegman hashing takes fresh seed bits for each block and hashes it
+    in sub-blocks of the largest field in utils.GF2N_REDUCTION. Each (sub-)
+    block contributes epsilon to the distance of the final key from uniform.
+
+    Toeplitz hashing is the default, as it costs 2*log2(1/epsilon) bits once
+    per block. Carter-Wegman hashing costs as much for every 512 bit sub-block,
+    around 60 bits in 512 at the default epsilon, giving a key some 15% 
+    shorter at low QBER, and it uses 2 fresh seed bits per key bit.
+
+    Amplifiers of successive keys should share one opened seed, so that each
+    key is hashed with fresh seed bits. An amplifier opening its own seed 
+    closes it on close, or on leaving a with block.
+    """
+
+    def __init__(self, extractor='toeplitz', block_size=PA_BLOCK_SIZE,
+                 epsilon=PA_EPSILON, seed_source="local", seed=None):
+        """
+        Create a new privacy amplifier.
+
+        Arguments:
+        extractor -- the name of the extractor, a key of utils.EXTRACTORS
+        block_size -- the number of key bits hashed at once
+        epsilon -- the distance from uniform accepted for each block
+        seed_source -- seed file, or "local", as for utils.open_seed, opened
+        if no seed is given
+        seed -- an opened seed, as from utils.open_seed, shared with other 
+        amplifiers and left open by close, None to open one from seed_source
+        """
+        field_size = None
+        if extractor == 'carter_wegman':
+            field_size = max(utils.GF2N_REDUCTION)
+        self.extractor = utils.EXTRACTORS[extractor](field_size)
+        self.reuse_seed = extractor == 'toeplitz'
+        self.block_size = block_size
+        self.epsilon = epsilon
+        self.own_seed = seed is None
+        self.seed = utils.open_seed(seed_source) if seed is None else seed
+
+
+    def close(self):
+        """
+        Close the seed, if the amplifier opened it.
+        """
+        if self.own_seed:
+            self.seed.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def amplify(self, key_blocks, rate):
+        """
+        Hash each block of the keys in turn.
+
+        Arguments:
+        key_blocks -- iterable of np.ndarray, (n_parties, n_bits), of blocks
+        of each party's key, as from blocks
+        rate -- the min-entropy per key bit, as from min_entropy_rate
+
+        Returns:
+        outputs -- generator of np.ndarray, (n_parties, m), of the hashed
+        blocks, short blocks with too little min-entropy are dropped
+        """
+        seed = None
+        for block in key_blocks:
+            n = block.shape[1]
+            k = rate * n
+            if self.extractor.output_length(n, k, self.epsilon) <= 0:
+                logging.info("PA     : Dropping %d bit block, too little "
+                             "min-entropy to extract from.", n)
+                continue
+            # later blocks are no longer than the first, so a reused seed
+            # sized for the first block covers them all
+            if seed is None or not self.reuse_seed:
+                length = self.extractor.seed_length(n, k, self.epsilon)
+                seed = np.asarray(self.seed.take(length)[0])
+            yield np.stack([self.extractor.extract(key, seed, k, self.epsilon)
+                            for key in block])
+
+
+    def amplify_keys(self, alice_key, bob_key, qber, n_leaked):
+        """
+        Run privacy amplification over the whole of Alice's and Bob's keys.
+
+        Arguments:
+        alice_key -- np.ndarray of Alice's reconciled key
+        bob_key -- np.ndarray of Bob's reconciled key
+        qber -- the estimated QBER
+        n_leaked -- the number of bits disclosed by reconciliation
+
+        Returns:
+        alice_secret -- np.ndarray of Alice's secret key
+        bob_secret -- np.ndarray of Bob's secret key
+        """
+        n_bits = len(alice_key)
+        rate = min_entropy_rate(qber, n_bits, n_leaked)
+        key_blocks = blocks((alice_key, bob_key), self.block_size)
+        outputs = list(self.amplify(key_blocks, rate))
+        if not outputs:
+            logging.warning("PA     : No secret key could be extracted.")
+            return (np.zeros(0, dtype=bool), np.zeros(0, dtype=bool))
+        alice_secret, bob_secret = np.concatenate(outputs, axis=1)
+        logging.info("PA     : %d bit keys amplified to %d bits.",
+                     n_bits, len(alice_secret))
+        return (alice_secret, bob_secret)
@@ -0,0 +1,457 @@
+import logging
+import numpy as np
+
+"""
+Information reconciliation for the sifted BB84 keys. Alice's and Bob's keys
+differ wherever noise or Eve disturbed a qubit; reconciliation finds and
+corrects Bob's errors by disclosing parities of Alice's key over the public
+classical channel. Every disclosed parity is counted as leaked to Eve, to be
+removed again by privacy amplification.
+
+Keys are np.ndarrays of bits, one per element, as returned by generate_key.
+"""
+
+PARITY_TABLE = np.array([bin(i).count('1') & 1 for i in range(256)],
+                        dtype=np.uint8)
+CASCADE_PASSES = 4
+CASCADE_BLOCK_FACTOR = 0.73  # first block size, as a fraction of 1/QBER
+LDPC_BLOCK_SIZE = 1 << 14
+LDPC_COLUMN_WEIGHT = 3
+LDPC_ITERATIONS = 50
+# (code rate, highest QBER decoded), measured for LDPC_BLOCK_SIZE bit blocks
+# with a 20% margin. These random column weight 3 codes are far from the
+# Shannon limit: the syndrome discloses f = (1 - rate) / h(QBER) times the
+# minimum, f = 1, e.g. f ~ 2.1 at QBER 0.03 and up to f ~ 2.9 below 0.002,
+# against f ~ 1.1 - 1.2 for Cascade.
+LDPC_RATES = [(0.95, 0.0016), (0.9, 0.0048), (0.85, 0.0096), (0.8, 0.0144),
+              (0.75, 0.0208), (0.7, 0.0272), (0.6, 0.0432), (0.5, 0.0656),
+              (0.4, 0.088), (0.3, 0.1136)]
+LLR_MAX = 50.
+
+
+def block_parities(key, block_size):
+    """
+    Compute the parity of each consecutive block of a key. The blocks are
+    packed into bytes, XORed together bytewise and the parity of the result
+    looked up, so only one byte per eight bits is touched after packing.
+
+    Arguments:
+    key -- np.ndarray of bits
+    block_size -- the number of bits per block, the last block is zero-padded
+
+    Returns:
+    parities -- np.ndarray of the parity of each block
+    """
+    n_blocks = -(-len(key) // block_size)
+    blocks = np.zeros(n_blocks * block_size, dtype=np.uint8)
+    blocks[:len(key)] = key
+    packed = np.packbits(blocks.reshape(n_blocks, block_size), axis=1)
+    return PARITY_TABLE[np.bitwise_xor.reduce(packed, axis=1)]
+
+
+def prefix_parities(key):
+    """
+    Compute the parity of every prefix of a key, so that the parity of any
+    range [lo, hi) is prefix[hi] ^ prefix[lo].
+
+    Arguments:
+    key -- np.ndarray of bits
+
+    Returns:
+    prefix -- np.ndarray of len(key)+1 prefix parities
+    """
+    prefix = np.zeros(len(key) + 1, dtype=np.uint8)
+    np.bitwise_xor.accumulate(key.astype(np.uint8) & 1, out=prefix[1:])
+    return prefix
+
+
+def cascade_block_size(qber):
+    """
+    Choose the first pass block size of Cascade, such that each block is
+    expected to hold CASCADE_BLOCK_FACTOR errors.
+
+    Arguments:
+    qber -- the estimated QBER
+
+    Returns:
+    block_size -- the number of bits per block in the first pass
+    """
+    if not qber > 0:
+        return 1 << 16
+    return max(1, int(round(CASCADE_BLOCK_FACTOR / qber)))
+
+
+class Cascade:
+    """
+    The Cascade protocol of Brassard and Salvail. In each pass, the key is
+    shuffled by a permutation shared by Alice and Bob and split into blocks,
+    doubling in size each pass. Alice discloses the parity of every block, and
+    every block whose parity differs from Bob's is binary searched for an
+    error. Correcting an error flips the parity of the blocks containing it
+    in earlier passes, which are then searched in turn (the cascade).
+
+    The binary searches of all odd blocks in a pass proceed together, each
+    step being a single exchange of messages between Alice and Bob.
+    """
+
+    def __init__(self, n_passes=CASCADE_PASSES, block_size=None, seed=None):
+        """
+        Create a new Cascade reconciler.
+
+        Arguments:
+        n_passes -- the number of passes
+        block_size -- the number of bits per block in the first pass, chosen
+        from the QBER if not specified
+        seed -- seed for the permutations shared by Alice and Bob
+        """
+        self.n_passes = n_passes
+        self.block_size = block_size
+        self.seed = seed
+
+
+    def reconcile(self, alice_key, bob_key, qber=None):
+        """
+        Correct Bob's key to match Alice's.
+
+        Arguments:
+        alice_key -- np.ndarray of Alice's sifted key
+        bob_key -- np.ndarray of Bob's sifted key
+        qber -- the estimated QBER, used to choose the block size
+
+        Returns:
+        bob_key -- np.ndarray of Bob's corrected key
+        n_leaked -- the number of parity bits disclosed
+        n_messages -- the number of messages exchanged
+        """
+        rng = np.random.RandomState(self.seed)
+        alice_key = np.asarray(alice_key).astype(np.uint8) & 1
+        bob_key = np.asarray(bob_key).astype(np.uint8) & 1
+        n = len(alice_key)
+        block_size = self.block_size or cascade_block_size(qber)
+
+        self.n_leaked = self.n_messages = self.n_failed = 0
+        self.passes = []  # (permutation, its inverse, block size, odd blocks)
+        for pass_idx in range(self.n_passes):
+            size = min(block_size << pass_idx, max(n, 1))
+            perm = np.arange(n) if pass_idx == 0 else rng.permutation(n)
+            inv_perm = np.empty_like(perm)
+            inv_perm[perm] = np.arange(n)
+            odd = (block_parities(alice_key[perm], size)
+                   != block_parities(bob_key[perm], size))
+            self.n_leaked += len(odd)
+            self.n_messages += 1
+            self.passes.append((perm, inv_perm, size, odd))
+
+            # correct errors until every block of every pass so far is even
+            while True:
+                pending = [j for j, p in enumerate(self.passes) if p[3].any()]
+                if not pending:
+                    break
+                errors = self.search(alice_key, bob_key, pending[0])
+                bob_key[errors] ^= 1
+                self.flip(errors)
+            if n <= size:
+                break
+
+        logging.info("RECON  : Cascade disclosed %d parities in %d messages.",
+                     self.n_leaked, self.n_messages)
+        return (bob_key, self.n_leaked, self.n_messages)
+
+
+    def search(self, alice_key, bob_key, pass_idx):
+        """
+        Binary search every odd block of a pass for an error, halving all the
+        blocks together.
+
+        Arguments:
+        alice_key -- np.ndarray of Alice's sifted key
+        bob_key -- np.ndarray of Bob's current key
+        pass_idx -- the pass whose odd blocks are searched
+
+        Returns:
+        errors -- np.ndarray of the positions of one error per odd block
+        """
+        perm, _, size, odd = self.passes[pass_idx]
+        alice_prefix = prefix_parities(alice_key[perm])
+        bob_prefix = prefix_parities(bob_key[perm])
+        lo = np.flatnonzero(odd) * size
+        hi = np.minimum(lo + size, len(perm))
+        while True:
+            active = hi - lo > 1
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            differ = ((alice_prefix[mid] ^ alice_prefix[lo])
+                      != (bob_prefix[mid] ^ bob_prefix[lo]))
+            self.n_leaked += np.count_nonzero(active)
+            self.n_messages += 1
+            hi = np.where(active & differ, mid, hi)
+            lo = np.where(active & ~differ, mid, lo)
+        return perm[lo]
+
+
+    def flip(self, errors):
+        """
+        Toggle the parity of the block containing each corrected error in
+        every pass so far.
+
+        Arguments:
+        errors -- np.ndarray of the positions of corrected errors
+        """
+        for _, inv_perm, size, odd in self.passes:
+            toggles = np.bincount(inv_perm[errors] // size,
+                                  minlength=len(odd)) & 1
+            odd ^= toggles.astype(bool)
+
+
+def ldpc_rate(qber):
+    """
+    Choose the highest code rate in LDPC_RATES able to correct the QBER.
+
+    Arguments:
+    qber -- the estimated QBER
+
+    Returns:
+    rate -- the fraction of key bits not disclosed by the syndrome
+    """
+    for rate, max_qber in LDPC_RATES:
+        if qber <= max_qber:
+            return rate
+    logging.warning("RECON  : QBER %.3f is above the LDPC codes' reach.", qber)
+    return LDPC_RATES[-1][0]
+
+
+class SparseParityMatrix:
+    """
+    A sparse binary parity-check matrix, stored in compressed sparse row form
+    (indptr, indices) with a second, column-sorted, view of the same nonzero
+    entries. Each nonzero entry is an edge of the code's Tanner graph, so 
+    messages passed along edges are stored as arrays in row order.
+    """
+
+    def __init__(self, n_rows, n_cols, column_weight=LDPC_COLUMN_WEIGHT,
+                 seed=None):
+        """
+        Construct a random matrix in which each column has column_weight ones
+        and the rows share the ones as evenly as possible. Alice and Bob can
+        build the same matrix from a shared seed.
+
+        Arguments:
+        n_rows -- the number of parity checks
+        n_cols -- the number of bits checked
+        column_weight -- the number of checks on each bit
+        seed -- seed for the construction
+        """
+        rng = np.random.RandomState(seed)
+        column_weight = min(column_weight, n_rows)
+        # deal the ones of a random ordering of the columns out to the rows
+        cols = rng.permutation(np.repeat(np.arange(n_cols), column_weight))
+        rows = np.arange(len(cols)) % n_rows
+        # a repeated entry would cancel, keep one and drop any empty rows
+        entries = np.unique(rows.astype(np.int64) * n_cols + cols)
+        rows, cols = np.divmod(entries, n_cols)
+        _, rows = np.unique(rows, return_inverse=True)
+
+        self.n_rows = rows.max() + 1
+        self.n_cols = n_cols
+        self.indices = cols
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(rows))))
+        self.edge_rows = rows
+        self.col_order = np.argsort(cols, kind='stable')
+        col_counts = np.bincount(cols, minlength=n_cols)
+        self.col_ptr = np.concatenate(([0], np.cumsum(col_counts)))
+
+
+    def syndrome(self, words):
+        """
+        Compute the syndromes of a stack of words.
+
+        Arguments:
+        words -- np.ndarray, (n_words, n_cols), of bits
+
+        Returns:
+        syndromes -- np.ndarray, (n_words, n_rows), of parity checks
+        """
+        return np.bitwise_xor.reduceat(words[:, self.indices], 
+                                       self.indptr[:-1], axis=1)
+
+
+    def row_sum(self, edges):
+        """
+        Sum the values on the edges of each row.
+
+        Arguments:
+        edges -- np.ndarray, (n_words, n_edges), of values in row order
+
+        Returns:
+        sums -- np.ndarray, (n_words, n_rows), of sums
+        """
+        return np.add.reduceat(edges, self.indptr[:-1], axis=1)
+
+
+    def col_sum(self, edges):
+        """
+        Sum the values on the edges of each column.
+
+        Arguments:
+        edges -- np.ndarray, (n_words, n_edges), of values in row order
+
+        Returns:
+        sums -- np.ndarray, (n_words, n_cols), of sums
+        """
+        return np.add.reduceat(edges[:, self.col_order], self.col_ptr[:-1], 
+                               axis=1)
+
+
+class LDPC:
+    """
+    One-way syndrome reconciliation with a low-density parity-check code. 
+    Alice sends the syndrome of each block of her key in a single message and
+    Bob finds the error pattern between their keys from the difference of
+    syndromes by belief propagation, decoding all blocks together. The 
+    code rate, and so the syndrome length, is chosen from the QBER.
+
+    Blocks which fail to decode are left uncorrected and counted in n_failed,
+    so that the caller can discard the key rather than amplify it.
+    """
+
+    def __init__(self, block_size=LDPC_BLOCK_SIZE, rate=None,
+                 column_weight=LDPC_COLUMN_WEIGHT, n_iterations=LDPC_ITERATIONS,
+                 seed=None):
+        """
+        Create a new LDPC reconciler.
+
+        Arguments:
+        block_size -- the number of key bits per code word
+        rate -- the code rate, chosen from the QBER if not specified
+        column_weight -- the number of checks on each key bit
+        n_iterations -- the maximum number of rounds of belief propagation
+        seed -- seed for the parity-check matrix shared by Alice and Bob
+        """
+        self.block_size = block_size
+        self.rate = rate
+        self.column_weight = column_weight
+        self.n_iterations = n_iterations
+        self.seed = seed
+
+
+    def code(self, n, qber):
+        """
+        Build the parity-check matrix for n-bit blocks at a given QBER.
+
+        Arguments:
+        n -- the number of bits per block
+        qber -- the estimated QBER
+
+        Returns:
+        matrix -- SparseParityMatrix of the code
+        """
+        rate = self.rate or ldpc_rate(qber)
+        n_rows = int(np.ceil((1 - rate) * n))
+        n_rows = min(max(n_rows, self.column_weight), n)
+        return SparseParityMatrix(n_rows, n, self.column_weight, self.seed)
+
+
+    def reconcile(self, alice_key, bob_key, qber=None):
+        """
+        Correct Bob's key to match Alice's.
+
+        Arguments:
+        alice_key -- np.ndarray of Alice's sifted key
+        bob_key -- np.ndarray of Bob's sifted key
+        qber -- the estimated QBER, used to choose the code rate
+
+        Returns:
+        bob_key -- np.ndarray of Bob's corrected key
+        n_leaked -- the number of syndrome bits disclosed
+        n_messages -- the number of messages exchanged
+        """
+        n = len(alice_key)
+        self.n_failed = 0
+        if n == 0:
+            return (np.asarray(bob_key).astype(np.uint8), 0, 0)
+        p = qber if qber is not None and qber > 0 else 0.
+        p = min(max(p, 1e-4), 0.5 - 1e-4)
+        alice_key = np.asarray(alice_key).astype(np.uint8) & 1
+        bob_key = np.asarray(bob_key).astype(np.uint8) & 1
+
+        # the whole blocks share one code, while a shorter last block gets a
+        # code of its own length rather than being padded, so its syndrome 
+        # only covers real key bits
+        block_size = min(self.block_size, n)
+        n_whole = n - n % block_size
+        n_leaked = 0
+        for lo, hi in [(0, n_whole), (n_whole, n)]:
+            if hi == lo:
+                continue
+            size = min(block_size, hi - lo)
+            matrix = self.code(size, p)
+            alice_words = alice_key[lo:hi].reshape(-1, size)
+            bob_words = bob_key[lo:hi].reshape(-1, size)
+            prior = np.full(alice_words.shape, np.log((1-p) / p))
+
+            # Alice -> Bob: the syndromes of all of her blocks, sent together
+            alice_syndrome = matrix.syndrome(alice_words)
+            errors, failed = self.decode(matrix, alice_syndrome 
+                                         ^ matrix.syndrome(bob_words), prior)
+            bob_key[lo:hi] ^= errors.reshape(-1)
+            n_leaked += alice_syndrome.size
+            self.n_failed += np.count_nonzero(failed)
+
+        logging.info("RECON  : LDPC disclosed %d syndrome bits in 1 message.",
+                     n_leaked)
+        return (bob_key, n_leaked, 1)
+
+
+    def decode(self, matrix, syndromes, prior):
+        """
+        Find the most likely error patterns with the given syndromes by 
+        sum-product belief propagation, iterating until every pattern matches
+        its syndrome or the iterations run out.
+
+        Arguments:
+        matrix -- SparseParityMatrix of the code
+        syndromes -- np.ndarray, (n_blocks, n_rows), of syndromes to match
+        prior -- np.ndarray, (n_blocks, n_cols), of log-likelihood ratios of
+        each bit being error free
+
+        Returns:
+        errors -- np.ndarray, (n_blocks, n_cols), of error patterns, zero for
+        blocks which failed to decode
+        failed -- np.ndarray, (n_blocks,), true for blocks which failed to 
+        decode
+        """
+        n_blocks = len(syndromes)
+        errors = np.zeros(prior.shape, dtype=np.uint8)
+        check_msgs = np.zeros((n_blocks, len(matrix.indices)))
+        active = np.arange(n_blocks)
+        for iteration in range(self.n_iterations + 1):
+            # bit beliefs and the tentative error patterns
+            belief = prior[active] + matrix.col_sum(check_msgs[active])
+            errors[active] = belief < 0
+            solved = np.all(matrix.syndrome(errors[active]) 
+                            == syndromes[active], axis=1)
+            active = active[~solved]
+            if len(active) == 0 or iteration == self.n_iterations:
+                break
+            belief = belief[~solved]
+
+            # bit -> check messages, then check -> bit by the tanh rule
+            bit_msgs = belief[:, matrix.indices] - check_msgs[active]
+            t = np.tanh(np.clip(bit_msgs, -LLR_MAX, LLR_MAX) / 2)
+            log_mag = np.log(np.maximum(np.abs(t), 1e-300))
+            negative = (t < 0).astype(np.int64)
+            rows = matrix.edge_rows
+            log_mag = matrix.row_sum(log_mag)[:, rows] - log_mag
+            sign = (matrix.row_sum(negative)[:, rows] - negative
+                    + syndromes[active][:, rows]) & 1
+            mag = np.minimum(np.exp(log_mag), 1 - 1e-15)
+            check_msgs[active] = (1 - 2*sign) * 2*np.arctanh(mag)
+
+        if len(active):
+            logging.warning("RECON  : %d of %d blocks failed to decode, "
+                            "leaving them uncorrected.", len(active), n_blocks)
+            errors[active] = 0
+        failed = np.zeros(n_blocks, dtype=bool)
+        failed[active] = True
+        return (errors, failed)
@@ -4,6 +4,7 @@ import numpy as np
 from numpy.random import binomial
 import logging
 from threading import Barrier
+import statevector
 import utils
 
 """ Randomness amplification using four measurement devices.
@@ -23,6 +24,40 @@ TODO:
     improve this blurb
 """
 
+def prepare_qubits(Generator):
+    """ Prepare the four-partite entangled state on a generator node.
+
+    See paper supplementary information equation 8.
+
+    Args:
+        Generator (cqc.pythonLib.CQCConnection): connection to the generator
+
+    Return:
+        (list): the four qubits, one for each measurement system
+    """
+    # \ket{\Psi_0} = \ket{0000}
+    qs = [qubit(Generator) for _ in range(4)]
+    # \ket{\Psi_1} = \ket{\phi_+}\ket{\phi_+} 
+    #              = \frac{1}{2}(\ket{00}+\ket{11})(\ket{00}+\ket{00})
+    qs[0].H()
+    qs[0].cnot(qs[1])
+    qs[2].H()               
+    qs[2].cnot(qs[3])
+    # \ket{\Psi_2} = \frac{1}{2}(\ket{\phi_-}\ket{\tilde{\phi}_+}+\ket{\psi_+}\ket{\tilde{\phi}_+})
+    #              = \frac{1}{4}((\ket{00}-\ket{11})(\ket{0+}+\ket{1-})+(\ket{01}+\ket{10})(\ket{0+}+\ket{1-}))
+    qs[1].H()
+    qs[3].H()
+    # \ket{\Psi_3} = \frac{1}{2}(\ket{\phi_-}\ket{\tilde{\phi}_+}+\ket{\psi_+}\ket{\tilde{\psi}_+})
+    #              = \frac{1}{4}((\ket{00}-\ket{11})(\ket{0+}+\ket{1-})+(\ket{01}+\ket{10})(\ket{0-}+\ket{1+}))
+    qs[0].cnot(qs[3])
+    qs[1].cnot(qs[3])
+    # \ket{\Psi_4} = \frac{1}{2}(\ket{\phi_-}\ket{\tilde{\phi}_+}+\ket{\psi_+}\ket{\tilde{\psi}_-})
+    #              = \frac{1}{4}((\ket{00}-\ket{11})(\ket{0+}+\ket{1-})+(\ket{01}+\ket{10})(\ket{0-}-\ket{1+}))
+    qs[0].cphase(qs[2])
+    qs[1].cphase(qs[2])
+
+    return qs
+
 def generator(network, node, n_runs, targets, barrier):
     """ Generate a four-partite entangled state and send to experiment.
 
@@ -40,27 +75,7 @@ def generator(network, node, n_runs, targets, barrier):
     with CQCConnection(node, network_name=network) as Generator:
         logging.info("GEN\t: Generator connected to node %s.", node)
         for i in range(n_runs):
-            # Prepare entangled state
-            # \ket{\Psi_0} = \ket{0000}
-            qs = [qubit(Generator) for _ in range(4)]
-            # \ket{\Psi_1} = \ket{\phi_+}\ket{\phi_+} 
-            #              = \frac{1}{2}(\ket{00}+\ket{11})(\ket{00}+\ket{00})
-            qs[0].H()
-            qs[0].cnot(qs[1])
-            qs[2].H()               
-            qs[2].cnot(qs[3])
-            # \ket{\Psi_2} = \frac{1}{2}(\ket{\phi_-}\ket{\tilde{\phi}_+}+\ket{\psi_+}\ket{\tilde{\phi}_+})
-            #              = \frac{1}{4}((\ket{00}-\ket{11})(\ket{0+}+\ket{1-})+(\ket{01}+\ket{10})(\ket{0+}+\ket{1-}))
-            qs[1].H()
-            qs[3].H()
-            # \ket{\Psi_3} = \frac{1}{2}(\ket{\phi_-}\ket{\tilde{\phi}_+}+\ket{\psi_+}\ket{\tilde{\psi}_+})
-            #              = \frac{1}{4}((\ket{00}-\ket{11})(\ket{0+}+\ket{1-})+(\ket{01}+\ket{10})(\ket{0-}+\ket{1+}))
-            qs[0].cnot(qs[3])
-            qs[1].cnot(qs[3])
-            # \ket{\Psi_4} = \frac{1}{2}(\ket{\phi_-}\ket{\tilde{\phi}_+}+\ket{\psi_+}\ket{\tilde{\psi}_-})
-            #              = \frac{1}{4}((\ket{00}-\ket{11})(\ket{0+}+\ket{1-})+(\ket{01}+\ket{10})(\ket{0-}-\ket{1+}))
-            qs[0].cphase(qs[2])
-            qs[1].cphase(qs[2])
+            qs = prepare_qubits(Generator)
 
             # Wait until all parties are ready for another qubit
             barrier.wait()
@@ -73,7 +88,7 @@ def generator(network, node, n_runs, targets, barrier):
             elif i % (n_runs // 8) == 0:
                 logging.info("GEN\t: %d of %d sent.", i, n_runs)
 
-def measurement(network, node, n_runs, seed, results, bases, barrier):
+def measurement(network, node, n_runs, seed, bases, barrier):
     """ Recieve entangled qubit and perform random basis measurement.
 
     Recieves one of the entanbled qubits from the generator and performs one of 
@@ -85,12 +100,14 @@ def measurement(network, node, n_runs, seed, results, bases, barrier):
         node (str): name of the node to connect to
         seed (iterable): list-type object containing a set of random bits to be
             used as measurement bases
-        results (np.ndarray): array for storing measurement bases, results 
-            and qubit IDs
         basis (tuple): pair of lists of rotations to apply to set up the 
             required measurement bases
         recv_EPR (bool): will this node be recieving an EPR pair?
+
+    Return:
+        (np.ndarray): (2, n_runs) array of measurement bases and results
     """
+    results = -1 * np.ones((2, n_runs), dtype=np.int8)
     with CQCConnection(node, network_name=network) as Meas:
         logging.info("MEAS\t: Measurement connected to node %s.", node)
         for i in range(n_runs):
@@ -105,6 +122,231 @@ def measurement(network, node, n_runs, seed, results, bases, barrier):
             results[0,i] = x
             results[1,i] = q.measure()
 
+    return results
+
+async def generator_async(em, node, n_runs, targets, barrier):
+    """ Coroutine version of generator, for asynchronous experiments.
+
+    Args:
+        em (utils.ExperimentManager): manager running the experiment
+        node (str): name of the node to connect to
+        n_runs (int): number of experiments to prepare states for
+        targets (iterable): name of the target nodes
+        barrier (utils.AsyncBarrier): control qubit flow
+    """
+    async with utils.AsyncCQCConnection(em, node) as Generator:
+        logging.info("GEN\t: Generator connected to node %s.", node)
+        for i in range(n_runs):
+            qs = await Generator.call(prepare_qubits, Generator.connection)
+
+            # Wait until all parties are ready for another qubit
+            await barrier.wait()
+            # Share qubits with targets
+            for target, q in zip(targets, qs):
+                await Generator.sendQubit(q, target)
+
+            if n_runs < 10:
+                logging.info("GEN\t: %d of %d sent.", i, n_runs)
+            elif i % (n_runs // 8) == 0:
+                logging.info("GEN\t: %d of %d sent.", i, n_runs)
+
+async def measurement_async(em, node, n_runs, seed, bases, barrier):
+    """ Coroutine version of measurement, for asynchronous experiments.
+
+    Args:
+        em (utils.ExperimentManager): manager running the experiment
+        node (str): name of the node to connect to
+        seed (iterable): list-type object containing a set of random bits to be
+            used as measurement bases
+        basis (tuple): pair of lists of rotations to apply to set up the 
+            required measurement bases
+        barrier (utils.AsyncBarrier): control qubit flow
+
+    Return:
+        (np.ndarray): (2, n_runs) array of measurement bases and results
+    """
+    results = -1 * np.ones((2, n_runs), dtype=np.int8)
+    async with utils.AsyncCQCConnection(em, node) as Meas:
+        logging.info("MEAS\t: Measurement connected to node %s.", node)
+        for i in range(n_runs):
+            x = seed[i]
+            # Wait until all parties are ready for another qubit
+            await barrier.wait()
+            # Get qubit from generator
+            q = await Meas.recvQubit()
+            # Apply rotations
+            await Meas.call(utils.change_basis, q, bases[x])
+
+            results[0,i] = x
+            results[1,i] = await Meas.call(q.measure)
+
+    return results
+
+def prepare_state():
+    """ Prepare the four-partite entangled state as a single state vector.
+
+    Applies the same gates as the generator (see paper supplementary 
+    information equation 8), but once rather than every round.
+
+    Return:
+        (np.ndarray): (1, 16) state vector, SysA the first qubit.
+    """
+    state = statevector.zero_state(4)
+    state = statevector.apply_gate(state, statevector.H, 0)
+    state = statevector.cnot(state, 0, 1)
+    state = statevector.apply_gate(state, statevector.H, 2)
+    state = statevector.cnot(state, 2, 3)
+    state = statevector.apply_gate(state, statevector.H, 1)
+    state = statevector.apply_gate(state, statevector.H, 3)
+    state = statevector.cnot(state, 0, 3)
+    state = statevector.cnot(state, 1, 3)
+    state = statevector.cphase(state, 0, 2)
+    state = statevector.cphase(state, 1, 2)
+    return state
+
+def simulate(n_runs, seeds, bases):
+    """ Simulate the generator and all measurement systems natively.
+
+    Prepare the four-partite state once, then for each batch of rounds apply
+    every system's seeded basis transformation and sample all four results in
+    one step.
+
+    Args:
+        n_runs (int): number of experiments to simulate
+        seeds (list): random bits choosing each system's bases
+        bases (tuple): pair of measurement bases used by every system
+
+    Return:
+        (np.ndarray): (n_systems, 2, n_runs) array of bases and results
+    """
+    results = -1 * np.ones((len(seeds), 2, n_runs), dtype=np.int8)
+    state = prepare_state()
+    rotations = statevector.basis_rotations(bases)
+    for start in range(0, n_runs, statevector.CHUNK_SIZE):
+        stop = min(start + statevector.CHUNK_SIZE, n_runs)
+        states = np.repeat(state, stop - start, axis=0)
+        for p, seed in enumerate(seeds):
+            x = np.asarray(seed[start:stop])
+            states = statevector.apply_gate(states, rotations[x], p)
+            results[p][0,start:stop] = x
+        outcomes = statevector.measure(states)
+        for p in range(len(seeds)):
+            results[p][1,start:stop] = outcomes[:,p]
+
+    return results
+
+def extract(results, weak_source, block_size, k_1, k_2, epsilon, carry=None):
+    """ Pass the device outputs through a classical two-source extractor.
+
+    The outcomes of all four devices, taken round by round, form the first 
+    source. The second is a fresh stretch of the weak source, not used to 
+    choose measurement bases.
+
+    Bits short of a whole block are handed back rather than dropped, so that
+    chunks of results can be extracted in turn, each continuing the last.
+
+    Args:
+        results (np.ndarray): (4, 2, n_runs) array of bases and results
+        weak_source (iterable): bits of the weak source, at least 4*n_runs
+        block_size (int): number of bits per extractor block
+        k_1 (float): min-entropy of each block of device outputs
+        k_2 (float): min-entropy of each block of the weak source
+        epsilon (float): distance from uniform accepted in the extracted bits
+        carry (tuple): device outputs and weak source bits left over from
+            the previous chunk, defaults to None
+
+    Return:
+        (np.ndarray): extracted random bits, one per block
+        (tuple): device outputs and weak source bits short of a block
+    """
+    outputs = results[:,1,:].T.ravel()
+    weak_source = np.asarray(weak_source[:len(outputs)], dtype=np.int8)
+    if carry is not None:
+        outputs = np.concatenate([carry[0], outputs])
+        weak_source = np.concatenate([carry[1], weak_source])
+    n = len(outputs) // block_size * block_size
+    extracted = utils.inner_product_extractor(outputs[:n], weak_source[:n],
+                                              block_size, k_1, k_2, epsilon)
+    return extracted, (outputs[n:], weak_source[n:])
+
+def run_experiment(args, network, seeds, profiler=None):
+    """ Run the experiment for one set of seeds.
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+        network (dict): network parameters
+        seeds (list): random bits choosing each system's bases
+        profiler (utils.Profiler): if set, time the parties' calls
+
+    Return:
+        (np.ndarray): (4, 2, n_runs) array of bases and results
+    """
+    n_runs = len(seeds[0])
+    pool = utils.get_network_pool() if args.pool else None
+    # Run the experiment
+    em = utils.ExperimentManager(network, native=args.native,
+                                 pool=pool,
+                                 profiler=profiler,
+                                 asynchronous=args.asyncio)
+    if args.native:
+        em.start([(simulate, [n_runs, seeds, ('X','Z')])])
+        results, = em.join()
+    elif args.asyncio:
+        qubit_control_barrier = utils.AsyncBarrier(len(network['nodes']))
+        parties = [(generator_async, [em, 
+                                      network['nodes'][0],
+                                      n_runs,
+                                      network['nodes'][1:],
+                                      qubit_control_barrier]
+                   )]
+        for node, seed in zip(network['nodes'][1:], seeds):
+            parties.append((measurement_async, [em, node, n_runs, seed, 
+                                                ('X','Z'),
+                                                qubit_control_barrier]))
+        em.start(parties)
+        results = np.stack(em.join()[1:])
+    else:
+        qubit_control_barrier = Barrier(len(network['nodes']))
+        em.start([(generator, [em.network_name, 
+                               network['nodes'][0], 
+                               n_runs,
+                               network['nodes'][1:],
+                               qubit_control_barrier
+                              ]
+                   ),
+                   (measurement, [em.network_name,
+                                  network['nodes'][1],
+                                  n_runs,
+                                  seeds[0],
+                                  ('X','Z'),
+                                  qubit_control_barrier]
+                   ),
+                   (measurement, [em.network_name,
+                                  network['nodes'][2],
+                                  n_runs,
+                                  seeds[1],
+                                  ('X','Z'),
+                                  qubit_control_barrier]
+                   ),
+                   (measurement, [em.network_name,
+                                  network['nodes'][3],
+                                  n_runs,
+                                  seeds[2],
+                                  ('X','Z'),
+                                  qubit_control_barrier]
+                   ),
+                   (measurement, [em.network_name,
+                                  network['nodes'][4],
+                                  n_runs,
+                                  seeds[3],
+                                  ('X','Z'),
+                                  qubit_control_barrier]
+                   )
+                 ])
+        results = np.stack(em.join()[1:])
+
+    return results
+
 def main(args):
     logging.basicConfig(format=utils.LOG_FORMAT, level=utils.LOG_LEVEL)
     # Define network parameters
@@ -117,68 +359,137 @@ def main(args):
                             'SysD': []
                            }
                }
-    # Define required SimulaQron parameters
-    #backend = {}
-    with open(args.seed_source, 'r') as f:
-        seed = np.array(list(f.read())).astype(int)
-    seeds = [seed[i:4*args.n_runs:4] for i in range(4)]
-    # Prepare bits'n'pieces
-    results = [-1*np.ones((2, args.n_runs)) for _ in range(4)]
-    qubit_control_barrier = Barrier(len(network['nodes']))
-    # Run the experiment
-    em = utils.ExperimentManager(network)#, backend)
-    em.start([(generator, [network['name'], 
-                           network['nodes'][0], 
-                           args.n_runs,
-                           network['nodes'][1:],
-                           qubit_control_barrier
-                          ]
-               ),
-               (measurement, [network['name'],
-                              network['nodes'][1],
-                              args.n_runs,
-                              seeds[0], results[0], 
-                              ('X','Z'),
-                              qubit_control_barrier]
-               ),
-               (measurement, [network['name'],
-                              network['nodes'][2],
-                              args.n_runs,
-                              seeds[1], results[1], 
-                              ('X','Z'),
-                              qubit_control_barrier]
-               ),
-               (measurement, [network['name'],
-                              network['nodes'][3],
-                              args.n_runs,
-                              seeds[2], results[2], 
-                              ('X','Z'),
-                              qubit_control_barrier]
-               ),
-               (measurement, [network['name'],
-                              network['nodes'][4],
-                              args.n_runs,
-                              seeds[3], results[3], 
-                              ('X','Z'),
-                              qubit_control_barrier]
-               )
-             ])
-    em.join()
-
-    results = np.stack(results)
-
-    print(utils.estimate_FPB(results[:,0,:], results[:,1,:]))
-    np.save(args.outpath, results)
+    if args.network_name is not None:
+        network['name'] = args.network_name
+    if args.port_base is not None:
+        network['port_base'] = args.port_base
+    profiler = None if args.profile is None else utils.Profiler(args.profile)
+    if args.block_size is not None:
+        # Check the extractor can be used before running the experiment
+        k_1 = args.output_entropy * args.block_size
+        k_2 = args.source_entropy * args.block_size
+        bound = utils.inner_product_bound(args.block_size, args.epsilon)
+        if k_1 + k_2 <= bound:
+            raise ValueError("Blocks of {} bits hold {:.1f} bits of "
+                             "min-entropy, extraction needs more than {:.1f}."
+                             .format(args.block_size, k_1 + k_2, bound))
 
-if __name__ == "__main__":
+    if args.chunk_size is None:
+        with utils.open_seed(args.seed_source, args.seed_cursor) as seed:
+            seeds = seed.take(args.n_runs, 4)
+            results = run_experiment(args, network, seeds, profiler)
+            if args.block_size is not None:
+                weak_source, = seed.take(4*args.n_runs)
+                weak_source = np.asarray(weak_source, dtype=np.int8)
+
+        FPB_est = utils.estimate_FPB(results[:,0,:], results[:,1,:])
+        if args.packed:
+            utils.PackedResults.from_array(
+                results, {'fields': ['system', 'basis/result']}
+                ).save(args.outpath)
+        else:
+            np.save(args.outpath, results)
+
+        if args.block_size is not None:
+            extracted, carry = extract(results, weak_source, 
+                                       args.block_size, k_1, k_2, 
+                                       args.epsilon)
+    else:
+        # Checkpoint each chunk, resuming any previous run
+        run = utils.ChunkedRun(args.outpath, args.n_runs, args.chunk_size,
+                               args.packed)
+        # Track the seed used with the checkpoint, unless told otherwise
+        with utils.open_seed(args.seed_source, 
+                             args.seed_cursor or run.seed_cursor) as seed:
+            for index, start, stop in run.pending():
+                results = run_experiment(args, network, 
+                                         seed.take(stop - start, 4), profiler)
+                if args.block_size is not None:
+                    # Store the chunk's weak source with it, as a third field
+                    # of each system, so extraction can be repeated on resuming
+                    weak_source, = seed.take(4*(stop - start))
+                    weak_source = np.asarray(weak_source, dtype=np.int8)
+                    results = np.concatenate(
+                        (results, weak_source.reshape(-1, 4).T[:,None,:]), 
+                        axis=1)
+                run.save(index, results)
+        fpb = utils.FPBAccumulator()
+        extracted = []
+        carry = None
+        for index, start, stop in run.chunks():
+            if args.packed:
+                # Score the packed bits directly
+                packed = run.load(index, unpack=False)
+                fpb.update_packed([packed.field((p, 0)) for p in range(4)],
+                                  [packed.field((p, 1)) for p in range(4)],
+                                  packed.mask)
+                if args.block_size is not None:
+                    results = packed.to_array()
+            else:
+                results = run.load(index)
+                fpb.update(results[:,0,:], results[:,1,:])
+            if args.block_size is not None:
+                if results.shape[1] < 3:
+                    raise ValueError("Chunk {} was run without a block size, "
+                                     "so has no weak source to extract with."
+                                     .format(index))
+                weak_source = results[:,2,:].T.ravel()
+                bits, carry = extract(results, weak_source, 
+                                      args.block_size, k_1, k_2, 
+                                      args.epsilon, carry)
+                extracted.append(bits)
+        FPB_est = fpb.estimate
+        if args.block_size is not None:
+            extracted = np.concatenate(extracted)
+
+    print(FPB_est)
+    if args.block_size is not None:
+        logging.info("MAIN\t: Extracted %d bits, %d output bits short of a "
+                     "block unused.", len(extracted), len(carry[0]))
+        np.save(args.outpath + "_extracted", extracted)
+
+    return {'FPB_est': FPB_est,
+            'n_extracted': None if args.block_size is None else len(extracted)}
+
+def get_parser():
+    """ Command line arguments for the experiment. """
     parser = argparse.ArgumentParser(
         description="Random number expansion certified by Bell's theorem.")
     parser.add_argument("n_runs", type=int,
                         help="number of times to query measurement systems")
     parser.add_argument("--seed_source", '-s', default="anu_seed.txt",
-                        help="source file for random seed")
+                        help="source file for random seed, or local")
+    parser.add_argument("--seed_cursor", default=None,
+                        help="if set, file recording seed bits already used, "
+                             "kept with the checkpoint when chunking if unset")
     parser.add_argument("--outpath", '-o', default="results",
                         help="path for storing results")
-    args = parser.parse_args()
+    parser.add_argument("--native", action="store_true",
+                        help="simulate natively rather than with SimulaQron")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run parties as coroutines on one event loop")
+    parser.add_argument("--block_size", '-b', type=int, default=None,
+                        help="if set, extract from results in blocks of this size")
+    parser.add_argument("--output_entropy", type=float, default=0.9,
+                        help="min-entropy per bit of the device outputs")
+    parser.add_argument("--source_entropy", type=float, default=0.9,
+                        help="min-entropy per bit of the weak source")
+    parser.add_argument("--epsilon", type=float, default=1e-3,
+                        help="distance from uniform accepted in extracted bits")
+    parser.add_argument("--chunk_size", '-c', type=int, default=None,
+                        help="if set, checkpoint results in chunks of this many runs")
+    parser.add_argument("--packed", action="store_true",
+                        help="store results bit-packed rather than as .npy")
+    parser.add_argument("--profile", default=None,
+                        help="if set, prefix of files to save a timing profile to")
+    parser.add_argument("--pool", action="store_true",
+                        help="keep the network running for the next experiment")
+    parser.add_argument("--network_name", default=None,
+                        help="if set, name of the SimulaQron network")
+    parser.add_argument("--port_base", type=int, default=None,
+                        help="if set, first port of the SimulaQron network")
+    return parser
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
     main(args)
-    
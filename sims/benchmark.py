@@ -0,0 +1,359 @@
+import argparse
+import contextlib
+import csv
+import datetime
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import utils
+
+""" Benchmark the experiments and post-processing kernels in this directory.
+
+Two kinds of benchmark are run, each at several problem sizes n:
+
+    sims: whole experiments (certified_expansion, amplification_four_devices,
+        generation_polarisation and the BB84_QKD example), run through their
+        own main and reported in rounds per second.
+    kernels: the post-processing routines the experiments spend their time in
+        (estimate_CHSH, estimate_FPB, the extractors, BB84 key sifting of
+        one run or a stack of runs at once, key reconciliation and privacy
+        amplification), run on random inputs and reported in input bits per
+        second.
+
+Every measurement is appended as a row of a CSV table tagged with the commit,
+host, Python and NumPy versions and the backend, so that tables from different
+revisions or backends can be compared, e.g.
+
+    python benchmark.py --backend native --table bench.csv
+    python benchmark.py --backend native --compare bench.csv
+
+flags any benchmark whose rate has dropped by more than the tolerance against
+the latest matching row of bench.csv.
+"""
+
+BB84_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'simple_examples', 'BB84_QKD')
+
+SIM_SIZES = {'native': [1000, 10000, 100000],
+             'simulaqron': [10, 100, 1000],
+             'asyncio': [10, 100, 1000]}
+KERNEL_SIZES = [10000, 100000, 1000000]
+
+# Min-entropy rate and distance from uniform used for the extractor kernels
+EXTRACTOR_RATE = 0.5
+EXTRACTOR_EPSILON = 1e-6
+# Error rate between the keys given to the reconciliation kernels
+RECONCILE_QBER = 0.03
+# Number of runs the sift_keys kernel sifts at once
+SIFT_RUNS = 16
+
+def sim_argv(script, n, backend):
+    """ Command line arguments for one run of an experiment.
+
+    Args:
+        script (str): name of the experiment module.
+        n (int): number of rounds.
+        backend (str): one of native, simulaqron or asyncio.
+
+    Return:
+        (list): arguments for the experiment's parser.
+    """
+    argv = {'certified_expansion': [str(n), '0.99', '-s', 'local'],
+            'amplification_four_devices': [str(n), '-s', 'local'],
+            'generation_polarisation': [str(n)]}[script]
+    if backend == 'native':
+        argv.append('--native')
+    elif backend == 'asyncio':
+        if script == 'generation_polarisation':
+            return None
+        argv.extend(['--asyncio', '--pool'])
+    else:
+        argv.append('--pool')
+    return argv
+
+def time_sim(script, n, backend):
+    """ Time one run of an experiment.
+
+    The run takes place in a temporary directory so that its results don't
+    overwrite any in the working directory.
+
+    Args:
+        script (str): name of the experiment module.
+        n (int): number of rounds.
+        backend (str): one of native, simulaqron or asyncio.
+
+    Return:
+        (float): wall-clock time of the run in seconds, None if the
+            experiment has no such backend.
+    """
+    if script == 'BB84_QKD':
+        return time_bb84(n, backend)
+    argv = sim_argv(script, n, backend)
+    if argv is None:
+        return None
+    module = __import__(script)
+    args = module.get_parser().parse_args(argv)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            start = time.perf_counter()
+            module.main(args)
+            return time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+def time_bb84(n, backend):
+    """ Time the exchange of n qubits in the BB84_QKD example.
+
+    The example only runs on SimulaQron, through its own ThreadManager.
+
+    Args:
+        n (int): number of qubits sent from Alice to Bob.
+        backend (str): one of native, simulaqron or asyncio.
+
+    Return:
+        (float): wall-clock time of the exchange in seconds, None if the
+            backend isn't simulaqron.
+    """
+    if backend != 'simulaqron':
+        return None
+    if BB84_DIR not in sys.path:
+        sys.path.append(BB84_DIR)
+    import BB84_QKD
+    start = time.perf_counter()
+    tm = BB84_QKD.ThreadManager(n, False, None)
+    tm.start(False)
+    tm.join()
+    return time.perf_counter() - start
+
+def kernel_inputs(name, n):
+    """ Random inputs for a post-processing kernel.
+
+    Args:
+        name (str): name of the kernel, a key of KERNELS.
+        n (int): number of rounds, or source bits for the extractors.
+
+    Return:
+        (tuple): function to time, its arguments and the number of input bits.
+    """
+    bits = lambda *shape: np.random.randint(2, size=shape, dtype=np.int8)
+    if name == 'estimate_CHSH':
+        return utils.estimate_CHSH, bits(4, n), 4*n
+    if name == 'estimate_CHSH_packed':
+        packed = np.packbits(bits(4, n), axis=1)
+        return (lambda *a: utils.estimate_CHSH(*a, packed=True, n=n),
+                packed, 4*n)
+    if name == 'estimate_FPB':
+        return utils.estimate_FPB, bits(2, 4, n), 8*n
+    if name in utils.EXTRACTORS:
+        extractor = utils.EXTRACTORS[name](512)
+        k = EXTRACTOR_RATE * n
+        seed = bits(extractor.seed_length(n, k, EXTRACTOR_EPSILON))
+        return (extractor.extract, (bits(n), seed, k, EXTRACTOR_EPSILON), n)
+    if name == 'generate_key':
+        if BB84_DIR not in sys.path:
+            sys.path.append(BB84_DIR)
+        import BB84_QKD
+        results = bits(2, 2, n).astype(float)
+        return (lambda a, b: BB84_QKD.generate_key(a, b, 0.1), results, 4*n)
+    if name == 'sift_keys':
+        if BB84_DIR not in sys.path:
+            sys.path.append(BB84_DIR)
+        import BB84_QKD
+        results = bits(2, SIFT_RUNS, 2, n // SIFT_RUNS)
+        return (lambda a, b: BB84_QKD.sift_keys(a, b, 0.1), results, 4*n)
+    if name in ('cascade', 'ldpc'):
+        if BB84_DIR not in sys.path:
+            sys.path.append(BB84_DIR)
+        import reconciliation
+        reconciler = {'cascade': reconciliation.Cascade,
+                      'ldpc': reconciliation.LDPC}[name]()
+        alice_key = bits(n).astype(np.uint8)
+        bob_key = alice_key ^ (np.random.random_sample(n) < RECONCILE_QBER)
+        return (reconciler.reconcile, (alice_key, bob_key, RECONCILE_QBER), n)
+    if name == 'amplify':
+        if BB84_DIR not in sys.path:
+            sys.path.append(BB84_DIR)
+        import amplification
+        key = bits(n).astype(np.uint8)
+        n_leaked = int(0.3 * n)
+        return (amplification.PrivacyAmplifier().amplify_keys,
+                (key, key.copy(), RECONCILE_QBER, n_leaked), 2*n)
+    raise ValueError("Unknown kernel {}.".format(name))
+
+def time_kernel(name, n):
+    """ Time one call of a post-processing kernel on random inputs.
+
+    Args:
+        name (str): name of the kernel, a key of KERNELS.
+        n (int): number of rounds, or source bits for the extractors.
+
+    Return:
+        (tuple): wall-clock time of the call in seconds and the number of
+            input bits processed.
+    """
+    func, args, n_bits = kernel_inputs(name, n)
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start, n_bits
+
+SIMS = ['certified_expansion', 'amplification_four_devices',
+        'generation_polarisation', 'BB84_QKD']
+KERNELS = ['estimate_CHSH', 'estimate_CHSH_packed', 'estimate_FPB',
+           'carter_wegman', 'toeplitz', 'generate_key', 'sift_keys',
+           'cascade', 'ldpc', 'amplify']
+
+def environment(backend):
+    """ Columns identifying where and on what a benchmark was run.
+
+    Args:
+        backend (str): one of native, simulaqron or asyncio.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                universal_newlines=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'host': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'backend': backend}
+
+def run_benchmarks(args):
+    """ Run the selected benchmarks, keeping the best of the repeats.
+
+    Logging and printing are silenced while timing, as the experiments
+    report every round.
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments.
+
+    Return:
+        (list): one row of results per benchmark and size.
+    """
+    env = environment(args.backend)
+    jobs = []
+    if args.kind in ('all', 'sims'):
+        sizes = args.sizes or SIM_SIZES[args.backend]
+        jobs += [('sim', name, n) for name in args.sims for n in sizes]
+    if args.kind in ('all', 'kernels'):
+        sizes = args.sizes or KERNEL_SIZES
+        jobs += [('kernel', name, n) for name in args.kernels for n in sizes]
+
+    rows = []
+    for kind, name, n in jobs:
+        best = None
+        for _ in range(args.repeats):
+            logging.disable(logging.INFO)
+            try:
+                with open(os.devnull, 'w') as null, \
+                        contextlib.redirect_stdout(null):
+                    if kind == 'sim':
+                        seconds, amount = time_sim(name, n, args.backend), n
+                    else:
+                        seconds, amount = time_kernel(name, n)
+            finally:
+                logging.disable(logging.NOTSET)
+            if seconds is None:
+                break
+            best = seconds if best is None else min(best, seconds)
+        if best is None:
+            logging.info("BENCH\t: %s has no %s backend, skipping.", name,
+                         args.backend)
+            continue
+        row = dict(env, benchmark=name, n=n, seconds=best,
+                   rate=amount / best,
+                   unit='rounds/s' if kind == 'sim' else 'bits/s')
+        logging.info("BENCH\t: %s n=%d %.4gs %.4g %s", name, n, best,
+                     row['rate'], row['unit'])
+        rows.append(row)
+    return rows
+
+def compare(rows, path, tolerance):
+    """ Compare benchmark rates against a baseline table.
+
+    Each row is compared with the latest row of the baseline for the same
+    benchmark, backend and size.
+
+    Args:
+        rows (list): rows returned by run_benchmarks.
+        path (str): path of the baseline CSV table.
+        tolerance (float): fractional drop in rate reported as a regression.
+
+    Return:
+        (list): (benchmark, n, baseline rate, rate) of each regression.
+    """
+    baseline = {}
+    with open(path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            key = (row['benchmark'], row['backend'], int(row['n']))
+            baseline[key] = float(row['rate'])
+    regressions = []
+    for row in rows:
+        key = (row['benchmark'], row['backend'], row['n'])
+        if key not in baseline:
+            continue
+        change = row['rate'] / baseline[key] - 1
+        logging.info("BENCH\t: %s n=%d %+.1f%% against %s.", row['benchmark'],
+                     row['n'], 100*change, path)
+        if change < -tolerance:
+            regressions.append((row['benchmark'], row['n'], baseline[key],
+                                row['rate']))
+            logging.warning("BENCH\t: %s n=%d regressed from %.4g to %.4g %s.",
+                            row['benchmark'], row['n'], baseline[key],
+                            row['rate'], row['unit'])
+    return regressions
+
+def main(args):
+    logging.basicConfig(format=utils.LOG_FORMAT, level=utils.LOG_LEVEL)
+    rows = run_benchmarks(args)
+    regressions = []
+    if args.compare is not None:
+        regressions = compare(rows, args.compare, args.tolerance)
+    if args.table is not None:
+        utils.write_table(rows, args.table, append=True)
+        logging.info("MAIN\t: %d benchmarks written to %s.", len(rows),
+                     args.table)
+    return regressions
+
+def get_parser():
+    """ Command line arguments for the benchmarks. """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the experiments and post-processing kernels.")
+    parser.add_argument("--backend", choices=["native", "simulaqron", "asyncio"],
+                        default="native",
+                        help="how the experiments are simulated")
+    parser.add_argument("--kind", choices=["all", "sims", "kernels"],
+                        default="all", help="which benchmarks to run")
+    parser.add_argument("--sims", nargs='+', choices=SIMS, default=SIMS,
+                        help="experiments to benchmark")
+    parser.add_argument("--kernels", nargs='+', choices=KERNELS,
+                        default=KERNELS, help="kernels to benchmark")
+    parser.add_argument("--sizes", '-n', nargs='+', type=int, default=None,
+                        help="if set, problem sizes replacing the defaults")
+    parser.add_argument("--repeats", '-r', type=int, default=3,
+                        help="number of runs per benchmark, the fastest is kept")
+    parser.add_argument("--table", '-t', default="benchmarks.csv",
+                        help="CSV table the results are appended to")
+    parser.add_argument("--compare", default=None,
+                        help="if set, baseline CSV table to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fractional drop in rate reported as a regression")
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    regressions = main(args)
+    sys.exit(1 if regressions else 0)
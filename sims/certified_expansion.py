@@ -3,6 +3,7 @@ from cqc.pythonLib import CQCConnection, qubit
 import numpy as np
 import logging
 from threading import Barrier
+import statevector
 import utils
 
 """ Random number expansion certified by Bell's theorem.
@@ -18,11 +19,13 @@ TODO:
     move network setup into config file?
     move SimQ setup to command line for experiment control?
 """
-def generator(network, node, n_runs, target_A, target_B, barrier):
+def generator(network, node, n_runs, target_A, target_B, barrier,
+              batch_size=1):
     """ Generate an EPR pair and share with measurement systems.
     
     Generate a maximally entangled EPR state and send it to the systems located
-    at the specified targets:
+    at the specified targets. Pairs are sent in batches, synchronising with 
+    the measurement systems once per batch:
 
     Args:
         network (str): name of the network to connect to
@@ -30,22 +33,27 @@ def generator(network, node, n_runs, target_A, target_B, barrier):
         n_runs (int): number of EPR pairs to generate
         target_A (str): name of the first target node
         target_B (str): name of the second target node
+        barrier (threading.Barrier): control qubit flow
+        batch_size (int): number of EPR pairs to send per synchronisation
     """
     with CQCConnection(node, network_name=network) as Generator:
         logging.info("GEN\t: Generator connected to node %s.", node)
-        for _ in range(n_runs):
-            # Wait until all parties are ready for another qubit
+        for start in range(0, n_runs, batch_size):
+            # Wait until all parties are ready for another batch
             barrier.wait()
             # Share qubits with targets
-            q = Generator.createEPR(target_A)
-            Generator.sendQubit(q, target_B)
+            for _ in range(min(batch_size, n_runs - start)):
+                q = Generator.createEPR(target_A)
+                Generator.sendQubit(q, target_B)
 
-def measurement(network, node, n_runs, seed, results, bases, recvEPR, barrier):
+def measurement(network, node, n_runs, seed, bases, recvEPR, barrier,
+                batch_size=1):
     """ Recieve entangled qubit and perform random basis measurement.
 
     Recieves one of the EPR qubits from the generator and performs one of two
     specified basis measurements as decided by the next bit in the seed. Stores
-    each measurement result, basis and qubit EPR ID as it goes.
+    each measurement result as it goes. Qubits are received in batches, 
+    synchronising with the generator once per batch.
 
     Args:
         network (str): name of the network to connect to
@@ -53,27 +61,125 @@ def measurement(network, node, n_runs, seed, results, bases, recvEPR, barrier):
         n_runs (int): number of qubits to measure
         seed (iterable): list-type object containing a set of random bits to be
             used as measurement bases
-        results (np.ndarray): array for storing measurement bases, results 
-            and qubit IDs
         basis (tuple): pair of lists of rotations to apply to set up the 
             required measurement bases
         recv_EPR (bool): will this node be recieving an EPR pair?
+        barrier (threading.Barrier): control qubit flow
+        batch_size (int): number of qubits to receive per synchronisation
+
+    Return:
+        (np.ndarray): measurement results
     """
+    results = -1 * np.ones(n_runs, dtype=np.int8)
     with CQCConnection(node, network_name=network) as Meas:
         logging.info("MEAS\t: Measurement connected to node %s.", node)
-        for i in range(n_runs):
-            x = seed[i]
-            # Wait until all parties are ready for another qubit
+        for start in range(0, n_runs, batch_size):
+            # Wait until all parties are ready for another batch
             barrier.wait()
-            # Get qubit from generator
-            if recvEPR:
-                q = Meas.recvEPR()
-            else:
-                q = Meas.recvQubit()
-            # Apply rotations
-            utils.change_basis(q, bases[x])
-            
-            results[i] = q.measure()
+            for i in range(start, min(start + batch_size, n_runs)):
+                x = seed[i]
+                # Get qubit from generator
+                if recvEPR:
+                    q = Meas.recvEPR()
+                else:
+                    q = Meas.recvQubit()
+                # Apply rotations
+                utils.change_basis(q, bases[x])
+                
+                results[i] = q.measure()
+
+    return results
+
+async def generator_async(em, node, n_runs, target_A, target_B, barrier,
+                          batch_size=1):
+    """ Coroutine version of generator, for asynchronous experiments.
+
+    Args:
+        em (utils.ExperimentManager): manager running the experiment
+        node (str): name of the node to connect to
+        n_runs (int): number of EPR pairs to generate
+        target_A (str): name of the first target node
+        target_B (str): name of the second target node
+        barrier (utils.AsyncBarrier): control qubit flow
+        batch_size (int): number of EPR pairs to send per synchronisation
+    """
+    async with utils.AsyncCQCConnection(em, node) as Generator:
+        logging.info("GEN\t: Generator connected to node %s.", node)
+        for start in range(0, n_runs, batch_size):
+            # Wait until all parties are ready for another batch
+            await barrier.wait()
+            # Share qubits with targets
+            for _ in range(min(batch_size, n_runs - start)):
+                q = await Generator.createEPR(target_A)
+                await Generator.sendQubit(q, target_B)
+
+async def measurement_async(em, node, n_runs, seed, bases, recvEPR, barrier,
+                            batch_size=1):
+    """ Coroutine version of measurement, for asynchronous experiments.
+
+    Args:
+        em (utils.ExperimentManager): manager running the experiment
+        node (str): name of the node to connect to
+        n_runs (int): number of qubits to measure
+        seed (iterable): list-type object containing a set of random bits to be
+            used as measurement bases
+        basis (tuple): pair of lists of rotations to apply to set up the 
+            required measurement bases
+        recv_EPR (bool): will this node be recieving an EPR pair?
+        barrier (utils.AsyncBarrier): control qubit flow
+        batch_size (int): number of qubits to receive per synchronisation
+
+    Return:
+        (np.ndarray): measurement results
+    """
+    results = -1 * np.ones(n_runs, dtype=np.int8)
+    async with utils.AsyncCQCConnection(em, node) as Meas:
+        logging.info("MEAS\t: Measurement connected to node %s.", node)
+        for start in range(0, n_runs, batch_size):
+            # Wait until all parties are ready for another batch
+            await barrier.wait()
+            for i in range(start, min(start + batch_size, n_runs)):
+                x = seed[i]
+                # Get qubit from generator
+                if recvEPR:
+                    q = await Meas.recvEPR()
+                else:
+                    q = await Meas.recvQubit()
+                # Apply rotations
+                await Meas.call(utils.change_basis, q, bases[x])
+
+                results[i] = await Meas.call(q.measure)
+
+    return results
+
+def simulate(n_runs, seed_A, seed_B, bases_A, bases_B):
+    """ Simulate the generator and both measurement systems natively.
+
+    Rather than passing qubits through the SimulaQron network, prepare the
+    EPR pairs of many rounds at once as a batch of state vectors, apply each
+    system's seeded basis transformation and sample the measurement results.
+
+    Args:
+        n_runs (int): number of EPR pairs to generate
+        seed_A (iterable): random bits choosing system A's bases
+        seed_B (iterable): random bits choosing system B's bases
+        bases_A (tuple): pair of measurement bases for system A
+        bases_B (tuple): pair of measurement bases for system B
+
+    Yield:
+        (tuple): start and stop of each batch of rounds, and the (n, 2) 
+            results of systems A and B
+    """
+    rotations_A = statevector.basis_rotations(bases_A)
+    rotations_B = statevector.basis_rotations(bases_B)
+    for start in range(0, n_runs, statevector.CHUNK_SIZE):
+        stop = min(start + statevector.CHUNK_SIZE, n_runs)
+        x = np.asarray(seed_A[start:stop])
+        y = np.asarray(seed_B[start:stop])
+        states = statevector.epr_pairs(stop - start)
+        states = statevector.apply_gate(states, rotations_A[x], 0)
+        states = statevector.apply_gate(states, rotations_B[y], 1)
+        yield start, stop, statevector.measure(states)
 
 def calculate_statistical_correction(n, alpha):
     """ Determine finite stastistics correction factor.
@@ -102,6 +208,100 @@ def calculate_min_entropy_bound(n, I_est, epsilon):
     return n * f
 
 
+def run_experiment(args, network, backend, seed_A, seed_B, profiler=None):
+    """ Run the experiment for one set of seeds.
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+        network (dict): network parameters
+        backend (dict): SimulaQron parameters
+        seed_A (iterable): random bits choosing system A's bases
+        seed_B (iterable): random bits choosing system B's bases
+        profiler (utils.Profiler): if set, time the parties' calls
+
+    Return:
+        (tuple): results of systems A and B
+    """
+    n_runs = len(seed_A)
+    pool = utils.get_network_pool() if args.pool else None
+    # Run the experiment
+    em = utils.ExperimentManager(network, backend, native=args.native,
+                                 pool=pool,
+                                 profiler=profiler,
+                                 asynchronous=args.asyncio)
+    if args.native:
+        em.start([(simulate, [n_runs,
+                              seed_A, seed_B,
+                              ('X','Z'), ('X+Z','X-Z')]
+                  )
+                 ])
+        results = -1 * np.ones((2, n_runs), dtype=np.int8)
+        for _, (start, stop, outcomes) in em.stream():
+            results[:,start:stop] = outcomes.T
+        em.join()
+        results_A, results_B = results
+    elif args.asyncio:
+        batch_size = utils.limit_batch_size(args.batch_size)
+        qubit_control_barrier = utils.AsyncBarrier(len(network['nodes']))
+        em.start([(generator_async, [em,
+                                     network['nodes'][0],
+                                     n_runs,
+                                     network['nodes'][1],
+                                     network['nodes'][2],
+                                     qubit_control_barrier,
+                                     batch_size]
+                   ),
+                   (measurement_async, [em,
+                                        network['nodes'][1],
+                                        n_runs,
+                                        seed_A,
+                                        ('X','Z'), True,
+                                        qubit_control_barrier,
+                                        batch_size]
+                   ),
+                   (measurement_async, [em,
+                                        network['nodes'][2],
+                                        n_runs,
+                                        seed_B,
+                                        ('X+Z','X-Z'), False,
+                                        qubit_control_barrier,
+                                        batch_size]
+                   )
+                 ])
+        _, results_A, results_B = em.join()
+    else:
+        batch_size = utils.limit_batch_size(args.batch_size)
+        qubit_control_barrier = Barrier(len(network['nodes']))
+        em.start([(generator, [em.network_name, 
+                               network['nodes'][0], 
+                               n_runs,
+                               network['nodes'][1], 
+                               network['nodes'][2],
+                               qubit_control_barrier,
+                               batch_size
+                               ]
+                   ),
+                   (measurement, [em.network_name,
+                                  network['nodes'][1],
+                                  n_runs,
+                                  seed_A,
+                                  ('X','Z'), True,
+                                  qubit_control_barrier,
+                                  batch_size]
+                   ),
+                   (measurement, [em.network_name,
+                                  network['nodes'][2],
+                                  n_runs,
+                                  seed_B,
+                                  ('X+Z','X-Z'), False,
+                                  qubit_control_barrier,
+                                  batch_size]
+                   )
+                 ])
+        _, results_A, results_B = em.join()
+
+    return results_A, results_B
+
 def main(args):
     logging.basicConfig(format=utils.LOG_FORMAT, level=utils.LOG_LEVEL)
     # Define network parameters
@@ -112,47 +312,48 @@ def main(args):
                             'SysB' : []
                             }
                }
+    if args.network_name is not None:
+        network['name'] = args.network_name
+    if args.port_base is not None:
+        network['port_base'] = args.port_base
     # Define required SimulaQron parameters
     backend = {'backend': 'projectq',
                'noisy_qubits': False
               }
-    # Process input seed
-    with open(args.seed_source, 'r') as f:
-        seed = np.array(list(f.read())).astype(int)
-    seed_A = seed[0:2*args.n_runs:2]
-    seed_B = seed[1:2*args.n_runs:2]
-    # Prepare bits'n'pieces
-    results_A = -1 * np.ones(args.n_runs)
-    results_B = -1 * np.ones(args.n_runs)
-    qubit_control_barrier = Barrier(len(network['nodes']))
-    # Run the experiment
-    em = utils.ExperimentManager(network, backend)
-    em.start([(generator, [network['name'], 
-                           network['nodes'][0], 
-                           args.n_runs,
-                           network['nodes'][1], 
-                           network['nodes'][2],
-                           qubit_control_barrier
-                           ]
-               ),
-               (measurement, [network['name'],
-                              network['nodes'][1],
-                              args.n_runs,
-                              seed_A, results_A, 
-                              ('X','Z'), True,
-                              qubit_control_barrier]
-               ),
-               (measurement, [network['name'],
-                              network['nodes'][2],
-                              args.n_runs,
-                              seed_B, results_B, 
-                              ('X+Z','X-Z'), False,
-                              qubit_control_barrier]
-               )
-             ])
-    em.join()
-
-    I_est = utils.estimate_CHSH(seed_A, seed_B, results_A, results_B)
+    profiler = None if args.profile is None else utils.Profiler(args.profile)
+
+    if args.chunk_size is None:
+        # Process input seed
+        with utils.open_seed(args.seed_source, args.seed_cursor) as seed:
+            seed_A, seed_B = seed.take(args.n_runs, 2)
+            results_A, results_B = run_experiment(args, network, backend,
+                                                  seed_A, seed_B, profiler)
+            I_est = utils.estimate_CHSH(seed_A, seed_B, results_A, results_B)
+    else:
+        # Checkpoint each chunk, resuming any previous run
+        run = utils.ChunkedRun(args.outpath, args.n_runs, args.chunk_size,
+                               args.packed)
+        # Track the seed used with the checkpoint, unless told otherwise
+        with utils.open_seed(args.seed_source, 
+                             args.seed_cursor or run.seed_cursor) as seed:
+            for index, start, stop in run.pending():
+                seed_A, seed_B = seed.take(stop - start, 2)
+                results = run_experiment(args, network, backend, 
+                                         seed_A, seed_B, profiler)
+                # Store the seeds so that each chunk can be scored on its own
+                run.save(index, 
+                         np.stack((seed_A, seed_B) + results).astype(np.int8))
+        chsh = utils.CHSHAccumulator()
+        for index, _, _ in run.chunks():
+            if args.packed:
+                # Score the packed bits directly
+                results = run.load(index, unpack=False)
+                chsh.update(*[results.field(i) for i in range(4)],
+                            packed=True, mask=results.mask)
+            else:
+                chsh.update(*run.load(index))
+        I_est = chsh.estimate
+
     epsilon = calculate_statistical_correction(args.n_runs, args.alpha)
     H_est = calculate_min_entropy_bound(args.n_runs, I_est, epsilon)
 
@@ -160,10 +361,19 @@ def main(args):
     logging.info("MAIN\t: Estimated statistical correciton: %.3f", epsilon)
     logging.info("MAIN\t: Estimated min-entropy bound: %.3f", H_est)
 
-    np.save(args.outpath, np.concatenate((results_A, results_B), axis=0))
+    if args.chunk_size is None and args.packed:
+        results = utils.PackedResults.from_array(
+            np.stack((results_A, results_B)),
+            {'fields': ['results_A', 'results_B']})
+        results.save(args.outpath)
+    elif args.chunk_size is None:
+        np.save(args.outpath, np.concatenate((results_A, results_B), axis=0))
 
+    return {'I_est': I_est, 'epsilon': epsilon, 'H_est': H_est}
 
-if __name__ == "__main__":
+
+def get_parser():
+    """ Command line arguments for the experiment. """
     parser = argparse.ArgumentParser(
         description="Random number expansion certified by Bell's theorem.")
     parser.add_argument("n_runs", type=int,
@@ -171,9 +381,32 @@ if __name__ == "__main__":
     parser.add_argument("alpha", type=float,
                         help="confidence in correction of min-entropy bound")
     parser.add_argument("--seed_source", '-s', default="anu_seed.txt",
-                        help="source file for random seed")
+                        help="source file for random seed, or local")
+    parser.add_argument("--seed_cursor", default=None,
+                        help="if set, file recording seed bits already used, "
+                             "kept with the checkpoint when chunking if unset")
     parser.add_argument("--outpath", '-o', default="results",
                         help="path for storing results")
-    args = parser.parse_args()
+    parser.add_argument("--batch_size", '-b', type=int, default=1,
+                        help="number of EPR pairs sent per synchronisation")
+    parser.add_argument("--native", action="store_true",
+                        help="simulate natively rather than with SimulaQron")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="run parties as coroutines on one event loop")
+    parser.add_argument("--chunk_size", '-c', type=int, default=None,
+                        help="if set, checkpoint results in chunks of this many runs")
+    parser.add_argument("--packed", action="store_true",
+                        help="store results bit-packed rather than as .npy")
+    parser.add_argument("--profile", default=None,
+                        help="if set, prefix of files to save a timing profile to")
+    parser.add_argument("--pool", action="store_true",
+                        help="keep the network running for the next experiment")
+    parser.add_argument("--network_name", default=None,
+                        help="if set, name of the SimulaQron network")
+    parser.add_argument("--port_base", type=int, default=None,
+                        help="if set, first port of the SimulaQron network")
+    return parser
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
     main(args)
-    
\ No newline at end of file
@@ -1,9 +1,10 @@
 import argparse
 from cqc.pythonLib import CQCConnection, qubit
 import numpy as np
-from numpy.random import binomial
+from numpy.random import binomial, geometric
 import logging
 from threading import Barrier
+import statevector
 import utils
 
 
@@ -22,7 +23,7 @@ TODO:
 
 """
 
-def generator(network, node, n_timesteps, results, p_emit):
+def generator(network, node, n_timesteps, p_emit, state=0):
     """ Produce photons one at a time.
 
     Mimic low-intensity photon source by releasing photons (qubits) with a
@@ -33,13 +34,15 @@ def generator(network, node, n_timesteps, results, p_emit):
         network (str): name of the network to connect to
         node (str): name of the node to connect to
         n_timesteps (int): number timesteps to simulate
-        results (np.ndarray): array for storing results    
         p_emit (float): probability of photon emission per timestep
+        state (int): initial output signal state (0 = LO, 1 = HI)
+
+    Return:
+        (np.ndarray): (2, n_timesteps) array of emissions and signal states
     """
+    results = -1 * np.ones((2, n_timesteps), dtype=np.int8)
     with CQCConnection(node, network_name=network) as Source:
         logging.info("GEN\t: Generator connected to node %s.", node)
-        # Output signal state (0 = LO, 1 = HI)
-        state = 0
         for i in range(n_timesteps):
             # If the source "emits" a photon, we measure
             emit = binomial(1, p_emit)
@@ -54,6 +57,83 @@ def generator(network, node, n_timesteps, results, p_emit):
             results[0,i] = emit
             results[1,i] = state
 
+    return results
+
+
+def simulate(n_timesteps, p_emit, state=0):
+    """ Simulate the photon source natively.
+
+    Draw all emission times at once as geometric inter-arrival gaps, simulate
+    only the emitted photons in batches and forward fill the sample-and-hold
+    output signal between emissions.
+
+    Args:
+        n_timesteps (int): number timesteps to simulate
+        p_emit (float): probability of photon emission per timestep
+        state (int): initial output signal state (0 = LO, 1 = HI)
+
+    Return:
+        (np.ndarray): (2, n_timesteps) array of emissions and signal states
+    """
+    emit = np.zeros(n_timesteps, dtype=bool)
+    last = -1
+    while last < n_timesteps - 1:
+        n_gaps = int((n_timesteps - 1 - last) * p_emit) + 1
+        times = last + np.cumsum(geometric(p_emit, size=n_gaps))
+        emit[times[times < n_timesteps]] = True
+        last = times[-1]
+    # Photons passing the pi/4 polarising filter
+    n_emitted = np.count_nonzero(emit)
+    outcomes = np.zeros(n_emitted + 1, dtype=np.uint8)
+    outcomes[0] = state
+    for start in range(0, n_emitted, statevector.CHUNK_SIZE):
+        stop = min(start + statevector.CHUNK_SIZE, n_emitted)
+        states = statevector.zero_state(1, stop - start)
+        states = statevector.apply_gate(states, statevector.H, 0)
+        outcomes[start+1:stop+1] = statevector.measure(states)[:,0]
+    # Output signal holds the last measured state
+    results = np.empty((2, n_timesteps), dtype=np.int8)
+    results[0] = emit
+    results[1] = outcomes[np.cumsum(emit)]
+
+    return results
+
+
+def run_experiment(args, network, backend, n_timesteps, p_emit, state=0,
+                   profiler=None):
+    """ Run the experiment for a number of timesteps.
+
+    Args:
+        args (argparse.Namespace): parsed command line arguments
+        network (dict): network parameters
+        backend (dict): SimulaQron parameters
+        n_timesteps (int): number timesteps to simulate
+        p_emit (float): probability of photon emission per timestep
+        state (int): initial output signal state (0 = LO, 1 = HI)
+        profiler (utils.Profiler): if set, time the parties' calls
+
+    Return:
+        (np.ndarray): (2, n_timesteps) array of emissions and signal states
+    """
+    pool = utils.get_network_pool() if args.pool else None
+    # Run the experiment
+    em = utils.ExperimentManager(network, backend, native=args.native,
+                                 pool=pool,
+                                 profiler=profiler)
+    if args.native:
+        em.start([(simulate, [n_timesteps, p_emit, state])])
+    else:
+        em.start([(generator, [em.network_name, 
+                               network['nodes'][0], 
+                               n_timesteps,
+                               p_emit,
+                               state,
+                               ]
+                   )
+                 ])
+    results, = em.join()
+
+    return results
 
 def main(args):
     logging.basicConfig(format=utils.LOG_FORMAT, level=utils.LOG_LEVEL)
@@ -61,32 +141,64 @@ def main(args):
     network = {'name': 'gen_pol',
                'nodes': ['Gen'],
                }
+    if args.network_name is not None:
+        network['name'] = args.network_name
+    if args.port_base is not None:
+        network['port_base'] = args.port_base
     # Define required SimulaQron parameters
     backend = {'backend': 'stabilizer'}
-    # Prepare bits'n'pieces
-    results = -1 * np.ones((2,args.n_timesteps))
     p_emit = 0.05
-    # Run the experiment
-    em = utils.ExperimentManager(network, backend)
-    em.start([(generator, [network['name'], 
-                           network['nodes'][0], 
-                           args.n_timesteps,
-                           results, 
-                           p_emit,
-                           ]
-               )
-             ])
-    em.join()
+    profiler = None if args.profile is None else utils.Profiler(args.profile)
 
-    np.save(args.outpath, results)
+    if args.chunk_size is None:
+        results = run_experiment(args, network, backend, args.n_timesteps, 
+                                 p_emit, profiler=profiler)
+        if args.packed:
+            utils.PackedResults.from_array(
+                results, {'fields': ['emit', 'state']}).save(args.outpath)
+        else:
+            np.save(args.outpath, results)
+        n_emitted = int(np.sum(results[0]))
+    else:
+        # Checkpoint each chunk, resuming any previous run
+        run = utils.ChunkedRun(args.outpath, args.n_timesteps, args.chunk_size,
+                               args.packed)
+        for index, start, stop in run.pending():
+            # Carry the output signal over from the previous chunk
+            state = 0 if index == 0 else int(run.load(index - 1)[1,-1])
+            run.save(index, run_experiment(args, network, backend, 
+                                           stop - start, p_emit, state,
+                                           profiler))
+        n_emitted = sum(int(np.sum(run.load(index)[0]))
+                        for index, _, _ in run.chunks())
 
+    return {'n_emitted': n_emitted}
 
-if __name__ == "__main__":
+
+def get_parser():
+    """ Command line arguments for the experiment. """
     parser = argparse.ArgumentParser(
         description="Random number expansion certified by Bell's theorem.")
     parser.add_argument("n_timesteps", type=int,
                         help="number of timesteps to query measurement systems")
     parser.add_argument("--outpath", '-o', default="results",
                         help="path for storing results")
-    args = parser.parse_args()
-    main(args)
\ No newline at end of file
+    parser.add_argument("--native", action="store_true",
+                        help="simulate natively rather than with SimulaQron")
+    parser.add_argument("--chunk_size", '-c', type=int, default=None,
+                        help="if set, checkpoint results in chunks of this many timesteps")
+    parser.add_argument("--packed", action="store_true",
+                        help="store results bit-packed rather than as .npy")
+    parser.add_argument("--profile", default=None,
+                        help="if set, prefix of files to save a timing profile to")
+    parser.add_argument("--pool", action="store_true",
+                        help="keep the network running for the next experiment")
+    parser.add_argument("--network_name", default=None,
+                        help="if set, name of the SimulaQron network")
+    parser.add_argument("--port_base", type=int, default=None,
+                        help="if set, first port of the SimulaQron network")
+    return parser
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    main(args)
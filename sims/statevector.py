@@ -0,0 +1,154 @@
+import numpy as np
+
+""" Batched state-vector simulation of small quantum protocols.
+
+The protocols in this directory only ever involve a handful of qubits per
+round, so rather than passing each qubit through the SimulaQron network the
+states of many independent rounds can be held as rows of a single array and
+evolved together. A batch of n-qubit states has shape (n_rounds, 2**n), with
+qubit 0 the most significant bit of the basis state index.
+
+Rotations follow the CQC convention of angles in steps of 2*pi/256, so the
+bases here match those applied by utils.change_basis.
+"""
+
+# Number of rounds simulated at once, bounding memory use
+CHUNK_SIZE = 1 << 16
+
+# Single-qubit gates
+I = np.eye(2, dtype=complex)
+X = np.array([[0, 1], [1, 0]], dtype=complex)
+Z = np.array([[1, 0], [0, -1]], dtype=complex)
+H = np.array([[1, 1], [1, -1]], dtype=complex) / np.sqrt(2)
+
+def rot_Y(step):
+    """ Rotation about the Y axis by step*2*pi/256.
+
+    Args:
+        step (int): rotation angle in CQC steps.
+    """
+    half_angle = step * np.pi / 256
+    return np.array([[np.cos(half_angle), -np.sin(half_angle)],
+                     [np.sin(half_angle), np.cos(half_angle)]], dtype=complex)
+
+def rot_Z(step):
+    """ Rotation about the Z axis by step*2*pi/256.
+
+    Args:
+        step (int): rotation angle in CQC steps.
+    """
+    half_angle = step * np.pi / 256
+    return np.diag([np.exp(-1j*half_angle), np.exp(1j*half_angle)])
+
+# Basis transformations applied by utils.change_basis before measurement
+BASES = {'Z': I,
+         'X': H,
+         'X+Z': rot_Z(128) @ rot_Y(32) @ rot_Z(128),
+         'X-Z': rot_Z(128) @ rot_Y(96) @ rot_Z(128)
+        }
+
+def basis_rotations(bases):
+    """ Stack the transformations for a pair of measurement bases.
+
+    Indexing the result with an array of seed bits gives the gate to apply in
+    each round.
+
+    Args:
+        bases (tuple): names of the measurement bases, as for
+            utils.change_basis.
+
+    Return:
+        (np.ndarray): (len(bases), 2, 2) array of unitaries.
+    """
+    try:
+        return np.stack([BASES[basis] for basis in bases])
+    except KeyError:
+        raise ValueError('Valid bases are Z, X, X+Z and X-Z.')
+
+def zero_state(n_qubits, n_rounds=1):
+    """ Prepare a batch of \\ket{0...0} states.
+
+    Args:
+        n_qubits (int): number of qubits per round.
+        n_rounds (int): number of rounds.
+    """
+    states = np.zeros((n_rounds, 2**n_qubits), dtype=complex)
+    states[:, 0] = 1
+    return states
+
+def epr_pairs(n_rounds):
+    """ Prepare a batch of \\ket{\\phi_+} states, as made by createEPR.
+
+    Args:
+        n_rounds (int): number of rounds.
+    """
+    states = zero_state(2, n_rounds)
+    states[:, 0] = states[:, 3] = 1 / np.sqrt(2)
+    return states
+
+def apply_gate(states, gate, target):
+    """ Apply a single-qubit gate to one qubit of every state in a batch.
+
+    Args:
+        states (np.ndarray): (n_rounds, 2**n) batch of states.
+        gate (np.ndarray): (2, 2) gate applied in every round, or
+            (n_rounds, 2, 2) gates applied round by round.
+        target (int): index of the qubit to act on.
+
+    Return:
+        (np.ndarray): the transformed batch of states.
+    """
+    n_rounds, dim = states.shape
+    psi = states.reshape(n_rounds, 2**target, 2, -1)
+    if gate.ndim == 2:
+        psi = np.einsum('ab,nlbr->nlar', gate, psi)
+    else:
+        psi = np.einsum('nab,nlbr->nlar', gate, psi)
+    return psi.reshape(n_rounds, dim)
+
+def apply_controlled(states, gate, control, target):
+    """ Apply a controlled single-qubit gate to every state in a batch.
+
+    Args:
+        states (np.ndarray): (n_rounds, 2**n) batch of states.
+        gate (np.ndarray): (2, 2) gate applied to the target.
+        control (int): index of the control qubit.
+        target (int): index of the target qubit.
+
+    Return:
+        (np.ndarray): the transformed batch of states.
+    """
+    n_rounds, dim = states.shape
+    n_qubits = dim.bit_length() - 1
+    on = (np.arange(dim) >> (n_qubits - 1 - control)) & 1 == 1
+    states = states.copy()
+    states[:, on] = apply_gate(states, gate, target)[:, on]
+    return states
+
+def cnot(states, control, target):
+    """ Apply a CNOT gate to every state in a batch. """
+    return apply_controlled(states, X, control, target)
+
+def cphase(states, control, target):
+    """ Apply a controlled phase gate to every state in a batch. """
+    return apply_controlled(states, Z, control, target)
+
+def measure(states):
+    """ Measure every qubit of every state in the computational basis.
+
+    Outcomes are sampled using numpy.random, as elsewhere in these
+    simulations.
+
+    Args:
+        states (np.ndarray): (n_rounds, 2**n) batch of states.
+
+    Return:
+        (np.ndarray): (n_rounds, n) array of measurement outcomes.
+    """
+    n_rounds, dim = states.shape
+    n_qubits = dim.bit_length() - 1
+    cumulative = np.cumsum(np.abs(states)**2, axis=1)
+    u = np.random.random_sample((n_rounds, 1)) * cumulative[:, -1:]
+    outcome = np.minimum(np.sum(cumulative < u, axis=1), dim - 1)
+    shifts = np.arange(n_qubits - 1, -1, -1)
+    return ((outcome[:, None] >> shifts) & 1).astype(np.uint8)
@@ -0,0 +1,62 @@
+import argparse
+import logging
+import shlex
+import utils
+
+""" Run a parameter sweep of one of the experiments in this directory.
+
+Each line of the sweep file holds the command line arguments for one
+configuration, e.g. for certified_expansion
+
+    1000 0.99 --native -s local
+    10000 0.99 --native -s local
+
+Configurations are run in parallel worker processes, each with its own
+SimulaQron network name and port range, and the arguments and main results of
+every configuration are collected into a single CSV table. Add --pool to the
+configurations to keep each worker's network running between them.
+"""
+
+def read_sweep(path):
+    """ Read the configurations of a sweep, ignoring blank and # lines.
+
+    Args:
+        path (str): path of the sweep file.
+
+    Return:
+        (list): command line arguments for each configuration.
+    """
+    with open(path, 'r') as f:
+        return [shlex.split(line) for line in f
+                if line.strip() and not line.lstrip().startswith('#')]
+
+def main(args):
+    logging.basicConfig(format=utils.LOG_FORMAT, level=utils.LOG_LEVEL)
+    argvs = read_sweep(args.sweep_file)
+    rows = utils.run_sweep(args.script, argvs, args.workers, args.outdir,
+                           args.port_base)
+    utils.write_table(rows, args.table)
+    logging.info("MAIN\t: Results of %d configurations written to %s.",
+                 len(rows), args.table)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run experiment configurations in parallel processes.")
+    parser.add_argument("script",
+                        choices=["certified_expansion",
+                                 "amplification_four_devices",
+                                 "generation_polarisation"],
+                        help="experiment to sweep")
+    parser.add_argument("sweep_file",
+                        help="file with the arguments of one configuration per line")
+    parser.add_argument("--workers", '-w', type=int, default=None,
+                        help="number of worker processes, one per core if unset")
+    parser.add_argument("--outdir", '-d', default=None,
+                        help="if set, directory for the results of each configuration")
+    parser.add_argument("--table", '-t', default="sweep.csv",
+                        help="path for the table of results")
+    parser.add_argument("--port_base", type=int, default=utils.NETWORK_PORT_BASE,
+                        help="first port used by the worker networks")
+    args = parser.parse_args()
+    main(args)
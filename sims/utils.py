@@ -1,11 +1,32 @@
-from cqc.pythonLib import qubit
+from abc import ABC, abstractmethod
+from cqc.pythonLib import CQCConnection, qubit
+from contextlib import contextmanager
+import asyncio
+import atexit
+import contextvars
+import csv
+import fcntl
+import importlib
 import json
 import logging
 import numpy as np
 import os
 from simulaqron.network import Network
 from simulaqron.settings import simulaqron_settings
-from threading import Thread
+from concurrent.futures import (Future, ProcessPoolExecutor, 
+                                ThreadPoolExecutor, wait)
+from functools import partial, wraps
+import inspect
+import multiprocessing as mp
+import queue
+import socket
+import sys
+import time
+from threading import Barrier, BrokenBarrierError, Event, Lock, Thread
+try:
+    from simulaqron.network import construct_topology_config
+except ImportError:
+    construct_topology_config = None
 
 """ Some helpful functions for running SimulaQron experiments
 
@@ -16,28 +37,92 @@ TODO:
 # Some useful variables
 LOG_FORMAT = "%(levelname)s: %(message)s"
 LOG_LEVEL = logging.INFO
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], 
+                          dtype=np.uint8)
+BIT_REVERSE_TABLE = np.array([int('{:08b}'.format(i)[::-1], 2) 
+                              for i in range(256)], dtype=np.uint8)
+# Four-partite basis/result tuples packed with system A as the leading bit
+FPB_U0 = [0b1000, 0b0100, 0b0010, 0b0001]
+FPB_U1 = [0b1000, 0b0100, 0b0010, 0b0001]
+# Irreducible x^n + p(x) used to reduce products in GF(2^n), stored as p(x)
+GF2N_REDUCTION = {64: 0x1B, 128: 0x87, 256: 0x425, 512: 0x125}
+# Number of FFT points transformed at once by the Toeplitz extractor
+TOEPLITZ_FFT_BUFFER = 1 << 22
+# Ports given to networks, clear of SimulaQron's own 8000-9000 range
+NETWORK_PORT_BASE = 9100
+# Can networks be started on ports of our choosing? This needs SimulaQron 3,
+# with construct_topology_config and Network(..., new=False)
+NETWORK_PORTS_SUPPORTED = (construct_topology_config is not None and
+                           'new' in inspect.signature(Network).parameters)
+SWEEP_PORTS_PER_WORKER = 48
+# Threads making blocking CQC calls for coroutine parties
+ASYNC_CQC_WORKERS = 4
+# CQC calls timed by a Profiler
+PROFILED_CALLS = {CQCConnection: ['createEPR', 'sendQubit', 'recvQubit', 
+                                  'recvEPR', 'sendClassical', 'recvClassical'],
+                  qubit: ['__init__', 'measure', 'I', 'H', 'X', 'Y', 'Z', 
+                          'cnot', 'cphase', 'rot_X', 'rot_Y', 'rot_Z']
+                 }
+
+# Party on whose behalf the current thread or task is working
+_party = contextvars.ContextVar('party', default="main")
+# Profiler of the experiment the current party belongs to, if any
+_profiler = contextvars.ContextVar('profiler', default=None)
+
+# Calls wrapped while any profiler is installed, and the number installed
+_profiled_calls = []
+_n_profilers = 0
+_profiling_lock = Lock()
+
+# Index of this process when running as a sweep worker
+_sweep_worker = None
 
 class ExperimentManager:
     """ Manage the setup, running and clean-up of SimulaQron experiments.
     """
-    def __init__(self, usr_network_params=None, usr_simQ_params=None):
+    def __init__(self, usr_network_params=None, usr_simQ_params=None,
+                 native=False, pool=None, asynchronous=False,
+                 max_workers=ASYNC_CQC_WORKERS, profiler=None):
         """ Prepare experiment environment.
 
         Load config file, pass specified settings to simulaQron backend and
-        initialise the simulaQron network to be used in the experiment.
+        initialise the simulaQron network to be used in the experiment. With
+        the native backend, parties simulate the protocol directly (see the
+        statevector module) and no network is started. If a NetworkPool is
+        given the network is taken from it, and handed back on join, rather
+        than started afresh.
+
+        In asynchronous mode parties are coroutines, run together on one
+        event loop and talking to their nodes through AsyncCQCConnection,
+        rather than each holding a thread of its own.
 
         Args:
             network_params (dict): Parameters to be used in network setup. 
                 Defaults to None. Defaults in config file used if so.
             simQ_params (dict): Parameters to be passed to SimulaQron backend.
                 Defaults to None. Defaults in config file used if so.           
+            native (bool): Use the native state-vector backend rather than a
+                SimulaQron network. Defaults to False.
+            pool (NetworkPool): pool of running networks to draw from.
+                Defaults to None.
+            asynchronous (bool): run parties as coroutines. Defaults to
+                False.
+            max_workers (int): number of threads making blocking CQC calls
+                for coroutine parties. Defaults to ASYNC_CQC_WORKERS.
+            profiler (Profiler): if set, time the parties' CQC calls and
+                barrier waits, reporting them on join. Defaults to None.
         
         Attributes:
             config (dict): Configuration file read in to dictionary.
             params (dict): Dictionary of parameters used in experiment.
             network (simulaqron.network.Network): pointer to simulaqron 
-                network started by the ExperimentManager.
-            threads (list): List for storing all managed experiment threads.
+                network started by the ExperimentManager, None if native.
+            network_name (str): name parties should connect to the network
+                with, which differs from the requested name if pooled.
+            futures (list): futures of all managed experiment threads.
+            chunks (queue.Queue): chunks yielded by parties, not yet read.
+            cancelled (threading.Event): set once any party has failed.
+            error (Exception): first exception raised by a party, if any.
         """
         config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
         with open(config_path, 'r') as cfg:
@@ -47,10 +132,35 @@ class ExperimentManager:
         self.parse_params('network_params', usr_network_params)
         self.parse_params('simQ_params', usr_simQ_params)
 
-        setup_simQ(self.params['simQ_params'])
-        self.network = setup_network(self.params['network_params'])
+        self.pool = pool
+        if native:
+            logging.info("EM\t: Using native backend, no network started.")
+            self.network = None
+            self.network_name = self.params['network_params']['name']
+        else:
+            setup_simQ(self.params['simQ_params'])
+            if pool is None:
+                self.network = setup_network(self.params['network_params'])
+            else:
+                self.network = pool.acquire(self.params['network_params'],
+                                            self.params['simQ_params'])
+            self.network_name = self.network.name
 
-        self.threads = []
+        self.asynchronous = asynchronous
+        self.max_workers = max_workers
+        self.profiler = profiler
+        self.executor = None
+        self.loop = None
+        self.loop_thread = None
+        self.tasks = []
+        self.inboxes = {}
+        self.futures = []
+        self.barriers = []
+        self.chunks = queue.Queue()
+        self.n_finished = 0
+        self.cancelled = Event()
+        self.error = None
+        self.lock = Lock()
 
     def parse_params(self, location, usr_params):
         """ Compare passed parameters to defaults and update where required.
@@ -79,33 +189,1256 @@ class ExperimentManager:
     def start(self, threads):
         """ Start all experiment threads.
 
+        A party either returns its results or, if it is a generator, yields
+        them in chunks which can be read with stream as they are made. Any
+        threading.Barrier or AsyncBarrier passed to a party is aborted if
+        another party fails, so that no party is left waiting on it.
+
+        Args:
+            threads (list): Tuples of function and arguments pairs
+                corresponding to each party in the protocol.
+        """
+        if self.profiler is not None:
+            self.profiler.install()
+            threads = [(func, self.profiler.time_barriers(args)) 
+                       for func, args in threads]
+        try:
+            if self.asynchronous:
+                self.start_async(threads)
+            else:
+                self.start_threads(threads)
+        except BaseException:
+            if self.profiler is not None:
+                self.profiler.uninstall()
+            raise
+
+    def start_threads(self, threads):
+        """ Start every party on a thread of its own.
+
         Args:
             threads (list): Tuples of function and arguments pairs
                 corresponding to each party in the protocol.
         """
+        # Register every barrier before any party can fail and abort them
         for func, args in threads:
+            self.barriers += barriers_in(args)
+        self.executor = ThreadPoolExecutor(max_workers=len(threads))
+        for index, (func, args) in enumerate(threads):
             logging.info("EM\t: Starting thread for target %s.", func.__name__)
-            thread = Thread(target=func, args=args)
-            thread.start()
-            self.threads.append(thread)
+            self.futures.append(self.executor.submit(self.run_party, index,
+                                                     func, args))
+
+    def run_party(self, index, func, args):
+        """ Run one party of the protocol, cancelling the rest if it fails.
+
+        Args:
+            index (int): position of the party in the list given to start.
+            func (function): function run by the party.
+            args (list): arguments passed to func.
+
+        Return:
+            (var): return value of func, or the generator itself if func 
+                yields its results in chunks.
+        """
+        _party.set("{}[{}]".format(func.__name__, index))
+        _profiler.set(self.profiler)
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+            if inspect.isgenerator(result):
+                for chunk in result:
+                    if self.cancelled.is_set():
+                        result.close()
+                        break
+                    self.chunks.put((index, chunk))
+            return result
+        except Exception as error:
+            with self.lock:
+                if self.error is None:
+                    self.error = error
+            if not self.cancelled.is_set():
+                logging.error("EM\t: %s failed, cancelling experiment.",
+                              func.__name__)
+                self.cancel()
+            raise
+        finally:
+            if self.profiler is not None:
+                self.profiler.record("party", start, time.perf_counter())
+            self.chunks.put((index, None))
+
+    def start_async(self, threads):
+        """ Start all parties as coroutines on one event loop.
+
+        The event loop runs in a single thread of its own, with blocking CQC
+        calls handed to a small pool of worker threads.
+
+        Args:
+            threads (list): Tuples of coroutine function and arguments pairs
+                corresponding to each party in the protocol.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        for func, args in threads:
+            logging.info("EM\t: Starting coroutine for target %s.", 
+                         func.__name__)
+            self.barriers += barriers_in(args)
+            self.futures.append(Future())
+        self.loop_thread = Thread(target=asyncio.run, 
+                                  args=(self.run_parties_async(threads),))
+        self.loop_thread.start()
+
+    async def run_parties_async(self, threads):
+        """ Run every coroutine party to completion.
+
+        Args:
+            threads (list): Tuples of coroutine function and arguments pairs.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.tasks = [asyncio.ensure_future(self.run_party_async(i, func, args))
+                      for i, (func, args) in enumerate(threads)]
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        # Parties cancelled before they began never settle their futures
+        for index, future in enumerate(self.futures):
+            if not future.done():
+                future.cancel()
+                future.set_running_or_notify_cancel()
+                self.chunks.put((index, None))
+
+    async def run_party_async(self, index, func, args):
+        """ Run one coroutine party, cancelling the rest if it fails.
+
+        Args:
+            index (int): position of the party in the list given to start.
+            func (function): coroutine function, or asynchronous generator,
+                run by the party.
+            args (list): arguments passed to func.
+        """
+        future = self.futures[index]
+        _party.set("{}[{}]".format(func.__name__, index))
+        _profiler.set(self.profiler)
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+            if inspect.isasyncgen(result):
+                async for chunk in result:
+                    self.chunks.put((index, chunk))
+                future.set_result(result)
+            else:
+                future.set_result(await result)
+        except asyncio.CancelledError:
+            future.cancel()
+            future.set_running_or_notify_cancel()
+        except Exception as error:
+            with self.lock:
+                if self.error is None:
+                    self.error = error
+            future.set_exception(error)
+            if not self.cancelled.is_set():
+                logging.error("EM\t: %s failed, cancelling experiment.",
+                              func.__name__)
+                for task in self.tasks:
+                    task.cancel()
+                self.cancel()
+        finally:
+            if self.profiler is not None:
+                self.profiler.record("party", start, time.perf_counter())
+            self.chunks.put((index, None))
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """ Run a blocking call from a coroutine party on a worker thread.
+
+        Args:
+            func (function): function to call.
+            args, kwargs: arguments passed to func.
+
+        Return:
+            (var): return value of func.
+        """
+        # Calls are made on behalf of the party awaiting them
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.executor, context.run,
+                                               partial(func, *args, **kwargs))
+
+    def inbox(self, node, kind):
+        """ Count of qubits sent to a node but not yet received.
+
+        Args:
+            node (str): name of the receiving node.
+            kind (str): 'qubit' for sendQubit, 'epr' for createEPR.
+
+        Return:
+            (asyncio.Semaphore): released for each qubit sent.
+        """
+        if (node, kind) not in self.inboxes:
+            self.inboxes[(node, kind)] = asyncio.Semaphore(0)
+        return self.inboxes[(node, kind)]
+
+    def cancel(self):
+        """ Stop the experiment, releasing any parties left waiting.
+
+        Barriers are aborted, and the network stopped so that parties blocked
+        on CQC calls see their connections close.
+        """
+        self.cancelled.set()
+        for barrier in self.barriers:
+            barrier.abort()
+        if self.network is not None:
+            stop_network(self.network)
+
+    def stream(self):
+        """ Read the chunks yielded by parties as they are made.
+
+        Yield:
+            (tuple): index of the party and the chunk, until every party has
+                finished.
+        """
+        while self.n_finished < len(self.futures):
+            index, chunk = self.chunks.get()
+            if chunk is None:
+                self.n_finished += 1
+            else:
+                yield index, chunk
 
     def join(self):
         """ Gracefully finish the experiment.
 
         Wait for all threads to finish and clean up the SimulaQron backend
-        and network.
+        and network. If any party failed, its exception is raised once 
+        everything has been cleaned up.
 
         Return:
-            (list): list of return values from each thread.
+            (list): list of return values from each thread. Parties which
+                yield their results give a list of the chunks not already
+                read with stream.
         """
         logging.info("EM\t: Joining threads.")
 
-        for thread in self.threads:
-            thread.join()
+        try:
+            wait(self.futures)
+            if self.loop_thread is not None:
+                self.loop_thread.join()
+            self.executor.shutdown()
+        finally:
+            if self.profiler is not None:
+                self.profiler.uninstall()
+
+        if self.profiler is not None:
+            self.profiler.log_summary()
+            if self.profiler.path is not None:
+                self.profiler.save(self.profiler.path)
+
+        if self.network is not None and self.pool is not None:
+            # A failed or cancelled run may have left qubits queued on its
+            # nodes, so only reuse the network after a clean one
+            self.pool.release(self.network, reuse=self.error is None and 
+                              not self.cancelled.is_set())
+        elif self.network is not None:
+            stop_network(self.network)
+            # Settings are shared by all sweep workers, so leave them in place
+            if _sweep_worker is None:
+                simulaqron_settings.default_settings()
+
+        if self.error is not None:
+            raise self.error
 
-        self.network.stop()
-        simulaqron_settings.default_settings()
+        unread = [[] for _ in self.futures]
+        for index, chunk in self.stream():
+            unread[index].append(chunk)
+        results = []
+        for future, chunks in zip(self.futures, unread):
+            result = future.result()
+            if inspect.isgenerator(result) or inspect.isasyncgen(result):
+                result = chunks
+            results.append(result)
+
+        return results
         
+def barriers_in(args):
+    """ Barriers, timed or not, among the arguments of a party. """
+    barriers = []
+    for arg in args:
+        if isinstance(arg, TimedBarrier):
+            arg = arg.barrier
+        if isinstance(arg, (Barrier, AsyncBarrier)):
+            barriers.append(arg)
+    return barriers
+
+def _profiled(func, operation):
+    """ Wrap a function so each call is recorded by the caller's profiler.
+
+    Calls made outside a profiled experiment's parties go straight through.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler.get()
+        if profiler is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.record(operation, start, time.perf_counter())
+    return wrapper
+
+class Profiler:
+    """ Opt-in timing of each party's CQC calls and barrier waits.
+
+    While any profiler is installed, the calls listed in PROFILED_CALLS and 
+    change_basis are wrapped to record their start and end, as are waits on
+    any barrier passed to a party. Calls are recorded by the profiler of the
+    experiment whose party makes them, so experiments running alongside, 
+    profiled or not, are kept out of each other's profiles. Each record costs
+    two perf_counter calls and a list append, small next to a round trip to
+    a SimulaQron node, and nothing is wrapped unless a profiler is installed.
+
+    A profiler can also be installed for a block with the with statement.
+    """
+    # Latency histogram bin edges in seconds, powers of two from ~1us
+    BINS = 2.0 ** np.arange(-20, 7)
+
+    def __init__(self, path=None):
+        """ Create an empty profile.
+
+        Args:
+            path (str): if set, prefix of the files the profile is saved to
+                when an experiment joins. Defaults to None.
+
+        Attributes:
+            events (list): (party, operation, start, stop) of every call.
+        """
+        self.path = path
+        self.events = []
+        self.origin = time.perf_counter()
+        self.installed = False
+
+    def record(self, operation, start, stop):
+        """ Record one call made by the current party.
+
+        Args:
+            operation (str): name of the call.
+            start (float): perf_counter at the start of the call.
+            stop (float): perf_counter at the end of the call.
+        """
+        self.events.append((_party.get(), operation, start, stop))
+
+    @contextmanager
+    def span(self, operation):
+        """ Time the enclosed block as one call. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(operation, start, time.perf_counter())
+
+    def time_barriers(self, args):
+        """ Replace any barriers among a party's arguments by timed ones. """
+        return [TimedBarrier(arg, self) if isinstance(arg, (Barrier, AsyncBarrier))
+                else arg for arg in args]
+
+    def install(self):
+        """ Wrap the profiled calls, until uninstall is called. """
+        global _n_profilers
+        with _profiling_lock:
+            if self.installed:
+                return
+            self.installed = True
+            _n_profilers += 1
+            if _n_profilers > 1:
+                return
+            targets = [(owner, name, "{}.{}".format(owner.__name__, name))
+                       for owner, names in PROFILED_CALLS.items() 
+                       for name in names if hasattr(owner, name)]
+            targets.append((sys.modules[__name__], 'change_basis', 
+                            'change_basis'))
+            for owner, name, operation in targets:
+                original = owner.__dict__.get(name)
+                _profiled_calls.append((owner, name, original))
+                setattr(owner, name, _profiled(getattr(owner, name), 
+                                               operation))
+
+    def uninstall(self):
+        """ Restore the profiled calls once no profiler is installed. """
+        global _n_profilers
+        with _profiling_lock:
+            if not self.installed:
+                return
+            self.installed = False
+            _n_profilers -= 1
+            if _n_profilers:
+                return
+            for owner, name, original in reversed(_profiled_calls):
+                if original is None:
+                    delattr(owner, name)
+                else:
+                    setattr(owner, name, original)
+            _profiled_calls.clear()
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.uninstall()
+
+    def durations(self):
+        """ Durations of the recorded calls.
+
+        Return:
+            (dict): array of durations in seconds by (party, operation).
+        """
+        durations = {}
+        for party, operation, start, stop in self.events:
+            durations.setdefault((party, operation), []).append(stop - start)
+        return {key: np.array(value) for key, value in durations.items()}
+
+    def summary(self):
+        """ Latency statistics of each party's calls.
+
+        Return:
+            (list): one dictionary of statistics per party and operation.
+        """
+        rows = []
+        for (party, operation), d in sorted(self.durations().items()):
+            rows.append({'party': party, 'operation': operation, 
+                         'count': len(d), 'total': d.sum(), 'mean': d.mean(),
+                         'p50': np.percentile(d, 50), 
+                         'p99': np.percentile(d, 99), 'max': d.max()})
+        return rows
+
+    def histograms(self):
+        """ Latency histograms of each party's calls, over BINS.
+
+        Return:
+            (dict): counts per bin by "party/operation".
+        """
+        return {"{}/{}".format(party, operation):
+                np.histogram(np.clip(d, self.BINS[0], self.BINS[-1]), 
+                             self.BINS)[0].tolist()
+                for (party, operation), d in sorted(self.durations().items())}
+
+    def log_summary(self):
+        """ Log the latency statistics of each party's calls. """
+        for row in self.summary():
+            logging.info("PROF\t: %-20s %-24s n=%-8d total=%8.3fs "
+                         "mean=%.2es p99=%.2es", row['party'], 
+                         row['operation'], row['count'], row['total'],
+                         row['mean'], row['p99'])
+
+    def save(self, path):
+        """ Save the profile for later analysis.
+
+        Writes the statistics and histograms to <path>_profile.json, and
+        every call to <path>_trace.json in the Trace Event Format read by
+        chrome://tracing and Perfetto.
+
+        Args:
+            path (str): prefix of the files to write.
+        """
+        profile = {'bins': self.BINS.tolist(),
+                   'summary': [{key: (value if isinstance(value, (str, int))
+                                      else float(value)) 
+                                for key, value in row.items()}
+                               for row in self.summary()],
+                   'histograms': self.histograms()}
+        with open(path + "_profile.json", 'w') as f:
+            json.dump(profile, f, indent=4)
+
+        parties = sorted({event[0] for event in self.events})
+        trace = [{'name': "thread_name", 'ph': "M", 'pid': 0, 'tid': tid,
+                  'args': {'name': party}} for tid, party in enumerate(parties)]
+        tids = {party: tid for tid, party in enumerate(parties)}
+        for party, operation, start, stop in self.events:
+            trace.append({'name': operation, 'ph': "X", 'pid': 0, 
+                          'tid': tids[party],
+                          'ts': 1e6 * (start - self.origin), 
+                          'dur': 1e6 * (stop - start)})
+        with open(path + "_trace.json", 'w') as f:
+            json.dump({'traceEvents': trace}, f)
+        logging.info("PROF\t: Profile saved to %s_profile.json.", path)
+
+class TimedBarrier:
+    """ Barrier recording how long each party waits at it. """
+    def __init__(self, barrier, profiler):
+        """ Wrap a barrier.
+
+        Args:
+            barrier (threading.Barrier or AsyncBarrier): barrier to time.
+            profiler (Profiler): profile to record waits in.
+        """
+        self.barrier = barrier
+        self.profiler = profiler
+
+    def wait(self):
+        """ Wait at the barrier, as its own wait would. """
+        if isinstance(self.barrier, AsyncBarrier):
+            return self.wait_async()
+        with self.profiler.span("barrier.wait"):
+            return self.barrier.wait()
+
+    async def wait_async(self):
+        """ Wait at an AsyncBarrier. """
+        with self.profiler.span("barrier.wait"):
+            return await self.barrier.wait()
+
+    def abort(self):
+        """ Break the barrier, releasing any waiting parties. """
+        self.barrier.abort()
+
+class AsyncBarrier:
+    """ Barrier for coroutine parties, the counterpart of threading.Barrier.
+    """
+    def __init__(self, parties):
+        """ Create a barrier for a number of parties.
+
+        Args:
+            parties (int): number of parties to wait for.
+        """
+        self.parties = parties
+        self.count = 0
+        self.event = None
+        self.broken = False
+
+    async def wait(self):
+        """ Wait until all parties have reached the barrier. """
+        if self.event is None:
+            self.event = asyncio.Event()
+        if self.broken:
+            raise BrokenBarrierError
+        event = self.event
+        self.count += 1
+        if self.count == self.parties:
+            self.count = 0
+            self.event = asyncio.Event()
+            event.set()
+        else:
+            await event.wait()
+        if self.broken:
+            raise BrokenBarrierError
+
+    def abort(self):
+        """ Break the barrier, releasing any waiting parties. """
+        self.broken = True
+        if self.event is not None:
+            self.event.set()
+
+class AsyncCQCConnection:
+    """ Coroutine interface to a node, for parties run in asynchronous mode.
+
+    The CQC client library is blocking, so each call is made on one of the
+    ExperimentManager's worker threads, one call at a time per connection.
+    A qubit is only received once a party on the same event loop has sent
+    it, so no call waits on another party and a few threads can serve any
+    number of parties. All parties sending to a node must therefore run in
+    the same ExperimentManager.
+    """
+    def __init__(self, manager, node):
+        """ Prepare a connection, opened with async with.
+
+        Args:
+            manager (ExperimentManager): manager running the party.
+            node (str): name of the node to connect to.
+
+        Attributes:
+            connection (cqc.pythonLib.CQCConnection): underlying connection.
+        """
+        self.manager = manager
+        self.node = node
+        self.connection = None
+        self.lock = None
+
+    async def __aenter__(self):
+        self.lock = asyncio.Lock()
+        self.connection = await self.manager.run_blocking(
+            CQCConnection, self.node, network_name=self.manager.network_name)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.call(self.connection.close)
+
+    async def call(self, func, *args, **kwargs):
+        """ Make a blocking call using this connection, e.g. on a qubit.
+
+        Args:
+            func (function): function to call.
+            args, kwargs: arguments passed to func.
+
+        Return:
+            (var): return value of func.
+        """
+        async with self.lock:
+            return await self.manager.run_blocking(func, *args, **kwargs)
+
+    async def qubit(self):
+        """ Create a fresh qubit in \\ket{0}. """
+        return await self.call(qubit, self.connection)
+
+    async def createEPR(self, target):
+        """ Create an EPR pair, sending one half to target. """
+        q = await self.call(self.connection.createEPR, target)
+        self.manager.inbox(target, 'epr').release()
+        return q
+
+    async def sendQubit(self, q, target):
+        """ Send a qubit to target. """
+        await self.call(self.connection.sendQubit, q, target)
+        self.manager.inbox(target, 'qubit').release()
+
+    async def recvEPR(self):
+        """ Receive half of an EPR pair, once one has been made. """
+        await self.manager.inbox(self.node, 'epr').acquire()
+        return await self.call(self.connection.recvEPR)
+
+    async def recvQubit(self):
+        """ Receive a qubit, once one has been sent. """
+        await self.manager.inbox(self.node, 'qubit').acquire()
+        return await self.call(self.connection.recvQubit)
+
+class NetworkPool:
+    """ Keep started SimulaQron networks running between experiments.
+
+    Starting a network takes seconds, far longer than a short experiment, so
+    networks handed back by an ExperimentManager are kept idle and reused by
+    the next experiment with the same nodes, topology and backend settings.
+    Each pooled network gets a name unique to this process and its own
+    range of ports, so concurrent experiments never share a network.
+
+    Qubits a party held are released when its connection closes, but qubits
+    sent to a node and never received stay queued there. An experiment that
+    ends cleanly has received every qubit it sent, so its network is reused
+    as it is. Only an experiment that ends abnormally, with a failed party or
+    cancelled, can leave qubits queued, and its network is stopped rather 
+    than reused, as is an idle network that is no longer running.
+
+    Pooling is opt-in (the scripts' --pool flag), as pooled networks keep
+    running until the pool is closed at exit.
+    """
+    def __init__(self, port_base=NETWORK_PORT_BASE):
+        """ Create an empty pool.
+
+        Args:
+            port_base (int): port from which free port ranges are sought.
+
+        Attributes:
+            idle (dict): idle networks, listed by configuration key.
+            keys (dict): configuration key of each started network by name.
+            networks (list): all networks started by the pool.
+        """
+        self.port_base = port_base
+        self.idle = {}
+        self.keys = {}
+        self.networks = []
+        self.lock = Lock()
+
+    @staticmethod
+    def key(params, simQ_params=None):
+        """ Configuration key, networks with equal keys are interchangeable.
+
+        Args:
+            params (dict): network parameters, as for setup_network.
+            simQ_params (dict): SimulaQron settings the network runs with.
+        """
+        return json.dumps([params.get('nodes'), params.get('topology'),
+                           simQ_params], sort_keys=True)
+
+    def acquire(self, params, simQ_params=None):
+        """ Take an idle network from the pool, starting one if none match.
+
+        Args:
+            params (dict): network parameters, as for setup_network.
+            simQ_params (dict): SimulaQron settings the network runs with.
+
+        Return:
+            (simulaqron.network.Network): running network.
+        """
+        key = self.key(params, simQ_params)
+        while True:
+            with self.lock:
+                if not self.idle.get(key):
+                    break
+                network = self.idle[key].pop()
+            if not network.running:
+                logging.warning("EM\t: Idle network %s stopped.", 
+                                network.name)
+                self.release(network, reuse=False)
+                continue
+            logging.info("EM\t: Reusing network %s.", network.name)
+            return network
+        with self.lock:
+            name = "{}_{}_{}".format(params.get('name') or "default",
+                                     os.getpid(), len(self.networks))
+            self.networks.append(name)
+        params = dict(params, name=name)
+        params.setdefault('port_base', self.port_base)
+        network = setup_network(params)
+        with self.lock:
+            self.networks[self.networks.index(name)] = network
+            self.keys[name] = key
+        return network
+
+    def release(self, network, reuse=True):
+        """ Hand a network back to the pool.
+
+        Args:
+            network (simulaqron.network.Network): network from acquire.
+            reuse (bool): keep the network for reuse if it is still
+                running. Defaults to True.
+        """
+        if reuse and network.running:
+            with self.lock:
+                self.idle.setdefault(self.keys[network.name], []).append(network)
+            return
+        logging.info("EM\t: Discarding network %s.", network.name)
+        stop_network(network)
+        with self.lock:
+            self.networks.remove(network)
+            idle = self.idle.get(self.keys.pop(network.name), [])
+            if network in idle:
+                idle.remove(network)
+
+    def close(self):
+        """ Stop every network started by the pool. """
+        with self.lock:
+            networks, self.networks, self.idle = self.networks, [], {}
+        for network in networks:
+            if isinstance(network, Network):
+                stop_network(network)
+        if networks and _sweep_worker is None:
+            simulaqron_settings.default_settings()
+
+_network_pool = None
+
+def get_network_pool():
+    """ Pool of networks shared by all experiments in this process.
+
+    The pool is created on first use and its networks stopped at exit.
+    """
+    global _network_pool
+    if _network_pool is None:
+        _network_pool = NetworkPool()
+        atexit.register(_network_pool.close)
+    return _network_pool
+
+class ChunkedRun:
+    """ Run an experiment in fixed-size chunks, checkpointing each to disk.
+
+    The results of each chunk are saved to their own file in a checkpoint
+    directory alongside a progress file, so that long runs need only hold one
+    chunk in memory and an interrupted run resumes from the last completed
+    chunk. A seed cursor kept in the same directory lets a resumed run carry
+    on from the seed bits the completed chunks used, rather than reusing them.
+    """
+    def __init__(self, outpath, n_runs, chunk_size, packed=False):
+        """ Create or resume a chunked run.
+
+        Args:
+            outpath (str): path for storing results, the checkpoint directory
+                is outpath + '_chunks'.
+            n_runs (int): total number of runs in the experiment.
+            chunk_size (int): number of runs per chunk.
+            packed (bool): store chunks as PackedResults. Defaults to False.
+
+        Attributes:
+            directory (str): checkpoint directory.
+            seed_cursor (str): path of the seed cursor kept with the 
+                checkpoint, for open_seed.
+            n_runs (int): total number of runs in the experiment.
+            chunk_size (int): number of runs per chunk.
+            completed (list): indices of the chunks already saved.
+            packed (bool): are chunks stored as PackedResults?
+        """
+        self.directory = outpath + "_chunks"
+        self.n_runs = n_runs
+        self.chunk_size = chunk_size
+        self.packed = packed
+        self.completed = []
+        self.progress_path = os.path.join(self.directory, "progress.json")
+        self.seed_cursor = os.path.join(self.directory, "seed_cursor.json")
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, 'r') as f:
+                progress = json.load(f)
+            if ((progress['n_runs'], progress['chunk_size'], 
+                 progress.get('packed', False)) != (n_runs, chunk_size, packed)):
+                raise ValueError("Checkpoint in {} was made with different "
+                                 "n_runs, chunk_size or packing."
+                                 .format(self.directory))
+            self.completed = progress['completed']
+            logging.info("EM\t: Resuming with %d of %d chunks complete.",
+                         len(self.completed), len(self.chunks()))
+        else:
+            self._write_progress()
+
+    def chunks(self):
+        """ List the (index, start, stop) run ranges of every chunk. """
+        return [(i, start, min(start + self.chunk_size, self.n_runs))
+                for i, start in enumerate(range(0, self.n_runs, self.chunk_size))]
+
+    def pending(self):
+        """ List the (index, start, stop) run ranges still to be run. """
+        return [chunk for chunk in self.chunks() if chunk[0] not in self.completed]
+
+    def path(self, index):
+        """ Path to the results file of a chunk.
+
+        Args:
+            index (int): index of the chunk.
+        """
+        ext = "npz" if self.packed else "npy"
+        return os.path.join(self.directory, "chunk_{:06d}.{}".format(index, ext))
+
+    def save(self, index, results):
+        """ Save the results of a chunk and record it as complete.
+
+        Args:
+            index (int): index of the chunk.
+            results (np.ndarray): results of the chunk.
+        """
+        if self.packed:
+            PackedResults.from_array(results, {'chunk': index}).save(self.path(index))
+        else:
+            np.save(self.path(index), results)
+        self.completed.append(index)
+        self._write_progress()
+        logging.info("EM\t: Chunk %d of %d saved.", index + 1, len(self.chunks()))
+
+    def load(self, index, unpack=True):
+        """ Load the results of a completed chunk.
+
+        Args:
+            index (int): index of the chunk.
+            unpack (bool): unpack packed chunks to an array. Defaults to True,
+                otherwise packed chunks are returned as PackedResults.
+        """
+        if self.packed:
+            results = PackedResults.load(self.path(index))
+            return results.to_array() if unpack else results
+        return np.load(self.path(index))
+
+    def _write_progress(self):
+        """ Atomically record the progress of the run. """
+        tmp_path = self.progress_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'n_runs': self.n_runs,
+                       'chunk_size': self.chunk_size,
+                       'packed': self.packed,
+                       'completed': self.completed}, f)
+        os.replace(tmp_path, self.progress_path)
+
+class PackedResults:
+    """ Compact storage for binary experiment results.
+
+    Results arrays of shape (..., n_runs), holding 0 or 1 in filled rounds and
+    -1 in unfilled ones, are stored one bit per round with np.packbits. Each 
+    leading index is a field (e.g. the bases or results of one system) and a
+    single packed validity mask marks the rounds in which every field was 
+    filled. Files are written as .npz with versioned JSON metadata.
+
+    Attributes:
+        bits (np.ndarray): (n_fields, n_bytes) packed bits of each field.
+        mask (np.ndarray): (n_bytes,) packed validity mask.
+        shape (tuple): shape of the unpacked results.
+        metadata (dict): user metadata stored alongside the results.
+    """
+    VERSION = 1
+
+    def __init__(self, bits, mask, shape, metadata=None):
+        self.bits = bits
+        self.mask = mask
+        self.shape = tuple(shape)
+        self.metadata = {} if metadata is None else metadata
+
+    @classmethod
+    def from_array(cls, results, metadata=None):
+        """ Pack an array of results.
+
+        Args:
+            results (np.ndarray): (..., n_runs) array of results, -1 where 
+                unfilled.
+            metadata (dict): metadata to store alongside the results.
+        """
+        results = np.asarray(results)
+        flat = results.reshape(-1, results.shape[-1])
+        bits = np.packbits(flat == 1, axis=1)
+        mask = np.packbits(np.all(flat >= 0, axis=0))
+        return cls(bits, mask, results.shape, metadata)
+
+    @property
+    def n(self):
+        """ (int): number of rounds. """
+        return self.shape[-1]
+
+    def field(self, index):
+        """ Packed bits of one field.
+
+        Args:
+            index (int or tuple): index of the field in the leading 
+                dimensions of the unpacked results.
+        """
+        return self.bits[np.ravel_multi_index(np.atleast_1d(index), 
+                                              self.shape[:-1])]
+
+    def to_array(self):
+        """ Unpack to an int8 array of results, -1 where unfilled. """
+        results = np.unpackbits(self.bits, axis=1, count=self.n).astype(np.int8)
+        valid = np.unpackbits(self.mask, count=self.n).astype(bool)
+        results[:, ~valid] = -1
+        return results.reshape(self.shape)
+
+    def save(self, path):
+        """ Write the packed results to an .npz file.
+
+        Args:
+            path (str): file to write, .npz is appended if missing.
+        """
+        meta = {'version': self.VERSION,
+                'shape': self.shape,
+                'metadata': self.metadata}
+        np.savez(path, bits=self.bits, mask=self.mask, meta=json.dumps(meta))
+
+    @classmethod
+    def load(cls, path):
+        """ Read packed results from an .npz file.
+
+        Args:
+            path (str): file to read.
+        """
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] > cls.VERSION:
+                raise ValueError("Packed results version {} is newer than "
+                                 "supported.".format(meta['version']))
+            return cls(data['bits'], data['mask'], meta['shape'], 
+                       meta['metadata'])
+
+class SeedSource:
+    """ Memory-mapped source of seed bits.
+
+    Seed files are memory-mapped rather than read into memory, either as ASCII
+    '0'/'1' characters (as anu_seed.txt) or as binary files of bits packed 
+    with np.packbits. Seed bits are handed out as strided SeedViews, one per 
+    party, without copying, and the number of bits handed out is tracked.
+    Used as a context manager, the file is unmapped on leaving the block.
+
+    Attributes:
+        path (str): canonical path to the seed file, as os.path.realpath.
+        binary (bool): is the file packed binary rather than ASCII?
+        data (np.memmap): raw bytes of the file.
+        n_bits (int): number of seed bits in the file.
+        consumed (int): number of seed bits handed out so far.
+    """
+    def __init__(self, path, binary=None, consumed=0):
+        """ Memory-map a seed file.
+
+        Args:
+            path (str): path to the seed file.
+            binary (bool): is the file packed binary? Defaults to None, in 
+                which case .txt files are read as ASCII and others as binary.
+            consumed (int): number of seed bits already used. Defaults to 0.
+        """
+        self.path = os.path.realpath(path)
+        self.binary = not path.endswith(".txt") if binary is None else binary
+        self.data = np.memmap(path, dtype=np.uint8, mode='r')
+        if self.binary:
+            self.n_bits = 8 * len(self.data)
+        else:
+            n_bits = len(self.data)
+            # ignore trailing whitespace
+            while n_bits and self.data[n_bits - 1] in b" \r\n":
+                n_bits -= 1
+            self.n_bits = n_bits
+        self.consumed = consumed
+
+    @property
+    def remaining(self):
+        """ (int): number of seed bits not yet handed out. """
+        return self.n_bits - self.consumed
+
+    def read(self, offset, n_bits):
+        """ Read a contiguous run of seed bits.
+
+        Args:
+            offset (int): index of the first bit.
+            n_bits (int): maximum number of bits to read.
+
+        Return:
+            (np.ndarray): np.uint8 array of up to n_bits bits.
+        """
+        return self.decode(offset, 1, max(0, min(n_bits, self.n_bits - offset)))
+
+    def decode(self, offset, stride, length):
+        """ Read a strided run of seed bits.
+
+        Args:
+            offset (int): index of the first bit.
+            stride (int): step between bits.
+            length (int): number of bits.
+
+        Return:
+            (np.ndarray): np.uint8 array of bits.
+
+        Raises:
+            ValueError: if an ASCII file holds characters other than 0 or 1
+                among the bits read.
+        """
+        if self.binary:
+            idx = offset + stride * np.arange(length)
+            return (self.data[idx >> 3] >> (7 - (idx & 7)).astype(np.uint8)) & 1
+        chars = self.data[offset:offset + stride*length:stride]
+        bits = np.asarray(chars) - np.uint8(ord('0'))
+        invalid = np.flatnonzero(bits > 1)
+        if len(invalid):
+            raise ValueError("Seed file {} holds {!r} at character {}, not a "
+                             "bit.".format(self.path, chr(chars[invalid[0]]),
+                                           offset + stride*invalid[0]))
+        return bits
+
+    def take(self, n_runs, n_parties=1):
+        """ Hand out the next n_runs*n_parties seed bits.
+
+        The bits are interleaved between parties, so party i receives every
+        n_parties-th bit starting from the i-th.
+
+        Args:
+            n_runs (int): number of bits for each party.
+            n_parties (int): number of parties. Defaults to 1.
+
+        Return:
+            (list): a SeedView for each party.
+        """
+        if n_runs * n_parties > self.remaining:
+            raise ValueError("Seed source {} has only {} unused bits, {} "
+                             "requested.".format(self.path, self.remaining, 
+                                                 n_runs * n_parties))
+        views = [SeedView(self, self.consumed + i, n_parties, n_runs) 
+                 for i in range(n_parties)]
+        self.consumed += n_runs * n_parties
+        return views
+
+    def close(self):
+        """ Unmap the file, after which views of it can no longer be read. """
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SeedView:
+    """ Zero-copy strided view of the bits of a SeedSource.
+
+    Indexing with an integer reads a single bit, slicing returns another view
+    and converting with np.asarray decodes the viewed bits.
+    """
+    def __init__(self, source, offset, stride, length):
+        """ Create a view of a seed source.
+
+        Args:
+            source (SeedSource): seed source to view.
+            offset (int): index of the first bit in the source.
+            stride (int): step between bits in the source.
+            length (int): number of bits in the view.
+        """
+        self.source = source
+        self.offset = offset
+        self.stride = stride
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step < 1:
+                raise ValueError("Seed views only support positive steps.")
+            return SeedView(self.source, self.offset + start*self.stride,
+                            self.stride * step, len(range(start, stop, step)))
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("Seed view index out of range.")
+        return int(self.source.decode(self.offset + key*self.stride, 1, 1)[0])
+
+    def __array__(self, dtype=None, copy=None):
+        bits = self.source.decode(self.offset, self.stride, self.length)
+        return bits if dtype is None else bits.astype(dtype)
+
+class LocalEntropyServer:
+    """ Local stand-in for a remote entropy server.
+
+    Serves an unlimited stream of bits from the operating system's random 
+    source, with the same read interface as SeedSource.
+
+    Attributes:
+        path (str): name recorded in seed cursor files.
+        n_bits (int): number of bits available, None as unlimited.
+    """
+    path = "local"
+    n_bits = None
+
+    def read(self, offset, n_bits):
+        """ Read fresh random bits.
+
+        Args:
+            offset (int): ignored, every read is fresh.
+            n_bits (int): number of bits to read.
+
+        Return:
+            (np.ndarray): np.uint8 array of n_bits bits.
+        """
+        data = np.frombuffer(os.urandom(-(-n_bits // 8)), dtype=np.uint8)
+        return np.unpackbits(data, count=n_bits)
+
+class SeedPool:
+    """ Hand out disjoint blocks of seed bits with consumption accounting.
+
+    Blocks are read from a SeedSource (or a LocalEntropyServer) one ahead of
+    use by a background thread. Every call to take hands out fresh bits and 
+    records how many have been used in a cursor file, so that successive runs
+    and campaigns never reuse seed material. Used as a context manager, the
+    pool is closed on leaving the block.
+
+    Attributes:
+        source (SeedSource): source of seed bits.
+        block_size (int): number of bits read per prefetch.
+        cursor (int): number of seed bits handed out.
+        cursor_path (str): file persisting the cursor, None if not persisted.
+    """
+    def __init__(self, source, block_size=1 << 16, cursor_path=None,
+                 prefetch=True):
+        """ Open a seed pool, resuming from a persisted cursor.
+
+        Args:
+            source (SeedSource): source of seed bits.
+            block_size (int): number of bits read per prefetch.
+            cursor_path (str): file persisting the cursor. Defaults to None.
+            prefetch (bool): read blocks in a background thread. Defaults to
+                True.
+        """
+        self.source = source
+        self.block_size = block_size
+        self.cursor_path = cursor_path
+        self.cursor = 0
+        if cursor_path is not None and os.path.exists(cursor_path):
+            with open(cursor_path, 'r') as f:
+                saved = json.load(f)
+            if (os.path.realpath(saved['source']) 
+                    != os.path.realpath(source.path)):
+                raise ValueError("Cursor {} belongs to seed source {}."
+                                 .format(cursor_path, saved['source']))
+            self.cursor = saved['cursor']
+            logging.info("EM\t: Resuming seed pool at bit %d.", self.cursor)
+        self._buffer = np.zeros(0, dtype=np.uint8)
+        self._position = self.cursor
+        self._exhausted = False
+        self._lock = Lock()
+        self._stop = Event()
+        self._blocks = None
+        if prefetch:
+            self._blocks = queue.Queue(maxsize=2)
+            self._thread = Thread(target=self._prefetch, daemon=True)
+            self._thread.start()
+
+    def _read_block(self):
+        """ Read the next block from the source, None once exhausted. """
+        n_bits = self.block_size
+        if self.source.n_bits is not None:
+            n_bits = min(n_bits, self.source.n_bits - self._position)
+        if n_bits <= 0:
+            return None
+        block = self.source.read(self._position, n_bits)
+        self._position += n_bits
+        return block
+
+    def _prefetch(self):
+        """ Keep the next blocks queued until the pool is closed. """
+        while not self._stop.is_set():
+            block = self._read_block()
+            while not self._stop.is_set():
+                try:
+                    self._blocks.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if block is None:
+                return
+
+    def take(self, n_runs, n_parties=1):
+        """ Hand out the next n_runs*n_parties seed bits.
+
+        The bits are interleaved between parties, as by SeedSource.take.
+
+        Args:
+            n_runs (int): number of bits for each party.
+            n_parties (int): number of parties. Defaults to 1.
+
+        Return:
+            (list): a np.uint8 array of bits for each party.
+        """
+        n_bits = n_runs * n_parties
+        with self._lock:
+            blocks = [self._buffer]
+            n_buffered = len(self._buffer)
+            while n_buffered < n_bits:
+                if self._exhausted:
+                    block = None
+                elif self._blocks is not None:
+                    block = self._blocks.get()
+                else:
+                    block = self._read_block()
+                if block is None:
+                    self._exhausted = True
+                    self._buffer = np.concatenate(blocks)
+                    raise ValueError("Seed source {} exhausted."
+                                     .format(self.source.path))
+                blocks.append(block)
+                n_buffered += len(block)
+            bits = np.concatenate(blocks)
+            self._buffer = bits[n_bits:]
+            self.cursor += n_bits
+            self._write_cursor()
+        return list(bits[:n_bits].reshape(n_runs, n_parties).T)
+
+    def close(self):
+        """ Stop prefetching. """
+        self._stop.set()
+        if self._blocks is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _write_cursor(self):
+        """ Atomically persist the cursor. """
+        if self.cursor_path is None:
+            return
+        tmp_path = self.cursor_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'source': self.source.path, 'cursor': self.cursor}, f)
+        os.replace(tmp_path, self.cursor_path)
+
+def open_seed(path, cursor_path=None):
+    """ Open a source of seed bits for an experiment.
+
+    Args:
+        path (str): seed file, or "local" for a LocalEntropyServer.
+        cursor_path (str): if set, hand out seed bits through a SeedPool 
+            persisting its cursor to this file. Defaults to None.
+
+    Return:
+        (SeedSource or SeedPool): object handing out seed bits with take, 
+            to be closed, or used as a context manager, once done with.
+    """
+    if path == "local":
+        return SeedPool(LocalEntropyServer(), cursor_path=cursor_path)
+    source = SeedSource(path)
+    if cursor_path is None:
+        return source
+    return SeedPool(source, cursor_path=cursor_path)
+
 def setup_simQ(params):
     """ Setup SimulaQron backend with required parameters.
 
@@ -122,18 +1455,311 @@ def setup_simQ(params):
 def setup_network(params):
     """ Setup new Simulaqron network. 
 
+    The nodes are placed on consecutive free ports, found from port_base if
+    given in params, rather than on the first ports SimulaQron finds, so that
+    networks can be started concurrently. SimulaQron before version 3 can't 
+    be told which ports to use, in which case its own are kept.
+
     Args:
         params (dict): Network parameters to be used.
 
     Return:
         network (simulaqron.network.Network): Pointer to started network.
     """
-    network = Network(**params)
+    params = dict(params)
+    port_base = params.pop('port_base', None)
+    if params.get('nodes') is None or not NETWORK_PORTS_SUPPORTED:
+        if port_base is not None:
+            logging.warning("EM\t: This SimulaQron can't place networks on "
+                            "chosen ports, ignoring port_base.")
+        network = Network(**params)
+    else:
+        if port_base is None:
+            port_base = NETWORK_PORT_BASE
+        n_ports = 3*len(params['nodes'])
+        port_base = allocate_ports(params['name'], n_ports, port_base)
+        write_network_config(params['name'], params['nodes'],
+                             params.get('topology'), port_base)
+        network = Network(name=params['name'], nodes=params['nodes'], 
+                          new=False)
     network.start()
     logging.info("EM\t: Network setup complete.")
 
     return network
 
+def stop_network(network):
+    """ Stop a network and free the ports it was given.
+
+    Args:
+        network (simulaqron.network.Network): network to stop.
+    """
+    network.stop()
+    free_ports(network.name)
+
+@contextmanager
+def _network_config_lock():
+    """ Hold the lock on the SimulaQron network config file. """
+    with open(simulaqron_settings.network_config_file + ".lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+def _read_port_leases():
+    """ Port ranges leased to networks by live processes.
+
+    Return:
+        (dict): (first port, number of ports, process id) by network name.
+    """
+    path = simulaqron_settings.network_config_file + ".ports"
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        leases = json.load(f)
+    live = {}
+    for name, (first, n_ports, pid) in leases.items():
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            continue
+        except PermissionError:
+            pass
+        live[name] = (first, n_ports, pid)
+    return live
+
+def _write_port_leases(leases):
+    """ Store the port leases next to the network config file. """
+    path = simulaqron_settings.network_config_file + ".ports"
+    with open(path + ".tmp", 'w') as f:
+        json.dump(leases, f)
+    os.replace(path + ".tmp", path)
+
+def _port_free(port):
+    """ Whether a port on localhost can currently be bound. """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        try:
+            sock.bind(("localhost", port))
+        except OSError:
+            return False
+    return True
+
+def allocate_ports(name, n_ports, port_base=NETWORK_PORT_BASE):
+    """ Lease a range of free ports to a network.
+
+    Ports are leased in a file shared by every process, so that a range is
+    not handed out twice while a network is still starting up. Leases held
+    by processes that have since exited are ignored.
+
+    Args:
+        name (str): name of the network.
+        n_ports (int): number of consecutive ports needed.
+        port_base (int): port from which to search. 
+
+    Return:
+        (int): first port of the range.
+    """
+    with _network_config_lock():
+        leases = _read_port_leases()
+        leases.pop(name, None)
+        port = port_base
+        while True:
+            clash = [first + n for first, n, _ in leases.values()
+                     if first < port + n_ports and port < first + n]
+            if clash:
+                port = max(clash)
+                continue
+            busy = [p for p in range(port, port + n_ports) if not _port_free(p)]
+            if busy:
+                port = busy[-1] + 1
+                continue
+            break
+        leases[name] = (port, n_ports, os.getpid())
+        _write_port_leases(leases)
+    return port
+
+def free_ports(name):
+    """ End a network's port lease and remove it from the config file.
+
+    Args:
+        name (str): name of the network.
+    """
+    config_file = simulaqron_settings.network_config_file
+    with _network_config_lock():
+        leases = _read_port_leases()
+        if leases.pop(name, None) is None:
+            return
+        _write_port_leases(leases)
+        if not os.path.exists(config_file):
+            return
+        with open(config_file, 'r') as f:
+            config = json.load(f)
+        config.pop(name, None)
+        with open(config_file, 'w') as f:
+            json.dump(config, f, indent=4)
+
+def write_network_config(name, nodes, topology, port_base):
+    """ Add a network on a fixed port range to the SimulaQron config file.
+
+    Each node takes three consecutive ports (application, CQC and virtual
+    node). The config file is shared by every SimulaQron process, so it is
+    locked while being rewritten.
+
+    Args:
+        name (str): name of the network.
+        nodes (list): names of the nodes in the network.
+        topology (dict or str): network topology, as for Network.
+        port_base (int): first port used by the network.
+    """
+    topology = construct_topology_config(topology, nodes)
+    config_file = simulaqron_settings.network_config_file
+    with _network_config_lock():
+        config = {}
+        if os.path.exists(config_file):
+            with open(config_file, 'r') as f:
+                config = json.load(f)
+        sockets = {}
+        for i, node in enumerate(nodes):
+            ports = port_base + 3*i + np.arange(3)
+            sockets[node] = {'app_socket': ["localhost", int(ports[0])],
+                             'cqc_socket': ["localhost", int(ports[1])],
+                             'vnode_socket': ["localhost", int(ports[2])]}
+        config[name] = {'nodes': sockets, 'topology': topology}
+        with open(config_file, 'w') as f:
+            json.dump(config, f, indent=4)
+    logging.info("EM\t: Network %s placed on ports %d-%d.", name, port_base,
+                 port_base + 3*len(nodes) - 1)
+
+def _init_sweep_worker(counter, log_level):
+    """ Number a sweep worker process and configure its logging.
+
+    Args:
+        counter (multiprocessing.Value): number of workers started so far.
+        log_level (int): logging level used by the worker.
+    """
+    global _sweep_worker
+    with counter.get_lock():
+        _sweep_worker = counter.value
+        counter.value += 1
+    logging.basicConfig(format=LOG_FORMAT, level=log_level)
+
+def _run_sweep_point(script, argv, outpath, port_base):
+    """ Run one configuration of a sweep in a worker process.
+
+    Args:
+        script (str): name of the experiment module, e.g. certified_expansion.
+        argv (list): command line arguments for the experiment.
+        outpath (str): if set, overrides the experiment's output path.
+        port_base (int): first port of the range shared by the workers.
+
+    Return:
+        (dict): the experiment arguments together with its main results.
+    """
+    module = importlib.import_module(script)
+    args = module.get_parser().parse_args(argv)
+    args.network_name = "{}_{}".format(script, _sweep_worker)
+    args.port_base = port_base + SWEEP_PORTS_PER_WORKER*_sweep_worker
+    if outpath is not None:
+        args.outpath = outpath
+    row = dict(vars(args))
+    row.update(module.main(args))
+    return row
+
+def run_sweep(script, argvs, n_workers=None, outdir=None, 
+              port_base=NETWORK_PORT_BASE):
+    """ Run many configurations of an experiment in parallel processes.
+
+    Every worker process starts its networks under its own name and on its
+    own range of ports, so experiments in different workers do not interfere.
+    SimulaQron settings are shared between processes, so all configurations
+    in a sweep should use the same backend.
+
+    Args:
+        script (str): name of the experiment module, e.g. certified_expansion.
+        argvs (list): command line arguments for each configuration.
+        n_workers (int): number of worker processes. Defaults to None, using
+            one per core.
+        outdir (str): if set, results of configuration i are stored in this
+            directory as <script>_<i>. Defaults to None, using the outpath
+            given in each configuration.
+        port_base (int): first port used by the workers.
+
+    Return:
+        (list): one dictionary of arguments and results per configuration.
+    """
+    counter = mp.Value('i', 0)
+    logging.info("SWEEP\t: Running %d configurations of %s.", len(argvs),
+                 script)
+    with ProcessPoolExecutor(n_workers, initializer=_init_sweep_worker,
+                             initargs=(counter, LOG_LEVEL)) as pool:
+        futures = []
+        for i, argv in enumerate(argvs):
+            outpath = None
+            if outdir is not None:
+                outpath = os.path.join(outdir, "{}_{:04d}".format(script, i))
+            futures.append(pool.submit(_run_sweep_point, script, argv,
+                                       outpath, port_base))
+        rows = [future.result() for future in futures]
+    logging.info("SWEEP\t: Sweep complete.")
+
+    return rows
+
+def check_table(path, columns):
+    """ Check that rows with the given columns can be appended to a CSV file.
+
+    Args:
+        path (str): path of the CSV file.
+        columns (iterable): names of the columns of the rows.
+
+    Return:
+        (list): columns of the existing table, empty if there is none yet.
+
+    Raises:
+        ValueError: if the existing table lacks any of the columns.
+    """
+    if not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return []
+    with open(path, 'r', newline='') as f:
+        existing = next(csv.reader(f))
+    new = set(columns) - set(existing)
+    if new:
+        raise ValueError("Columns {} are not in {}.".format(sorted(new), path))
+    return existing
+
+def write_table(rows, path, append=False):
+    """ Write a list of result dictionaries to a CSV file.
+
+    Args:
+        rows (list): dictionaries with one entry per column.
+        path (str): path of the CSV file.
+        append (bool): add the rows to an existing table, keeping its columns.
+    """
+    columns = []
+    if append:
+        columns = check_table(path, [key for row in rows for key in row])
+    if columns:
+        with open(path, 'a', newline='') as f:
+            csv.DictWriter(f, fieldnames=columns).writerows(rows)
+        return
+    for row in rows:
+        columns += [key for key in row if key not in columns]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def limit_batch_size(batch_size):
+    """ Limit a batch of qubits to what a SimulaQron node can hold at once.
+
+    Args:
+        batch_size (int): requested number of qubits per batch.
+
+    Return:
+        (int): batch size no greater than the per-node qubit limit.
+    """
+    if batch_size > simulaqron_settings.max_qubits:
+        logging.warning("EM\t: Batch size %d exceeds qubit limit, using %d.",
+                        batch_size, simulaqron_settings.max_qubits)
+        return simulaqron_settings.max_qubits
+    return batch_size
+
 def change_basis(qubit, basis):
     """ Apply specified basis transformation to qubit.
 
@@ -156,7 +1782,86 @@ def change_basis(qubit, basis):
     else:
         raise ValueError('Valid bases are Z, X, X+Z and X-Z.')
 
-def estimate_CHSH(bases_A, bases_B, results_A, results_B, px=0.5, py=0.5):
+def popcount(packed):
+    """ Count the set bits in an array of packed bytes.
+
+    Args:
+        packed (np.ndarray): bytes, e.g. as produced by np.packbits.
+
+    Return:
+        (int): total number of set bits.
+    """
+    return int(POPCOUNT_TABLE[np.asarray(packed, dtype=np.uint8)].sum(dtype=np.int64))
+
+def _chsh_negative_rounds(bases_A, bases_B, results_A, results_B, packed, n,
+                          mask=None):
+    """ Count the rounds contributing -1 to the CHSH correlation function.
+
+    A round contributes -1 when the results agree and both bases are 1, or 
+    the results disagree and at least one basis is 0, i.e. a^b^(x&y) == 1.
+
+    Return:
+        (tuple): number of negative rounds and total number of rounds.
+    """
+    if packed:
+        x, y, a, b = (np.asarray(arr, dtype=np.uint8) for arr in
+                      (bases_A, bases_B, results_A, results_B))
+        negative = np.bitwise_xor(a ^ b, x & y)
+        if mask is not None:
+            mask = np.asarray(mask, dtype=np.uint8)
+            return popcount(negative & mask), popcount(mask)
+        if n is None:
+            n = 8 * len(x)
+        # padding bits are zero in all four arrays so never contribute
+        return popcount(negative), n
+    x = np.asarray(bases_A) != 0
+    y = np.asarray(bases_B) != 0
+    agree = np.asarray(results_A) == np.asarray(results_B)
+    return int(np.count_nonzero(agree == np.logical_and(x, y))), len(x)
+
+class CHSHAccumulator:
+    """ Incrementally estimate the CHSH correlation function.
+
+    Rounds can be fed in chunks as they are produced, so the full set of 
+    bases and results never has to be held in memory at once.
+
+    Attributes:
+        n (int): number of rounds accumulated so far.
+        n_negative (int): number of rounds contributing -1.
+    """
+    def __init__(self):
+        self.n = 0
+        self.n_negative = 0
+
+    def update(self, bases_A, bases_B, results_A, results_B, packed=False,
+               n=None, mask=None):
+        """ Add a chunk of rounds to the running estimate.
+
+        Args:
+            bases_A (iterable): binary list of measurement bases for system A
+            bases_B (iterable): binary list of measurement bases for system B
+            results_A (iterable): binary list of measurement results for 
+                system A
+            results_B (iterable): binary list of measurement results for 
+                system B
+            packed (bool): are the inputs bytes packed with np.packbits?
+            n (int): number of rounds in a packed chunk. Defaults to None, 
+                in which case every packed bit is taken to be a round.
+            mask (np.ndarray): packed validity mask of a packed chunk, only 
+                rounds set in the mask are counted. Defaults to None.
+        """
+        n_negative, n = _chsh_negative_rounds(bases_A, bases_B, results_A,
+                                              results_B, packed, n, mask)
+        self.n_negative += n_negative
+        self.n += n
+
+    @property
+    def estimate(self):
+        """ (float): current estimate of the CHSH correlation function. """
+        return 4 * (self.n - 2*self.n_negative) / self.n
+
+def estimate_CHSH(bases_A, bases_B, results_A, results_B, px=0.5, py=0.5,
+                  packed=False, n=None, mask=None):
     """ Estimate the CHSH correlation function.
 
     Args:
@@ -164,13 +1869,130 @@ def estimate_CHSH(bases_A, bases_B, results_A, results_B, px=0.5, py=0.5):
         bases_B (iterable): binary list of measurement bases for system B
         results_A (iterable): binary list of measurement results for system A
         results_B (iterable): binary list of measurement results for system B
+        packed (bool): are the inputs bytes packed with np.packbits?
+        n (int): number of rounds in packed inputs, required if packed, as
+            the zero padding of the last byte would otherwise be counted.
+        mask (np.ndarray): packed validity mask of packed inputs, only rounds
+            set in the mask are counted. Defaults to None.
+    """
+    if packed and n is None:
+        raise ValueError("Packed inputs need their number of rounds n.")
+    acc = CHSHAccumulator()
+    acc.update(bases_A, bases_B, results_A, results_B, packed, n, mask)
+    return acc.estimate
+
+def pack_parties(bits):
+    """ Pack the binary values of each party in a round into one integer.
+
+    Args:
+        bits (np.ndarray): (n_parties, n_runs) array of binary values, e.g. 
+            the bases or results of a four-partite experiment.
+
+    Return:
+        (np.ndarray): n_runs integers with the first party as the most 
+            significant bit.
     """
-    I = 0
-    for i, (x, y) in enumerate(zip(bases_A, bases_B)):
-        a = results_A[i]
-        b = results_B[i]
-        I += (-1)**(x*y) * ((int(a==b) - int(a!=b)) / 0.25)
-    return I/len(bases_A)
+    bits = np.asarray(bits) != 0
+    n_parties = bits.shape[0]
+    packed = np.zeros(bits.shape[1], dtype=np.uint8)
+    for p in range(n_parties):
+        packed |= bits[p].astype(np.uint8) << (n_parties - 1 - p)
+    return packed
+
+def _fpb_table(U0, U1):
+    """ Tabulate the four-partite Bell inequality predicate.
+
+    Args:
+        U0 (list): packed basis/result tuples in U0.
+        U1 (list): packed basis/result tuples in U1.
+
+    Return:
+        (np.ndarray): 16x16 boolean table indexed by packed bases and results.
+    """
+    table = np.zeros((16, 16), dtype=bool)
+    for u in range(16):
+        if u in U0:
+            table[u, U1] = True
+        elif u in U1:
+            table[u, U0] = True
+    return table
+
+def _packed_minterms(planes, mask):
+    """ Select the rounds taking each packed 4-bit value.
+
+    Args:
+        planes (list): packed bits of each of the four systems.
+        mask (np.ndarray): packed validity mask.
+
+    Return:
+        (list): for each value 0-15, packed bits set in rounds taking it.
+    """
+    planes = [np.asarray(plane, dtype=np.uint8) for plane in planes]
+    minterms = []
+    for value in range(16):
+        rounds = mask.copy()
+        for p, plane in enumerate(planes):
+            rounds &= plane if (value >> (3 - p)) & 1 else ~plane
+        minterms.append(rounds)
+    return minterms
+
+class FPBAccumulator:
+    """ Incrementally estimate the four-partite Bell inequality violation.
+
+    Each round's bases and results are packed into 4-bit integers and scored
+    against a precomputed table, so chunks of rounds can be fed in as they
+    are produced.
+
+    Attributes:
+        n (int): number of rounds accumulated so far.
+        n_pass (int): number of rounds satisfying the predicate.
+    """
+    def __init__(self, table=None):
+        self.table = FPB_TABLE if table is None else table
+        self.n = 0
+        self.n_pass = 0
+
+    def update(self, bases, results):
+        """ Add a chunk of rounds to the running estimate.
+
+        Args:
+            bases (np.ndarray): (4, n_runs) array of bases used in each 
+                measurement.
+            results (np.ndarray): (4, n_runs) array of results obtained in 
+                each measurement.
+        """
+        u = pack_parties(bases)
+        x = pack_parties(results)
+        self.n_pass += int(np.count_nonzero(self.table[u, x]))
+        self.n += len(u)
+
+    def update_packed(self, bases, results, mask):
+        """ Add a chunk of bit-packed rounds to the running estimate.
+
+        The table is evaluated on the packed bytes directly: for every packed
+        tuple u the rounds taking that value are selected bitwise, so no 
+        round is unpacked.
+
+        Args:
+            bases (list): packed bases of each of the four systems.
+            results (list): packed results of each of the four systems.
+            mask (np.ndarray): packed validity mask, only rounds set in the 
+                mask are counted.
+        """
+        mask = np.asarray(mask, dtype=np.uint8)
+        u_rounds = _packed_minterms(bases, mask)
+        x_rounds = _packed_minterms(results, mask)
+        for u in range(16):
+            if self.table[u].any():
+                x_any = np.bitwise_or.reduce([x_rounds[x] for x in 
+                                              np.flatnonzero(self.table[u])])
+                self.n_pass += popcount(u_rounds[u] & x_any)
+        self.n += popcount(mask)
+
+    @property
+    def estimate(self):
+        """ (float): current estimate of the Bell inequality violation. """
+        return self.n_pass / self.n
 
 def estimate_FPB(bases, results):
     """ Estimate the four-partite Bell inequality violation.
@@ -179,53 +2001,329 @@ def estimate_FPB(bases, results):
         bases (np.ndarray): array of bases used in each measurement.
         results (np.ndarray): array of results obtained in each measurement.
     """
-    U0 = ['[1 0 0 0]', '[0 1 0 0]', '[0 0 1 0]', '[0 0 0 1]']
-    U1 = ['[1 0 0 0]', '[0 1 0 0]', '[0 0 1 0]', '[0 0 0 1]']
-    B = 0
-    for i in range(bases.shape[1]):
-        u = str(bases[:,i])
-        x = str(results[:,i])
-        if u in U0:
-            if x in U1:
-                B += 1
-        elif u in U1:
-            if x in U0:
-                B += 1
-    return B/bases.shape[1]
-
-def carter_wegman_extractor(source, seed, k, epsilon):
-	""" A Carter-Wegman hashing based randomness extractor.
-
-	http://users.cms.caltech.edu/~vidick/teaching/120_qcrypto/LN_Week4.pdf
-
-	A (k, epsilon)-strong randmoness extractor based on Carter-Wegman hashing.
-	Note that as the extractor is strong, the seed can be appended to its
-	output without compromising the uniformity of the final string. The seed
-	must be two-times the length of the source.
-
-	In the finite field F_q where q=2^n, f_{a,b}(x)=ax+b, (a,b) in F_q^2. 
-
-	Args:
-		source (np.ndarray): string of bits from a source of known min-entropy.
-		seed (np.ndarray): string of bits from uniformly random source.
-		k (float): (lower bound on) the min-entropy of the source.
-		epsilon (float): distance from uniform randomness accepted.
-
-	Returns:
-		(np.ndarray): random string of reduced length epsilon-close to uniform
-			randomness.
-	"""
-	d = len(seed)
-	n = len(source)
-	m = (int) (k - 2*np.log2(1/epsilon))
-	if (d < 2*n):
-		raise ValueError("Seed must have length two times that of source.")
-	# apply hash function by "sampling" from family of functions using seed
-	a = seed[:n]
-	b = seed[n:2*n]
-	f = np.logical_xor(np.logical_and(a, source), b)
-	# discard bits to satisfy leftover hash lemma 
-	return f[:m]
+    acc = FPBAccumulator()
+    acc.update(bases, results)
+    return acc.estimate
+
+FPB_TABLE = _fpb_table(FPB_U0, FPB_U1)
+
+def pack_words(bits, n, packed=False):
+    """ Pack a bit string into blocks of 64-bit words.
+
+    Bit i of each block is stored as the coefficient of x^i, i.e. bit i%64 of
+    word i//64. The final block is zero-padded.
+
+    Args:
+        bits (np.ndarray): binary string to pack.
+        n (int): number of bits per block, a multiple of 64.
+        packed (bool): is the string bytes packed with np.packbits? If so,
+            the bytes are reordered without unpacking.
+
+    Return:
+        (np.ndarray): (n_blocks, n//64) array of np.uint64 words.
+    """
+    if packed:
+        data = BIT_REVERSE_TABLE[np.asarray(bits, dtype=np.uint8)]
+    else:
+        data = np.packbits(np.asarray(bits) != 0, bitorder='little')
+    n_blocks = max(1, -(-len(data) // (n // 8)))
+    padded = np.zeros(n_blocks * n // 8, dtype=np.uint8)
+    padded[:len(data)] = data
+    return padded.view('<u8').reshape(n_blocks, n // 64)
+
+def unpack_words(words):
+    """ Unpack blocks of 64-bit words back into one bit string per block.
+
+    Args:
+        words (np.ndarray): (n_blocks, w) array of np.uint64 words.
+
+    Return:
+        (np.ndarray): (n_blocks, 64*w) boolean array.
+    """
+    words = np.ascontiguousarray(words, dtype='<u8')
+    bits = np.unpackbits(words.view(np.uint8), bitorder='little')
+    return bits.reshape(words.shape[0], -1).astype(bool)
+
+def gf2n_multiply(a, b, n):
+    """ Multiply elements of GF(2^n) blockwise.
+
+    Carry-less shift-and-add multiplication, reducing by the precomputed 
+    polynomial in GF2N_REDUCTION after every shift. Each step is applied to 
+    all blocks at once.
+
+    Args:
+        a (np.ndarray): (n_blocks, n//64) array of np.uint64 words.
+        b (np.ndarray): (n_blocks, n//64) array of np.uint64 words.
+        n (int): field size, one of GF2N_REDUCTION.
+
+    Return:
+        (np.ndarray): (n_blocks, n//64) array holding a*b in GF(2^n).
+    """
+    if n not in GF2N_REDUCTION:
+        raise ValueError("Supported field sizes are {}.".format(
+            sorted(GF2N_REDUCTION)))
+    one, top = np.uint64(1), np.uint64(63)
+    zero, poly = np.uint64(0), np.uint64(GF2N_REDUCTION[n])
+    a = np.array(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    p = np.zeros_like(a)
+    for i in range(n):
+        # add a*x^i if bit i of b is set
+        mask = zero - ((b[:, i // 64] >> np.uint64(i % 64)) & one)
+        p ^= a & mask[:, None]
+        # a <- a*x mod the reduction polynomial
+        carry = a[:, -1] >> top
+        a[:, 1:] = (a[:, 1:] << one) | (a[:, :-1] >> top)
+        a[:, 0] = (a[:, 0] << one) ^ (poly & (zero - carry))
+    return p
+
+def carter_wegman_extractor(source, seed, k, epsilon, block_size=None,
+                            packed=False):
+    """ A Carter-Wegman hashing based randomness extractor.
+
+    http://users.cms.caltech.edu/~vidick/teaching/120_qcrypto/LN_Week4.pdf
+
+    A (k, epsilon)-strong randmoness extractor based on Carter-Wegman hashing.
+    Note that as the extractor is strong, the seed can be appended to its
+    output without compromising the uniformity of the final string. The seed
+    must be two-times the length of the (zero-padded) source.
+
+    In the finite field F_q where q=2^n, f_{a,b}(x)=ax+b, (a,b) in F_q^2. 
+
+    Long sources are hashed in blocks of block_size bits, each with its own 
+    (a, b) drawn from the seed. The min-entropy is assumed to be spread evenly
+    over the blocks, each contributing k/n_blocks to the leftover hash lemma.
+
+    Args:
+        source (np.ndarray): string of bits from a source of known min-entropy.
+        seed (np.ndarray): string of bits from uniformly random source.
+        k (float): (lower bound on) the min-entropy of the source.
+        epsilon (float): distance from uniform randomness accepted.
+        block_size (int): field size n used for each block, one of 
+            GF2N_REDUCTION. Defaults to None, the smallest field holding the 
+            whole source.
+        packed (bool): is the source bytes packed with np.packbits?
+
+    Returns:
+        (np.ndarray): random string of reduced length epsilon-close to uniform
+            randomness.
+    """
+    n_source = 8*len(source) if packed else len(source)
+    if block_size is None:
+        fields = [n for n in sorted(GF2N_REDUCTION) if n >= n_source]
+        if not fields:
+            raise ValueError("Source too long for a single field element, "
+                             "specify a block_size.")
+        block_size = fields[0]
+    n_blocks = max(1, -(-n_source // block_size))
+    m = (int) (k / n_blocks - 2*np.log2(1/epsilon))
+    if m <= 0:
+        raise ValueError("Insufficient min-entropy per block to extract.")
+    d = len(seed)
+    n = n_blocks * block_size
+    if (d < 2*n):
+        raise ValueError("Seed must have length two times that of source.")
+    # apply hash function by "sampling" from family of functions using seed
+    seed = np.asarray(seed)
+    a = pack_words(seed[:n], block_size)
+    b = pack_words(seed[n:2*n], block_size)
+    x = pack_words(source, block_size, packed)
+    f = gf2n_multiply(a, x, block_size) ^ b
+    # discard bits to satisfy leftover hash lemma 
+    return unpack_words(f)[:, :m].ravel()
+
+def toeplitz_extractor(source, seed, k, epsilon, block_size=None,
+                       packed=False):
+    """ A Toeplitz hashing based randomness extractor.
+
+    A (k, epsilon)-strong randomness extractor multiplying each n-bit block of
+    the source by an m x n Toeplitz matrix over F_2, T_{ij} = s_{i-j+n-1}. The
+    product is evaluated as a convolution with FFTs, costing O(n log n) per 
+    block, and the seed need only have length n+m-1.
+
+    As the extractor is strong, the same seed is reused for every block. The 
+    min-entropy is assumed to be spread evenly over the blocks, each 
+    contributing k/n_blocks to the leftover hash lemma.
+
+    Args:
+        source (np.ndarray): string of bits from a source of known min-entropy.
+        seed (np.ndarray): string of bits from uniformly random source.
+        k (float): (lower bound on) the min-entropy of the source.
+        epsilon (float): distance from uniform randomness accepted.
+        block_size (int): number of source bits hashed at once. Defaults to 
+            None, in which case the whole source is one block.
+        packed (bool): is the source bytes packed with np.packbits? If so, 
+            only one group of blocks is unpacked at a time and block_size 
+            must be a multiple of 8.
+
+    Returns:
+        (np.ndarray): random string of reduced length epsilon-close to uniform
+            randomness.
+    """
+    n_source = 8*len(source) if packed else len(source)
+    n = n_source if block_size is None else block_size
+    n_blocks = max(1, -(-n_source // n))
+    m = (int) (k / n_blocks - 2*np.log2(1/epsilon))
+    if m <= 0:
+        raise ValueError("Insufficient min-entropy per block to extract.")
+    if len(seed) < n + m - 1:
+        raise ValueError("Seed must have length n+m-1 for n-bit blocks.")
+    if packed and n % 8:
+        raise ValueError("Block size must be a multiple of 8 for packed sources.")
+    # transform the seed once and convolve each group of blocks against it
+    n_fft = 1 << (2*n + m - 3).bit_length()
+    seed_fft = np.fft.rfft(np.asarray(seed[:n+m-1]) != 0, n_fft)
+    group = max(1, TOEPLITZ_FFT_BUFFER // n_fft)
+    f = np.empty((n_blocks, m), dtype=bool)
+    for i in range(0, n_blocks, group):
+        g = min(group, n_blocks - i)
+        if packed:
+            bits = np.unpackbits(np.asarray(source[i*n//8:(i+g)*n//8], 
+                                            dtype=np.uint8))
+        else:
+            bits = np.asarray(source[i*n:(i+g)*n]) != 0
+        x = np.zeros(g * n, dtype=np.float64)
+        x[:len(bits)] = bits
+        conv = np.fft.irfft(np.fft.rfft(x.reshape(g, n), n_fft) * seed_fft, 
+                            n_fft)
+        f[i:i+g] = np.rint(conv[:, n-1:n-1+m]).astype(np.int64) & 1
+    return f.ravel()
+
+def inner_product_bound(block_size, epsilon):
+    """ Least total min-entropy of a pair of blocks the inner product 
+    extractor can extract from.
+
+    Args:
+        block_size (int): number of bits per block.
+        epsilon (float): distance from uniform randomness accepted.
+
+    Return:
+        (float): bound the min-entropies of the two blocks must sum beyond.
+    """
+    return block_size + 2*np.log2(1/epsilon)
+
+def inner_product_extractor(source_1, source_2, block_size, k_1, k_2, 
+                            epsilon):
+    """ The Chor-Goldreich inner product two-source extractor.
+
+    Each pair of block_size-bit blocks (x, y) from the two independent weak 
+    sources yields the single bit <x, y> mod 2, which is epsilon-close to 
+    uniform provided k_1 + k_2 > block_size + 2*log2(1/epsilon) for the 
+    min-entropies of the blocks. The blocks are bit-packed and the parity of
+    every pair is taken at once: XORing together the bytes of x & y leaves a
+    byte with the same parity.
+
+    Args:
+        source_1 (np.ndarray): string of bits from the first weak source.
+        source_2 (np.ndarray): string of bits from the second weak source.
+        block_size (int): number of bits per block, a multiple of 8.
+        k_1 (float): (lower bound on) the min-entropy of each block of the 
+            first source.
+        k_2 (float): (lower bound on) the min-entropy of each block of the 
+            second source.
+        epsilon (float): distance from uniform randomness accepted.
+
+    Returns:
+        (np.ndarray): one random bit for each complete pair of blocks.
+    """
+    if block_size % 8:
+        raise ValueError("Block size must be a multiple of 8.")
+    if k_1 + k_2 <= inner_product_bound(block_size, epsilon):
+        raise ValueError("Insufficient min-entropy per block to extract.")
+    n_blocks = min(len(source_1), len(source_2)) // block_size
+    n = n_blocks * block_size
+    x, y = (np.packbits(np.asarray(s[:n]) != 0).reshape(n_blocks, 
+                                                        block_size // 8)
+            for s in (source_1, source_2))
+    parity = np.bitwise_xor.reduce(x & y, axis=1)
+    return (POPCOUNT_TABLE[parity] & 1).astype(bool)
+
+class Extractor(ABC):
+    """ Common interface to the seeded randomness extractors.
+
+    Subclasses wrap an extractor function so that post-processing can choose 
+    the extractor by name from EXTRACTORS.
+
+    Attributes:
+        block_size (int): number of source bits hashed at once, None for the 
+            extractor's default.
+    """
+    def __init__(self, block_size=None):
+        self.block_size = block_size
+
+    def layout(self, n):
+        """ Split an n-bit source into blocks.
+
+        Args:
+            n (int): length of the source.
+
+        Return:
+            (tuple): bits per block and number of blocks.
+        """
+        block_size = n if self.block_size is None else self.block_size
+        return block_size, max(1, -(-n // block_size))
+
+    def output_length(self, n, k, epsilon):
+        """ Number of bits extracted from an n-bit source.
+
+        Args:
+            n (int): length of the source.
+            k (float): (lower bound on) the min-entropy of the source.
+            epsilon (float): distance from uniform randomness accepted.
+        """
+        _, n_blocks = self.layout(n)
+        return n_blocks * (int) (k / n_blocks - 2*np.log2(1/epsilon))
+
+    @abstractmethod
+    def seed_length(self, n, k, epsilon):
+        """ Number of seed bits consumed extracting from an n-bit source.
+
+        Args:
+            n (int): length of the source.
+            k (float): (lower bound on) the min-entropy of the source.
+            epsilon (float): distance from uniform randomness accepted.
+        """
+
+    @abstractmethod
+    def extract(self, source, seed, k, epsilon, packed=False):
+        """ Extract randomness from the source.
+
+        Args:
+            source (np.ndarray): string of bits from a source of known 
+                min-entropy.
+            seed (np.ndarray): string of bits from uniformly random source.
+            k (float): (lower bound on) the min-entropy of the source.
+            epsilon (float): distance from uniform randomness accepted.
+            packed (bool): is the source bytes packed with np.packbits?
+        """
+
+class CarterWegmanExtractor(Extractor):
+    """ Extractor interface to carter_wegman_extractor. """
+    def layout(self, n):
+        block_size = self.block_size
+        if block_size is None:
+            block_size = min([f for f in GF2N_REDUCTION if f >= n],
+                             default=max(GF2N_REDUCTION))
+        return block_size, max(1, -(-n // block_size))
+
+    def seed_length(self, n, k, epsilon):
+        block_size, n_blocks = self.layout(n)
+        return 2 * block_size * n_blocks
+
+    def extract(self, source, seed, k, epsilon, packed=False):
+        block_size, _ = self.layout(8*len(source) if packed else len(source))
+        return carter_wegman_extractor(source, seed, k, epsilon, block_size,
+                                       packed)
 
+class ToeplitzExtractor(Extractor):
+    """ Extractor interface to toeplitz_extractor. """
+    def seed_length(self, n, k, epsilon):
+        block_size, n_blocks = self.layout(n)
+        return block_size + self.output_length(n, k, epsilon)//n_blocks - 1
 
+    def extract(self, source, seed, k, epsilon, packed=False):
+        return toeplitz_extractor(source, seed, k, epsilon, self.block_size,
+                                  packed)
 
+EXTRACTORS = {'carter_wegman': CarterWegmanExtractor,
+              'toeplitz': ToeplitzExtractor}
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# The sims scripts and BB84 example import their modules as top-level names,
+# so put their directories on the path as running them would.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in [os.path.join(ROOT, 'sims'),
+                  os.path.join(ROOT, 'simple_examples', 'BB84_QKD')]:
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
@@ -0,0 +1,99 @@
+import os
+import numpy as np
+import pytest
+import amplification
+import reconciliation
+import utils
+
+ANU_SEED = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'sims', 'anu_seed.txt')
+
+
+def random_key(n, seed):
+    return np.random.default_rng(seed).integers(0, 2, n).astype(np.uint8)
+
+
+def test_min_entropy_rate():
+    assert amplification.min_entropy_rate(0, 100, 0) == 1
+    assert amplification.min_entropy_rate(0, 100, 30) == pytest.approx(0.7)
+    h = -0.1*np.log2(0.1) - 0.9*np.log2(0.9)
+    assert amplification.min_entropy_rate(0.1, 100, 10) \
+        == pytest.approx(0.9 - h)
+    assert amplification.min_entropy_rate(0.3, 100, 50) == 0
+    assert amplification.min_entropy_rate(0.01, 0, 0) == 0
+
+
+def test_blocks_stack_each_party_block():
+    alice_key, bob_key = random_key(10, 1), random_key(10, 2)
+    key_blocks = list(amplification.blocks((alice_key, bob_key), 4))
+    assert [block.shape for block in key_blocks] == [(2, 4), (2, 4), (2, 2)]
+    assert np.array_equal(np.concatenate(key_blocks, axis=1),
+                          np.stack([alice_key, bob_key]))
+
+
+@pytest.mark.parametrize("extractor", ['toeplitz', 'carter_wegman'])
+def test_reconciled_keys_amplify_to_shared_secret(extractor):
+    rng = np.random.default_rng(3)
+    alice_key = random_key(20000, 4)
+    bob_key = alice_key ^ (rng.random(20000) < 0.02).astype(np.uint8)
+    bob_key, n_leaked, _ = reconciliation.Cascade(seed=5).reconcile(
+        alice_key, bob_key, 0.02)
+    with amplification.PrivacyAmplifier(extractor, 
+                                        block_size=8192) as amplifier:
+        alice_secret, bob_secret = amplifier.amplify_keys(alice_key, bob_key, 
+                                                          0.02, n_leaked)
+    assert np.array_equal(alice_secret, bob_secret)
+
+    # each block shrunk to the extractor's bound for its min-entropy
+    rate = amplification.min_entropy_rate(0.02, 20000, n_leaked)
+    expected = sum(amplifier.extractor.output_length(n, rate*n, 1e-9)
+                   for n in [8192, 8192, 3616])
+    assert len(alice_secret) == expected
+    assert 0 < len(alice_secret) < rate * 20000
+
+
+def test_carter_wegman_pays_for_each_sub_block():
+    key = random_key(50000, 6)
+    lengths = []
+    for extractor in ['toeplitz', 'carter_wegman']:
+        with amplification.PrivacyAmplifier(extractor) as amplifier:
+            lengths.append(len(amplifier.amplify_keys(key, key, 0.01, 
+                                                      5000)[0]))
+    assert lengths[1] < 0.9 * lengths[0]
+
+
+def test_short_key_takes_seed_for_its_own_length():
+    # the file holds far fewer bits than a whole PA_BLOCK_SIZE block needs
+    assert utils.open_seed(ANU_SEED).n_bits < amplification.PA_BLOCK_SIZE
+    key = random_key(1000, 7)
+    with amplification.PrivacyAmplifier('toeplitz', 
+                                        seed_source=ANU_SEED) as amplifier:
+        alice_secret, bob_secret = amplifier.amplify_keys(key, key, 0.01, 100)
+    assert np.array_equal(alice_secret, bob_secret)
+    assert 0 < len(alice_secret) < 900
+
+
+def test_amplifiers_sharing_a_seed_take_disjoint_bits():
+    key = random_key(1000, 8)
+    with utils.open_seed(ANU_SEED) as seed:
+        secrets = []
+        for _ in range(2):
+            with amplification.PrivacyAmplifier('toeplitz', 
+                                                seed=seed) as amplifier:
+                secrets.append(amplifier.amplify_keys(key, key, 0.01, 100)[0])
+        # the second amplifier starts where the first stopped, and neither
+        # closes the shared seed
+        rate = amplification.min_entropy_rate(0.01, 1000, 100)
+        n_bits = amplifier.extractor.seed_length(1000, rate*1000, 
+                                                 amplification.PA_EPSILON)
+        assert seed.consumed == 2 * n_bits
+        assert seed.data is not None
+    assert len(secrets[0]) == len(secrets[1])
+    assert not np.array_equal(secrets[0], secrets[1])
+
+
+def test_amplifier_closes_only_its_own_seed():
+    with amplification.PrivacyAmplifier() as amplifier:
+        amplifier.amplify_keys(random_key(1000, 9), random_key(1000, 9), 
+                               0.01, 100)
+    assert not amplifier.seed._thread.is_alive()
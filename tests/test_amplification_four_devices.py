@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import amplification_four_devices
+import statevector
+import utils
+
+
+def test_prepare_state_is_normalised_graph_state():
+    state = amplification_four_devices.prepare_state()[0]
+    assert np.linalg.norm(state) == pytest.approx(1.)
+    # every computational basis state is equally likely
+    assert np.allclose(np.abs(state)**2, 1/16)
+
+
+def test_native_simulation_matches_explicit_state():
+    np.random.seed(3)
+    n_runs = 40000
+    seeds = np.random.randint(2, size=(4, n_runs))
+    results = amplification_four_devices.simulate(n_runs, seeds, ('X', 'Z'))
+    assert np.array_equal(results[:, 0, :], seeds)
+    # compare the FPB score with the exact probability from the state
+    state = amplification_four_devices.prepare_state()[0]
+    rotations = statevector.basis_rotations(('X', 'Z'))
+    expected = 0.
+    for u in range(16):
+        bits = [(u >> (3 - p)) & 1 for p in range(4)]
+        psi = state[None]
+        for p, x in enumerate(bits):
+            psi = statevector.apply_gate(psi, rotations[x], p)
+        expected += np.sum(np.abs(psi[0, utils.FPB_TABLE[u]])**2) / 16
+    FPB_est = utils.estimate_FPB(results[:, 0, :], results[:, 1, :])
+    assert FPB_est == pytest.approx(expected, abs=0.01)
+
+
+def test_main_checks_extractor_bound_before_running(tmp_path):
+    parser = amplification_four_devices.get_parser()
+    args = parser.parse_args(['100', '--native', '-s', 'local', 
+                              '-o', str(tmp_path / 'results'), 
+                              '-b', '32', '--output_entropy', '0.5'])
+    with pytest.raises(ValueError):
+        amplification_four_devices.main(args)
+    assert not list(tmp_path.iterdir())
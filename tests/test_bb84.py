@@ -0,0 +1,217 @@
+import csv
+from threading import Thread
+import time
+import numpy as np
+import pytest
+import BB84_QKD
+import utils
+
+
+def test_window_bounds_qubits_in_flight():
+    window = BB84_QKD.QubitWindow(2)
+    window.acquire()
+    window.acquire()
+    assert window.n_in_flight == 2
+
+    # a third qubit has to wait for one to be received
+    thread = Thread(target=window.acquire)
+    thread.start()
+    thread.join(timeout=0.1)
+    assert thread.is_alive()
+
+    window.release()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+    assert window.n_in_flight == 2
+    assert window.n_received == 1
+
+
+def test_backoff_waits_for_a_qubit_to_be_received():
+    window = BB84_QKD.QubitWindow(1)
+    window.acquire()
+    Thread(target=lambda: (time.sleep(0.001), window.release())).start()
+    window.backoff()
+    assert window.n_received == 1
+
+
+def test_backoff_gives_up_when_nothing_arrives():
+    window = BB84_QKD.QubitWindow(1)
+    start = time.time()
+    window.backoff()
+    assert time.time() - start < 1
+    assert window.n_received == 0
+
+
+def test_window_size_bounded_by_node_capacity(monkeypatch):
+    monkeypatch.setattr(BB84_QKD.simulaqron_settings, 'max_qubits', 20)
+    assert BB84_QKD.window_size(1) == 1
+    assert BB84_QKD.window_size(20) == 20
+    assert BB84_QKD.window_size(50) == 20
+    assert BB84_QKD.window_size(None) == 20
+
+
+def sift_reference(alice_results, bob_results):
+    """Keep each run's bits where the bases agree, one qubit at a time."""
+    alice_keys, bob_keys, qbers = [], [], []
+    for alice, bob in zip(alice_results, bob_results):
+        alice_key, bob_key = [], []
+        for x, a, y, b in zip(alice[0], alice[1], bob[0], bob[1]):
+            if x == y and x >= 0 and b >= 0:
+                alice_key.append(int(a))
+                bob_key.append(int(b))
+        alice_keys.append(alice_key)
+        bob_keys.append(bob_key)
+        n_errors = sum(a != b for a, b in zip(alice_key, bob_key))
+        qbers.append(n_errors / len(alice_key) if alice_key else np.nan)
+    return (alice_keys, bob_keys, qbers)
+
+
+def random_results(n_runs, n_qubits, rng):
+    alice = rng.integers(0, 2, (n_runs, 2, n_qubits)).astype(float)
+    bob   = rng.integers(0, 2, (n_runs, 2, n_qubits)).astype(float)
+    bob[:,1] = np.where(rng.random((n_runs, n_qubits)) < 0.1, 
+                        1 - alice[:,1], alice[:,1])
+    # qubits never sent or measured in the last run
+    alice[-1,:,n_qubits//2:] = -1
+    bob[-1,:,n_qubits//2:] = -1
+    return (alice, bob)
+
+
+def test_sift_keys_matches_reference():
+    rng = np.random.default_rng(1)
+    alice, bob = random_results(4, 203, rng)
+    alice_keys, bob_keys, key_lens, qbers = BB84_QKD.sift_keys(alice, bob)
+    ref_alice, ref_bob, ref_qbers = sift_reference(alice, bob)
+
+    assert key_lens.tolist() == [len(key) for key in ref_alice]
+    assert alice_keys.dtype == np.uint8
+    assert alice_keys.shape == (4, (max(key_lens) + 7) // 8)
+    for run in range(4):
+        assert np.unpackbits(alice_keys[run], 
+                             count=key_lens[run]).tolist() == ref_alice[run]
+        assert np.unpackbits(bob_keys[run], 
+                             count=key_lens[run]).tolist() == ref_bob[run]
+        # zero-padded past each run's key
+        assert not np.unpackbits(alice_keys[run])[key_lens[run]:].any()
+    assert np.allclose(qbers, ref_qbers)
+
+
+def test_sift_keys_sets_tested_bits_aside():
+    rng = np.random.default_rng(2)
+    alice, bob = random_results(1, 2000, rng)
+    np.random.seed(2)
+    _, _, key_lens, qbers = BB84_QKD.sift_keys(alice, bob, test_prob=0.25)
+    ref_alice, _, _ = sift_reference(alice, bob)
+
+    n_sifted = len(ref_alice[0])
+    assert 0.6 * n_sifted < key_lens[0] < 0.9 * n_sifted
+    assert 0 < qbers[0] < 0.25
+
+    _, _, _, qbers = BB84_QKD.sift_keys(alice, bob, test_prob=0)
+    assert np.isnan(qbers[0])
+
+
+def test_generate_key_unpacks_one_run():
+    rng = np.random.default_rng(3)
+    alice, bob = random_results(1, 100, rng)
+    alice_key, bob_key, qber = BB84_QKD.generate_key(alice[0], bob[0])
+    ref_alice, ref_bob, ref_qbers = sift_reference(alice, bob)
+    assert alice_key.tolist() == ref_alice[0]
+    assert bob_key.tolist() == ref_bob[0]
+    assert qber == ref_qbers[0]
+
+
+def post_process_args(**args):
+    processed = {'reconcile': None, 'passes': 4, 'block_size': None,
+                 'amplify': None, 'seed_source': 'local', 'seed_cursor': None,
+                 'log_keys': False}
+    processed.update(args)
+    return processed
+
+
+def test_post_process_discards_keys_failing_to_reconcile():
+    rng = np.random.default_rng(4)
+    alice_key = rng.integers(0, 2, 2000).astype(np.uint8)
+    bob_key = alice_key ^ (rng.random(2000) < 0.3).astype(np.uint8)
+    args = post_process_args(reconcile='ldpc', block_size=1000, 
+                             amplify='toeplitz')
+    alice_key, bob_key, stats = BB84_QKD.post_process(alice_key, bob_key, 0.01,
+                                                      args)
+    assert len(alice_key) == len(bob_key) == 0
+    assert stats['failed'] == '2'
+    assert stats['secret_len'] == '0'
+
+
+def test_relay_keys_recovers_alice_key():
+    rng = np.random.default_rng(5)
+    sender_keys = [rng.integers(0, 2, n).astype(np.uint8) 
+                   for n in [40, 35, 50]]
+    receiver_keys = [key.copy() for key in sender_keys]
+    alice_key, bob_key = BB84_QKD.relay_keys(sender_keys, receiver_keys)
+    assert np.array_equal(alice_key, sender_keys[0][:35])
+    assert np.array_equal(bob_key, alice_key)
+
+    # a link's disagreement carries through to Bob
+    receiver_keys[1][3] ^= 1
+    _, bob_key = BB84_QKD.relay_keys(sender_keys, receiver_keys)
+    assert np.flatnonzero(bob_key != alice_key).tolist() == [3]
+
+
+class Stopped:
+    def stop(self):
+        pass
+
+
+def network_manager(monkeypatch, n_pairs, n_relays, n_qubits):
+    monkeypatch.setattr(BB84_QKD, 'init_network', lambda *args: Stopped())
+    return BB84_QKD.NetworkManager(n_pairs, n_relays, n_qubits, False, None)
+
+
+def test_path_links_follow_each_chain(monkeypatch):
+    manager = network_manager(monkeypatch, 2, 2, 10)
+    assert len(manager.links) == 6
+    for pair in range(2):
+        links = [manager.links[i] for i in manager.path_links(pair)]
+        assert [link[0] for link in links] == manager.paths[pair][:-1]
+        assert [link[2] for link in links] == manager.paths[pair][1:]
+        assert all(link[1].startswith("Eve{}_".format(pair)) 
+                   for link in links)
+
+
+def test_main_network_writes_a_row_per_link(monkeypatch, tmp_path):
+    n_qubits = 400
+    rng = np.random.default_rng(6)
+    sender_res = rng.integers(0, 2, (4, 2, n_qubits)).astype(float)
+    receiver_res = sender_res.copy()
+    monkeypatch.setattr(BB84_QKD.NetworkManager, 'start', 
+                        lambda self, eavesdrop: None)
+    monkeypatch.setattr(BB84_QKD.NetworkManager, 'join', 
+                        lambda self: (sender_res, receiver_res))
+    monkeypatch.setattr(BB84_QKD, 'init_network', lambda *args: Stopped())
+    outfile = str(tmp_path / "bb84.csv")
+    args = post_process_args(n_pairs=2, n_relays=1, n_qubits=n_qubits, 
+                             noisy=False, t1=None, window=1, eavesdrop=False,
+                             test_prob=None, outfile=outfile, 
+                             reconcile='cascade')
+    BB84_QKD.main_network(args)
+    BB84_QKD.main_network(args)
+
+    with open(outfile, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 8
+    assert list(rows[0]) == BB84_QKD.table_columns(args)
+    assert [row['pair'] for row in rows[:4]] == ['0', '0', '1', '1']
+    assert [row['hop'] for row in rows[:4]] == ['0', '1', '0', '1']
+    for row in rows:
+        assert row['errors'] == row['failed'] == '0'
+        assert int(row['leaked']) > 0
+        assert int(row['pair_key_len']) <= int(row['key_len'])
+
+    # a table started by single pair runs has no columns for the links
+    outfile = str(tmp_path / "bb84_pair.csv")
+    utils.write_table([BB84_QKD.table_row(args, 0., 10, {})], outfile)
+    args['outfile'] = outfile
+    # rejected before the network is started
+    monkeypatch.setattr(BB84_QKD, 'init_network', None)
+    with pytest.raises(ValueError, match="not in"):
+        BB84_QKD.main_network(args)
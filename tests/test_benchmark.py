@@ -0,0 +1,44 @@
+import csv
+import pytest
+import benchmark
+import utils
+
+
+def test_write_table_appends_under_existing_header(tmp_path):
+    path = str(tmp_path / "table.csv")
+    utils.write_table([{'a': 1, 'b': 2}], path, append=True)
+    utils.write_table([{'b': 4, 'a': 3}, {'a': 5}], path, append=True)
+    with open(path, newline='') as f:
+        assert list(csv.reader(f)) == [['a', 'b'], ['1', '2'], ['3', '4'],
+                                       ['5', '']]
+    with pytest.raises(ValueError):
+        utils.write_table([{'a': 6, 'c': 7}], path, append=True)
+
+
+def test_kernels_run_on_small_inputs(tmp_path):
+    args = benchmark.get_parser().parse_args(
+        ['--kind', 'kernels', '-n', '8192', '-r', '1',
+         '-t', str(tmp_path / "bench.csv")])
+    regressions = benchmark.main(args)
+    assert regressions == []
+    with open(args.table, newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['benchmark'] for row in rows] == benchmark.KERNELS
+    assert all(float(row['rate']) > 0 for row in rows)
+    assert all(row['unit'] == 'bits/s' for row in rows)
+
+
+def test_compare_flags_regressions(tmp_path):
+    path = str(tmp_path / "baseline.csv")
+    env = benchmark.environment('native')
+    utils.write_table([dict(env, benchmark='toeplitz', n=10, seconds=1.,
+                            rate=100., unit='bits/s'),
+                       dict(env, benchmark='toeplitz', n=10, seconds=1.,
+                            rate=200., unit='bits/s')], path)
+    row = dict(env, benchmark='toeplitz', n=10, seconds=1., rate=150.,
+               unit='bits/s')
+    # the latest baseline row is compared against
+    assert benchmark.compare([row], path, 0.1) == [('toeplitz', 10, 200.,
+                                                    150.)]
+    assert benchmark.compare([row], path, 0.3) == []
+    assert benchmark.compare([dict(row, n=20)], path, 0.1) == []
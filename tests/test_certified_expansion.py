@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import certified_expansion
+import utils
+from simulaqron.settings import simulaqron_settings
+
+NETWORK = {'name': 'test_cert_exp',
+           'nodes': ['Gen', 'SysA', 'SysB'],
+           'topology': {'Gen': ['SysA', 'SysB'], 'SysA': [], 'SysB': []}
+          }
+BACKEND = {'backend': 'projectq', 'noisy_qubits': False}
+
+
+def test_limit_batch_size():
+    assert utils.limit_batch_size(1) == 1
+    assert utils.limit_batch_size(simulaqron_settings.max_qubits + 1) \
+        == simulaqron_settings.max_qubits
+
+
+@pytest.mark.parametrize('batch_size', [1, 5])
+def test_batched_dispatch_measures_every_round(batch_size):
+    n_runs = 12
+    args = certified_expansion.get_parser().parse_args(
+        [str(n_runs), '0.99', '-b', str(batch_size)])
+    seed_A, seed_B = np.random.RandomState(0).randint(2, size=(2, n_runs))
+    results_A, results_B = certified_expansion.run_experiment(
+        args, dict(NETWORK), BACKEND, seed_A, seed_B)
+    for results in (results_A, results_B):
+        assert len(results) == n_runs
+        assert set(np.unique(results)) <= {0, 1}
+
+
+def test_native_simulation_violates_CHSH():
+    np.random.seed(2)
+    n_runs = 40000
+    seed_A, seed_B = np.random.randint(2, size=(2, n_runs))
+    results = np.empty((n_runs, 2), dtype=np.uint8)
+    for start, stop, outcomes in certified_expansion.simulate(
+            n_runs, seed_A, seed_B, ('X', 'Z'), ('X+Z', 'X-Z')):
+        results[start:stop] = outcomes
+    I_est = utils.estimate_CHSH(seed_A, seed_B, results[:, 0], results[:, 1])
+    assert abs(I_est) == pytest.approx(2*np.sqrt(2), abs=0.1)
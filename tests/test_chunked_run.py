@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import utils
+
+
+def test_chunks_cover_every_run(tmp_path):
+    run = utils.ChunkedRun(str(tmp_path / "out"), 10, 4)
+    assert run.chunks() == [(0, 0, 4), (1, 4, 8), (2, 8, 10)]
+    assert run.pending() == run.chunks()
+
+
+def test_resume_skips_completed_chunks(tmp_path):
+    outpath = str(tmp_path / "out")
+    run = utils.ChunkedRun(outpath, 10, 4)
+    results = np.arange(8).reshape(2, 4)
+    run.save(0, results)
+    resumed = utils.ChunkedRun(outpath, 10, 4)
+    assert resumed.completed == [0]
+    assert [chunk[0] for chunk in resumed.pending()] == [1, 2]
+    assert np.array_equal(resumed.load(0), results)
+
+
+def test_resume_rejects_different_layout(tmp_path):
+    outpath = str(tmp_path / "out")
+    utils.ChunkedRun(outpath, 10, 4)
+    with pytest.raises(ValueError):
+        utils.ChunkedRun(outpath, 10, 5)
+
+
+def test_chunked_main_resumes(tmp_path, monkeypatch):
+    import generation_polarisation
+    monkeypatch.chdir(tmp_path)
+    parser = generation_polarisation.get_parser()
+    args = parser.parse_args(['1000', '--native', '-c', '300'])
+    generation_polarisation.main(args)
+    run = utils.ChunkedRun(args.outpath, 1000, 300)
+    assert run.pending() == []
+    first = run.load(0)
+    # rerunning only reads back the completed chunks
+    generation_polarisation.main(args)
+    assert np.array_equal(utils.ChunkedRun(args.outpath, 1000, 300).load(0),
+                          first)
+
+
+def test_resumed_run_does_not_reuse_seed(tmp_path, monkeypatch):
+    import certified_expansion
+    bits = np.random.RandomState(13).randint(2, size=2000)
+    seed_path = tmp_path / "seed.txt"
+    seed_path.write_text("".join(map(str, bits)))
+    monkeypatch.chdir(tmp_path)
+    args = certified_expansion.get_parser().parse_args(
+        ['300', '0.99', '--native', '-c', '100', '-s', str(seed_path)])
+    run_experiment = certified_expansion.run_experiment
+
+    def interrupted(args, network, backend, seed_A, seed_B, profiler=None):
+        if len(utils.ChunkedRun(args.outpath, 300, 100).completed) == 1:
+            raise KeyboardInterrupt
+        return run_experiment(args, network, backend, seed_A, seed_B)
+    monkeypatch.setattr(certified_expansion, 'run_experiment', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        certified_expansion.main(args)
+    monkeypatch.setattr(certified_expansion, 'run_experiment', run_experiment)
+    certified_expansion.main(args)
+
+    run = utils.ChunkedRun(args.outpath, 300, 100)
+    seeds = [run.load(index)[:2] for index in range(3)]
+    # the interrupted chunk's seed bits are skipped, never handed out again
+    for chunk, start in zip(seeds, [0, 400, 600]):
+        assert np.array_equal(chunk, bits[start:start+200].reshape(-1, 2).T)
+
+
+def test_resumed_extraction_is_reproducible(tmp_path, monkeypatch):
+    import amplification_four_devices
+    monkeypatch.chdir(tmp_path)
+    args = amplification_four_devices.get_parser().parse_args(
+        ['250', '--native', '-c', '100', '-b', '64', '-s', 'local'])
+    amplification_four_devices.main(args)
+    first = np.load(args.outpath + "_extracted.npy")
+    assert len(first) == 4*250 // 64
+    # rerunning reads back the checkpointed weak source
+    amplification_four_devices.main(args)
+    assert np.array_equal(np.load(args.outpath + "_extracted.npy"), first)
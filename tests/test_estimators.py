@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+import utils
+
+
+def reference_CHSH(bases_A, bases_B, results_A, results_B):
+    """ The original round-by-round estimate of the CHSH correlation. """
+    I = 0
+    for i, (x, y) in enumerate(zip(bases_A, bases_B)):
+        a = results_A[i]
+        b = results_B[i]
+        I += (-1)**(x*y) * ((int(a==b) - int(a!=b)) / 0.25)
+    return I/len(bases_A)
+
+
+@pytest.fixture
+def chsh_rounds():
+    rng = np.random.RandomState(1)
+    return rng.randint(2, size=(4, 1001))
+
+
+def test_estimate_CHSH_matches_reference(chsh_rounds):
+    expected = reference_CHSH(*chsh_rounds)
+    assert utils.estimate_CHSH(*chsh_rounds) == pytest.approx(expected)
+    assert utils.estimate_CHSH(*chsh_rounds.tolist()) == pytest.approx(expected)
+
+
+def test_estimate_CHSH_extremes():
+    n = 64
+    x = np.tile([0, 0, 1, 1], n // 4)
+    y = np.tile([0, 1, 0, 1], n // 4)
+    # a = b except when both bases are 1 saturates the algebraic bound
+    a = np.zeros(n, dtype=int)
+    b = x & y
+    assert utils.estimate_CHSH(x, y, a, b) == pytest.approx(4.)
+    assert utils.estimate_CHSH(x, y, a, 1 - b) == pytest.approx(-4.)
+
+
+def test_estimate_CHSH_packed_needs_n(chsh_rounds):
+    packed = np.packbits(chsh_rounds, axis=1)
+    expected = reference_CHSH(*chsh_rounds)
+    assert utils.estimate_CHSH(*packed, packed=True, n=1001) == \
+        pytest.approx(expected)
+    with pytest.raises(ValueError):
+        utils.estimate_CHSH(*packed, packed=True)
+
+
+def test_CHSH_accumulator_chunks(chsh_rounds):
+    acc = utils.CHSHAccumulator()
+    for start in range(0, chsh_rounds.shape[1], 100):
+        acc.update(*chsh_rounds[:, start:start+100])
+    assert acc.n == chsh_rounds.shape[1]
+    assert acc.estimate == pytest.approx(reference_CHSH(*chsh_rounds))
+
+
+def reference_FPB(bases, results):
+    """ The original string-keyed estimate of the Bell inequality violation. """
+    U0 = ['[1 0 0 0]', '[0 1 0 0]', '[0 0 1 0]', '[0 0 0 1]']
+    U1 = ['[1 0 0 0]', '[0 1 0 0]', '[0 0 1 0]', '[0 0 0 1]']
+    B = 0
+    for i in range(bases.shape[1]):
+        u = str(bases[:,i])
+        x = str(results[:,i])
+        if u in U0:
+            if x in U1:
+                B += 1
+        elif u in U1:
+            if x in U0:
+                B += 1
+    return B/bases.shape[1]
+
+
+@pytest.fixture
+def fpb_rounds():
+    rng = np.random.RandomState(2)
+    # bias towards weight-one tuples so the predicate is often satisfied
+    bases = (rng.random_sample((4, 2000)) < 0.25).astype(int)
+    results = (rng.random_sample((4, 2000)) < 0.25).astype(int)
+    return bases, results
+
+
+def test_estimate_FPB_matches_reference(fpb_rounds):
+    expected = reference_FPB(*fpb_rounds)
+    assert expected > 0
+    assert utils.estimate_FPB(*fpb_rounds) == pytest.approx(expected)
+
+
+def test_FPB_accumulator_chunks(fpb_rounds):
+    bases, results = fpb_rounds
+    acc = utils.FPBAccumulator()
+    for start in range(0, bases.shape[1], 300):
+        acc.update(bases[:, start:start+300], results[:, start:start+300])
+    assert acc.n == bases.shape[1]
+    assert acc.estimate == pytest.approx(reference_FPB(bases, results))
+
+
+def test_pack_parties_leading_bit():
+    bits = np.array([[1, 0], [0, 0], [0, 1], [1, 1]])
+    assert utils.pack_parties(bits).tolist() == [0b1001, 0b0011]
@@ -0,0 +1,121 @@
+import asyncio
+from threading import Barrier
+import pytest
+import utils
+
+
+def square(x):
+    return x * x
+
+
+def count(n):
+    for i in range(n):
+        yield i
+
+
+def fail():
+    raise RuntimeError("party failed")
+
+
+def wait(barrier):
+    barrier.wait()
+
+
+def test_join_returns_results_in_order():
+    em = utils.ExperimentManager(native=True)
+    em.start([(square, [2]), (square, [3]), (count, [3])])
+    assert em.join() == [4, 9, [0, 1, 2]]
+
+
+def test_stream_yields_chunks_as_made():
+    em = utils.ExperimentManager(native=True)
+    em.start([(count, [4]), (square, [5])])
+    assert sorted(em.stream()) == [(0, 0), (0, 1), (0, 2), (0, 3)]
+    assert em.join() == [[], 25]
+
+
+def test_failed_party_cancels_the_rest():
+    em = utils.ExperimentManager(native=True)
+    barrier = Barrier(2)
+    em.start([(fail, []), (wait, [barrier])])
+    with pytest.raises(RuntimeError, match="party failed"):
+        em.join()
+    assert em.cancelled.is_set()
+    assert barrier.broken
+
+
+async def step(barrier, log, name, n_rounds):
+    for i in range(n_rounds):
+        log.append((i, name))
+        await barrier.wait()
+    return name
+
+
+async def count_async(n):
+    for i in range(n):
+        yield i
+
+
+async def fail_async():
+    raise RuntimeError("party failed")
+
+
+def test_async_parties_keep_in_step():
+    em = utils.ExperimentManager(native=True, asynchronous=True)
+    barrier = utils.AsyncBarrier(3)
+    log = []
+    em.start([(step, [barrier, log, name, 4]) for name in "abc"])
+    assert em.join() == ["a", "b", "c"]
+    # no party starts a round before every party has finished the last
+    assert [i for i, _ in log] == sorted(i for i, _ in log)
+
+
+def test_async_generator_and_failure():
+    em = utils.ExperimentManager(native=True, asynchronous=True)
+    em.start([(count_async, [3])])
+    assert em.join() == [[0, 1, 2]]
+    em = utils.ExperimentManager(native=True, asynchronous=True)
+    barrier = utils.AsyncBarrier(2)
+    em.start([(fail_async, []), (step, [barrier, [], "a", 1])])
+    with pytest.raises(RuntimeError, match="party failed"):
+        em.join()
+    assert barrier.broken
+
+
+class RecordingConnection:
+    """ Connection recording the order of CQC calls on every node. """
+    calls = []
+
+    def __init__(self, node, network_name=None):
+        self.node = node
+
+    def close(self):
+        pass
+
+    def sendQubit(self, q, target):
+        self.calls.append(('send', target))
+
+    def recvQubit(self):
+        self.calls.append(('recv', self.node))
+        return 'qubit'
+
+
+async def receiver(em, node):
+    async with utils.AsyncCQCConnection(em, node) as conn:
+        return [await conn.recvQubit() for _ in range(2)]
+
+
+async def sender(em, node, target):
+    async with utils.AsyncCQCConnection(em, node) as conn:
+        for _ in range(2):
+            await asyncio.sleep(0.01)
+            await conn.sendQubit('qubit', target)
+
+
+def test_async_receive_waits_for_send(monkeypatch):
+    monkeypatch.setattr(utils, 'CQCConnection', RecordingConnection)
+    em = utils.ExperimentManager(native=True, asynchronous=True,
+                                 max_workers=1)
+    em.start([(receiver, [em, 'Bob']), (sender, [em, 'Alice', 'Bob'])])
+    assert em.join()[0] == ['qubit', 'qubit']
+    assert RecordingConnection.calls == [('send', 'Bob'), ('recv', 'Bob')] * 2
@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+import utils
+
+
+def to_int(words):
+    """ Read a block of little-endian 64-bit words as one integer. """
+    return sum(int(w) << (64*i) for i, w in enumerate(words))
+
+
+def reference_gf2n_multiply(a, b, n):
+    """ Carry-less multiply integers and reduce modulo x^n + p(x). """
+    p = 0
+    for i in range(n):
+        if (b >> i) & 1:
+            p ^= a << i
+    modulus = (1 << n) | utils.GF2N_REDUCTION[n]
+    for i in range(2*n - 2, n - 1, -1):
+        if (p >> i) & 1:
+            p ^= modulus << (i - n)
+    return p
+
+
+@pytest.mark.parametrize('n', sorted(utils.GF2N_REDUCTION))
+def test_gf2n_multiply_matches_reference(n):
+    rng = np.random.RandomState(n)
+    a = utils.pack_words(rng.randint(2, size=3*n), n)
+    b = utils.pack_words(rng.randint(2, size=3*n), n)
+    p = utils.gf2n_multiply(a, b, n)
+    for i in range(3):
+        assert to_int(p[i]) == reference_gf2n_multiply(to_int(a[i]),
+                                                       to_int(b[i]), n)
+
+
+def test_gf2n_multiply_identity():
+    rng = np.random.RandomState(0)
+    a = utils.pack_words(rng.randint(2, size=128), 128)
+    one = utils.pack_words(np.eye(1, 128, dtype=int)[0], 128)
+    assert np.array_equal(utils.gf2n_multiply(a, one, 128), a)
+
+
+def test_gf2n_multiply_rejects_unknown_field():
+    with pytest.raises(ValueError):
+        utils.gf2n_multiply(np.zeros((1, 2)), np.zeros((1, 2)), 100)
+
+
+def test_pack_words_packed_input():
+    rng = np.random.RandomState(3)
+    bits = rng.randint(2, size=256)
+    assert np.array_equal(utils.pack_words(bits, 128),
+                          utils.pack_words(np.packbits(bits), 128, True))
+    assert np.array_equal(utils.unpack_words(utils.pack_words(bits, 128))
+                          .ravel(), bits.astype(bool))
+
+
+def test_carter_wegman_extractor_hashes_ax_plus_b():
+    rng = np.random.RandomState(4)
+    n, k, epsilon = 128, 100, 1e-3
+    source = rng.randint(2, size=n)
+    seed = rng.randint(2, size=2*n)
+    out = utils.carter_wegman_extractor(source, seed, k, epsilon)
+    m = int(k - 2*np.log2(1/epsilon))
+    f = (reference_gf2n_multiply(to_int(utils.pack_words(seed[:n], n)[0]),
+                                 to_int(utils.pack_words(source, n)[0]), n)
+         ^ to_int(utils.pack_words(seed[n:], n)[0]))
+    assert out.tolist() == [bool((f >> i) & 1) for i in range(m)]
+
+
+def test_carter_wegman_extractor_blocks_and_packed():
+    rng = np.random.RandomState(5)
+    source = rng.randint(2, size=1024)
+    seed = rng.randint(2, size=2*1024)
+    k, epsilon = 800, 1e-3
+    out = utils.carter_wegman_extractor(source, seed, k, epsilon, 256)
+    assert len(out) == 4 * int(k/4 - 2*np.log2(1/epsilon))
+    assert np.array_equal(out, utils.carter_wegman_extractor(
+        np.packbits(source), seed, k, epsilon, 256, packed=True))
+    with pytest.raises(ValueError):
+        utils.carter_wegman_extractor(source, seed[:1000], k, epsilon, 256)
+
+
+def reference_toeplitz(source, seed, m):
+    """ Multiply the source by the explicit m x n Toeplitz matrix of the seed. """
+    n = len(source)
+    T = np.array([[seed[i - j + n - 1] for j in range(n)] for i in range(m)])
+    return (T.dot(source) % 2).astype(bool)
+
+
+def test_toeplitz_extractor_matches_matrix():
+    rng = np.random.RandomState(6)
+    n, k, epsilon = 200, 150, 1e-3
+    m = int(k - 2*np.log2(1/epsilon))
+    source = rng.randint(2, size=n)
+    seed = rng.randint(2, size=n + m - 1)
+    out = utils.toeplitz_extractor(source, seed, k, epsilon)
+    assert np.array_equal(out, reference_toeplitz(source, seed, m))
+
+
+def test_toeplitz_extractor_blocks_and_packed():
+    rng = np.random.RandomState(7)
+    n, block_size, k, epsilon = 512, 128, 400, 1e-3
+    m = int(k/4 - 2*np.log2(1/epsilon))
+    source = rng.randint(2, size=n)
+    seed = rng.randint(2, size=block_size + m - 1)
+    out = utils.toeplitz_extractor(source, seed, k, epsilon, block_size)
+    expected = np.concatenate([reference_toeplitz(source[i:i+block_size],
+                                                  seed, m)
+                               for i in range(0, n, block_size)])
+    assert np.array_equal(out, expected)
+    assert np.array_equal(out, utils.toeplitz_extractor(
+        np.packbits(source), seed, k, epsilon, block_size, packed=True))
+
+
+def test_extractor_is_abstract():
+    with pytest.raises(TypeError):
+        utils.Extractor()
+
+
+@pytest.mark.parametrize('block_size', [256, None])
+@pytest.mark.parametrize('name', sorted(utils.EXTRACTORS))
+def test_extractor_interface(name, block_size):
+    rng = np.random.RandomState(8)
+    n, k, epsilon = 1000, 800, 1e-3
+    extractor = utils.EXTRACTORS[name](block_size)
+    source = rng.randint(2, size=n)
+    seed = rng.randint(2, size=extractor.seed_length(n, k, epsilon))
+    out = extractor.extract(source, seed, k, epsilon)
+    assert len(out) == extractor.output_length(n, k, epsilon)
+    assert np.array_equal(out, extractor.extract(np.packbits(source), seed, 
+                                                 k, epsilon, packed=True))
+
+
+def test_inner_product_extractor_matches_reference():
+    rng = np.random.RandomState(9)
+    x, y = rng.randint(2, size=(2, 64*10 + 5))
+    expected = [int(np.dot(x[i:i+64], y[i:i+64])) % 2
+                for i in range(0, 640, 64)]
+    assert utils.inner_product_extractor(x, y, 64, 60, 60, 1e-3).tolist() \
+        == expected
+    assert len(utils.inner_product_extractor(x[:10], y[:10], 64, 60, 60, 
+                                             1e-3)) == 0
+
+
+def test_inner_product_extractor_entropy_bound():
+    x = np.ones(64, dtype=int)
+    # 40 + 40 bits of min-entropy fall short of 64 + 2*log2(1000)
+    with pytest.raises(ValueError):
+        utils.inner_product_extractor(x, x, 64, 40, 40, 1e-3)
+
+
+def test_four_devices_extract_carries_remainder():
+    import amplification_four_devices
+    rng = np.random.RandomState(10)
+    results = rng.randint(2, size=(4, 2, 101)).astype(np.int8)
+    weak_source = rng.randint(2, size=4*101)
+    whole, (left, _) = amplification_four_devices.extract(
+        results, weak_source, 32, 30, 30, 1e-3)
+    assert len(left) == 4*101 % 32
+    extracted, carry = [], None
+    for start in range(0, 101, 25):
+        bits, carry = amplification_four_devices.extract(
+            results[:, :, start:start+25], weak_source[4*start:4*start+100],
+            32, 30, 30, 1e-3, carry=carry)
+        extracted.append(bits)
+    assert np.array_equal(np.concatenate(extracted), whole)
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+import generation_polarisation
+
+
+def test_emission_rate_and_sample_and_hold():
+    np.random.seed(4)
+    n_timesteps, p_emit = 200000, 0.05
+    emit, signal = generation_polarisation.simulate(n_timesteps, p_emit, 1)
+    assert set(np.unique(emit)) <= {0, 1}
+    assert emit.mean() == pytest.approx(p_emit, rel=0.05)
+    # the signal only changes at an emission, and holds its state before one
+    changes = np.flatnonzero(np.diff(signal)) + 1
+    assert emit[changes].all()
+    first = np.flatnonzero(emit)[0]
+    assert (signal[:first] == 1).all()
+    # photons pass the pi/4 filter with probability one half
+    assert signal[emit == 1].mean() == pytest.approx(0.5, abs=0.02)
+
+
+def test_emission_gaps_are_geometric():
+    np.random.seed(5)
+    emit, _ = generation_polarisation.simulate(100000, 0.2)
+    gaps = np.diff(np.flatnonzero(emit))
+    assert gaps.mean() == pytest.approx(1/0.2, rel=0.05)
@@ -0,0 +1,104 @@
+import json
+import pytest
+import utils
+from simulaqron.settings import simulaqron_settings
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    path = str(tmp_path / "network.json")
+    monkeypatch.setattr(simulaqron_settings, 'network_config_file', path)
+    return path
+
+
+def test_allocated_port_ranges_are_disjoint(config_file):
+    first = utils.allocate_ports('net_a', 9, 23000)
+    second = utils.allocate_ports('net_b', 9, 23000)
+    assert second >= first + 9 or first >= second + 9
+    # a network taking a new lease gives up its old one
+    assert utils.allocate_ports('net_a', 9, 23000) == first
+    utils.free_ports('net_a')
+    assert 'net_a' not in utils._read_port_leases()
+
+
+@pytest.mark.skipif(not utils.NETWORK_PORTS_SUPPORTED,
+                    reason="SimulaQron can't place networks on chosen ports")
+def test_network_config_uses_leased_ports(config_file):
+    utils.write_network_config('net', ['Alice', 'Bob'],
+                               {'Alice': ['Bob'], 'Bob': []}, 23100)
+    with open(config_file) as f:
+        nodes = json.load(f)['net']['nodes']
+    assert nodes['Bob']['app_socket'] == ["localhost", 23103]
+    assert nodes['Bob']['vnode_socket'] == ["localhost", 23105]
+
+
+class FakeNetwork:
+    def __init__(self, name):
+        self.name = name
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+def unreachable(*args, **kwargs):
+    raise ConnectionRefusedError
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(utils, 'setup_network',
+                        lambda params: FakeNetwork(params['name']))
+    monkeypatch.setattr(utils, 'stop_network', lambda network: network.stop())
+    # reusing a network must not wait on its nodes
+    monkeypatch.setattr(utils, 'CQCConnection', unreachable)
+    return utils.NetworkPool()
+
+
+PARAMS = {'name': 'test', 'nodes': ['Alice', 'Bob'], 'topology': None}
+
+
+def test_pool_reuses_idle_networks(pool):
+    network = pool.acquire(PARAMS)
+    pool.release(network)
+    assert pool.acquire(PARAMS) is network
+    # a different configuration gets a network of its own
+    assert pool.acquire(dict(PARAMS, nodes=['Alice'])) is not network
+
+
+def test_pool_discards_failed_networks(pool):
+    network = pool.acquire(PARAMS)
+    pool.release(network, reuse=False)
+    assert not network.running
+    network = pool.acquire(PARAMS)
+    pool.release(network)
+    # stopped while idle
+    network.stop()
+    assert pool.acquire(PARAMS) is not network
+    assert network not in pool.networks
+
+
+def test_experiment_reuses_network_only_after_clean_run(pool, monkeypatch):
+    monkeypatch.setattr(utils, 'setup_simQ', lambda params: None)
+    em = utils.ExperimentManager(pool=pool)
+    network = em.network
+    em.start([(lambda: 1, [])])
+    assert em.join() == [1]
+
+    em = utils.ExperimentManager(pool=pool)
+    assert em.network is network
+
+    def fail():
+        raise RuntimeError("party failed")
+    em.start([(fail, [])])
+    with pytest.raises(RuntimeError):
+        em.join()
+    assert not network.running
+    assert utils.ExperimentManager(pool=pool).network is not network
+
+
+def test_scripts_only_pool_when_asked():
+    import certified_expansion
+    parser = certified_expansion.get_parser()
+    assert not parser.parse_args(['10', '0.99']).pool
+    assert parser.parse_args(['10', '0.99', '--pool']).pool
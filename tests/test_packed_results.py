@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import utils
+
+
+@pytest.fixture
+def results():
+    rng = np.random.RandomState(11)
+    results = rng.randint(2, size=(4, 2, 1003)).astype(np.int8)
+    results[:, :, 17] = -1
+    results[2, 1, 500] = -1
+    return results
+
+
+def test_round_trip(results, tmp_path):
+    packed = utils.PackedResults.from_array(results, {'fields': 'test'})
+    assert packed.n == 1003
+    assert np.array_equal(packed.to_array(), np.where(
+        (results >= 0).all(axis=(0, 1)), results, -1))
+    path = str(tmp_path / "packed.npz")
+    packed.save(path)
+    loaded = utils.PackedResults.load(path)
+    assert loaded.metadata == {'fields': 'test'}
+    assert np.array_equal(loaded.to_array(), packed.to_array())
+
+
+def test_packed_CHSH_matches_unpacked(results):
+    rounds = results[:, 0, :]
+    valid = (rounds >= 0).all(axis=0)
+    packed = utils.PackedResults.from_array(rounds)
+    acc = utils.CHSHAccumulator()
+    acc.update(*[packed.field(i) for i in range(4)], packed=True,
+               mask=packed.mask)
+    assert acc.n == np.count_nonzero(valid)
+    assert acc.estimate == pytest.approx(
+        utils.estimate_CHSH(*rounds[:, valid]))
+
+
+def test_packed_FPB_matches_unpacked(results):
+    valid = (results >= 0).all(axis=(0, 1))
+    packed = utils.PackedResults.from_array(results)
+    acc = utils.FPBAccumulator()
+    acc.update_packed([packed.field((p, 0)) for p in range(4)],
+                      [packed.field((p, 1)) for p in range(4)], packed.mask)
+    assert acc.n == np.count_nonzero(valid)
+    assert acc.estimate == pytest.approx(
+        utils.estimate_FPB(results[:, 0, valid], results[:, 1, valid]))
+
+
+def test_packed_chunks(results, tmp_path):
+    chunk = results[:, :, :500]
+    run = utils.ChunkedRun(str(tmp_path / "out"), 1003, 500, packed=True)
+    run.save(0, chunk)
+    assert np.array_equal(run.load(0), np.where(
+        (chunk >= 0).all(axis=(0, 1)), chunk, -1))
+    assert isinstance(run.load(0, unpack=False), utils.PackedResults)
@@ -0,0 +1,70 @@
+import json
+from threading import Barrier, Thread
+import pytest
+import utils
+from cqc.pythonLib import qubit
+
+
+class FakeQubit:
+    """ Stand-in qubit, change_basis only calls its gates. """
+    def I(self):
+        pass
+
+    def H(self):
+        pass
+
+
+def rotate(n):
+    for _ in range(n):
+        utils.change_basis(FakeQubit(), 'X')
+
+
+def meet(barrier):
+    barrier.wait()
+
+
+def fail():
+    raise RuntimeError("party failed")
+
+
+def test_profile_records_own_parties_only(tmp_path):
+    original = utils.change_basis
+    profiler = utils.Profiler()
+    em = utils.ExperimentManager(native=True, profiler=profiler)
+    barrier = Barrier(2)
+    em.start([(rotate, [3]), (meet, [barrier]), (meet, [barrier])])
+    # calls from outside the experiment go unrecorded
+    outsider = Thread(target=rotate, args=(5,))
+    outsider.start()
+    outsider.join()
+    em.join()
+    counts = {(row['party'], row['operation']): row['count']
+              for row in profiler.summary()}
+    assert counts[('rotate[0]', 'change_basis')] == 3
+    assert counts[('meet[1]', 'barrier.wait')] == 1
+    assert ('main', 'change_basis') not in counts
+    # calls are unwrapped again once the experiment joins
+    assert utils.change_basis is original
+    profiler.save(str(tmp_path / "prof"))
+    with open(str(tmp_path / "prof_profile.json")) as f:
+        summary = json.load(f)['summary']
+    assert all(isinstance(row['count'], int) for row in summary)
+
+
+def test_failed_experiment_uninstalls():
+    original = qubit.measure
+    em = utils.ExperimentManager(native=True, profiler=utils.Profiler())
+    em.start([(fail, [])])
+    with pytest.raises(RuntimeError):
+        em.join()
+    assert qubit.measure is original
+
+
+def test_profilers_nest():
+    original = utils.change_basis
+    with utils.Profiler() as outer:
+        with utils.Profiler():
+            assert utils.change_basis is not original
+        assert utils.change_basis is not original
+    assert utils.change_basis is original
+    assert not outer.installed
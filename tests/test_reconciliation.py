@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+import reconciliation
+
+
+def noisy_keys(n, qber, seed):
+    rng = np.random.default_rng(seed)
+    alice_key = rng.integers(0, 2, n).astype(np.uint8)
+    bob_key = alice_key ^ (rng.random(n) < qber).astype(np.uint8)
+    return (alice_key, bob_key)
+
+
+@pytest.mark.parametrize("n,block_size", [(64, 8), (100, 7), (5, 16)])
+def test_block_parities_match_reference(n, block_size):
+    key, _ = noisy_keys(n, 0, n)
+    reference = [key[i:i+block_size].sum() & 1 
+                 for i in range(0, n, block_size)]
+    assert reconciliation.block_parities(key, block_size).tolist() \
+        == reference
+
+
+def test_prefix_parities_give_range_parities():
+    key, _ = noisy_keys(50, 0, 1)
+    prefix = reconciliation.prefix_parities(key)
+    for lo, hi in [(0, 50), (3, 17), (20, 21), (8, 8)]:
+        assert prefix[hi] ^ prefix[lo] == key[lo:hi].sum() & 1
+
+
+@pytest.mark.parametrize("qber", [0.01, 0.03, 0.08])
+def test_cascade_agrees_keys(qber):
+    alice_key, bob_key = noisy_keys(20000, qber, 2)
+    cascade = reconciliation.Cascade(seed=3)
+    corrected, n_leaked, n_messages = cascade.reconcile(alice_key, bob_key,
+                                                        qber)
+    assert np.array_equal(corrected, alice_key)
+    n_errors = np.count_nonzero(alice_key != bob_key)
+    # at least a parity per error, but well short of the whole key
+    assert n_errors < n_leaked < len(alice_key) / 2
+    assert n_messages > 1
+
+
+def test_cascade_counts_parities_of_one_search():
+    alice_key, _ = noisy_keys(64, 0, 4)
+    bob_key = alice_key.copy()
+    bob_key[37] ^= 1
+    cascade = reconciliation.Cascade(n_passes=1, block_size=8)
+    corrected, n_leaked, n_messages = cascade.reconcile(alice_key, bob_key)
+    assert np.array_equal(corrected, alice_key)
+    # eight block parities, then three halvings of the odd block
+    assert n_leaked == 8 + 3
+    assert n_messages == 1 + 3
+
+
+def test_cascade_leaves_agreeing_keys_alone():
+    alice_key, _ = noisy_keys(1000, 0, 5)
+    corrected, n_leaked, _ = reconciliation.Cascade(block_size=100).reconcile(
+        alice_key, alice_key.copy())
+    assert np.array_equal(corrected, alice_key)
+    assert n_leaked == 10 + 5 + 3 + 2
+
+
+def test_sparse_parity_matrix_syndrome_matches_dense():
+    matrix = reconciliation.SparseParityMatrix(30, 100, seed=6)
+    dense = np.zeros((matrix.n_rows, matrix.n_cols), dtype=np.uint8)
+    dense[matrix.edge_rows, matrix.indices] = 1
+    assert np.all(dense.sum(axis=0) <= reconciliation.LDPC_COLUMN_WEIGHT)
+    words = np.stack(noisy_keys(100, 0.5, 7))
+    assert np.array_equal(matrix.syndrome(words), (words @ dense.T) & 1)
+
+
+@pytest.mark.parametrize("n,qber", [(20000, 0.03), (3000, 0.01)])
+def test_ldpc_agrees_keys(n, qber):
+    alice_key, bob_key = noisy_keys(n, qber, 8)
+    ldpc = reconciliation.LDPC(block_size=1 << 12, seed=9)
+    corrected, n_leaked, n_messages = ldpc.reconcile(alice_key, bob_key, qber)
+    assert np.array_equal(corrected, alice_key)
+    assert ldpc.n_failed == 0
+    assert n_messages == 1
+    # the syndrome of each block is rounded up to a whole bit
+    n_blocks = -(-n // (1 << 12))
+    assert n_leaked == pytest.approx(
+        (1 - reconciliation.ldpc_rate(qber)) * n, abs=n_blocks)
+
+
+def test_ldpc_short_last_block_leaks_only_its_own_syndrome():
+    alice_key, bob_key = noisy_keys(4096 + 100, 0.01, 10)
+    ldpc = reconciliation.LDPC(block_size=4096, seed=11)
+    corrected, n_leaked, _ = ldpc.reconcile(alice_key, bob_key, 0.01)
+    assert np.array_equal(corrected, alice_key)
+    rate = reconciliation.ldpc_rate(0.01)
+    assert n_leaked == np.ceil((1 - rate) * 4096) + np.ceil((1 - rate) * 100)
+
+
+def test_ldpc_reports_blocks_failing_to_decode():
+    alice_key, bob_key = noisy_keys(4000, 0.1, 12)
+    ldpc = reconciliation.LDPC(block_size=1000, rate=0.95, n_iterations=5)
+    corrected, _, _ = ldpc.reconcile(alice_key, bob_key, 0.1)
+    assert ldpc.n_failed == 4
+    # failed blocks are left as they were
+    assert np.array_equal(corrected, bob_key)
@@ -0,0 +1,94 @@
+import os
+import numpy as np
+import pytest
+import utils
+
+
+@pytest.fixture
+def bits():
+    return np.random.RandomState(12).randint(2, size=1000).astype(np.uint8)
+
+
+@pytest.fixture
+def ascii_seed(tmp_path, bits):
+    path = tmp_path / "seed.txt"
+    path.write_text("".join(map(str, bits)) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def binary_seed(tmp_path, bits):
+    path = tmp_path / "seed.bin"
+    path.write_bytes(np.packbits(bits).tobytes())
+    return str(path)
+
+
+@pytest.mark.parametrize('seed_file', ['ascii_seed', 'binary_seed'])
+def test_seed_source_reads_bits(seed_file, bits, request):
+    source = utils.SeedSource(request.getfixturevalue(seed_file))
+    assert source.n_bits == 1000
+    assert np.array_equal(source.read(10, 20), bits[10:30])
+    assert len(source.read(990, 20)) == 10
+    view_A, view_B = source.take(100, 2)
+    assert np.array_equal(np.asarray(view_A), bits[0:200:2])
+    assert np.array_equal(np.asarray(view_B), bits[1:200:2])
+    assert view_B[3] == bits[7]
+    assert np.array_equal(np.asarray(view_A[10:20:3]), bits[20:40:6])
+    assert source.consumed == 200
+    with pytest.raises(ValueError):
+        source.take(801)
+
+
+def test_seed_source_rejects_corrupt_file(tmp_path):
+    path = tmp_path / "seed.txt"
+    path.write_text("0110x01\n")
+    source = utils.SeedSource(str(path))
+    assert source.read(0, 4).tolist() == [0, 1, 1, 0]
+    with pytest.raises(ValueError, match="character 4"):
+        source.read(0, 7)
+
+
+def test_seed_pool_cursor_follows_file_not_path(ascii_seed, bits,
+                                                monkeypatch):
+    cursor = ascii_seed + ".cursor"
+    with utils.SeedPool(utils.SeedSource(ascii_seed), 64, cursor) as pool:
+        first, = pool.take(100)
+    assert np.array_equal(first, bits[:100])
+    # reopen the same file through a relative path
+    monkeypatch.chdir(os.path.dirname(ascii_seed))
+    with utils.open_seed(os.path.basename(ascii_seed), cursor) as pool:
+        second, = pool.take(100)
+    assert np.array_equal(second, bits[100:200])
+
+
+def test_seed_pool_context_stops_prefetching(ascii_seed):
+    with utils.SeedPool(utils.SeedSource(ascii_seed), 64) as pool:
+        pool.take(10)
+        assert pool._thread.is_alive()
+    assert not pool._thread.is_alive()
+    with utils.open_seed(ascii_seed) as source:
+        source.take(10)
+    assert source.data is None
+
+
+@pytest.mark.parametrize('prefetch', [True, False])
+def test_seed_pool_hands_out_disjoint_bits(ascii_seed, bits, prefetch):
+    pool = utils.SeedPool(utils.SeedSource(ascii_seed), 64, prefetch=prefetch)
+    seed_A, seed_B = pool.take(150, 2)
+    assert np.array_equal(seed_A, bits[0:300:2])
+    assert np.array_equal(seed_B, bits[1:300:2])
+    rest, = pool.take(700)
+    assert np.array_equal(rest, bits[300:])
+    assert pool.cursor == 1000
+    with pytest.raises(ValueError):
+        pool.take(1)
+    pool.close()
+
+
+def test_seed_pool_rejects_other_source_cursor(ascii_seed, binary_seed):
+    cursor = ascii_seed + ".cursor"
+    pool = utils.SeedPool(utils.SeedSource(ascii_seed), cursor_path=cursor)
+    pool.take(10)
+    pool.close()
+    with pytest.raises(ValueError):
+        utils.SeedPool(utils.SeedSource(binary_seed), cursor_path=cursor)
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import statevector
+
+
+def test_apply_gate_matches_kronecker_product():
+    rng = np.random.RandomState(0)
+    states = rng.randn(5, 8) + 1j*rng.randn(5, 8)
+    for target in range(3):
+        ops = [statevector.I] * 3
+        ops[target] = statevector.H
+        full = np.kron(np.kron(ops[0], ops[1]), ops[2])
+        assert np.allclose(statevector.apply_gate(states, statevector.H, target),
+                           states @ full.T)
+
+
+def test_apply_gate_per_round():
+    states = statevector.zero_state(1, 2)
+    gates = np.stack([statevector.I, statevector.X])
+    assert np.allclose(statevector.apply_gate(states, gates, 0),
+                       [[1, 0], [0, 1]])
+
+
+def test_cnot_prepares_epr_pair():
+    state = statevector.apply_gate(statevector.zero_state(2), statevector.H, 0)
+    assert np.allclose(statevector.cnot(state, 0, 1), statevector.epr_pairs(1))
+
+
+def test_basis_rotations():
+    rotations = statevector.basis_rotations(('X', 'Z'))
+    assert np.allclose(rotations[np.array([1, 0])],
+                       [statevector.I, statevector.H])
+    for basis in statevector.BASES.values():
+        assert np.allclose(basis.conj().T @ basis, np.eye(2))
+    with pytest.raises(ValueError):
+        statevector.basis_rotations(('Y',))
+
+
+def test_measure_samples_born_rule():
+    np.random.seed(1)
+    states = np.tile([np.sqrt(0.2), 0, 0, np.sqrt(0.8)], (20000, 1))
+    outcomes = statevector.measure(states)
+    # only |00> and |11> occur, |11> with probability 0.8
+    assert np.array_equal(outcomes[:, 0], outcomes[:, 1])
+    assert outcomes[:, 0].mean() == pytest.approx(0.8, abs=0.02)
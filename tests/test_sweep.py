@@ -0,0 +1,28 @@
+import csv
+import utils
+
+
+def test_read_sweep_skips_comments(tmp_path):
+    import sweep
+    path = tmp_path / "sweep.txt"
+    path.write_text("# native runs\n100 0.99 --native -s local\n\n"
+                    "200 0.99 --native -s 'local'\n")
+    assert sweep.read_sweep(str(path)) == [
+        ['100', '0.99', '--native', '-s', 'local'],
+        ['200', '0.99', '--native', '-s', 'local']]
+
+
+def test_run_sweep_collects_every_configuration(tmp_path):
+    argvs = [['100', '0.99', '--native', '-s', 'local'],
+             ['2000', '0.99', '--native', '-s', 'local']]
+    rows = utils.run_sweep('certified_expansion', argvs, n_workers=2,
+                           outdir=str(tmp_path))
+    assert [row['n_runs'] for row in rows] == [100, 2000]
+    assert all(abs(row['I_est']) <= 4 for row in rows)
+    # the results of each configuration are stored in outdir
+    assert (tmp_path / "certified_expansion_0001.npy").exists()
+    table = str(tmp_path / "sweep.csv")
+    utils.write_table(rows, table)
+    with open(table, newline='') as f:
+        read = list(csv.DictReader(f))
+    assert [int(row['n_runs']) for row in read] == [100, 2000]